@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Measures how long the album library takes to regroup songs after they
+got edited, like when changing the album tag of many songs at once.
+
+For each number of edited songs this measures `SongLibrary.changed` with an
+`AlbumLibrary` listening, once only changing a tag which keeps the songs in
+their album and once moving them to a new one. The time should grow with
+the number of edited songs and not with the size of the library:
+
+    ./bench_mass_edit.py --songs 20000
+    ./bench_mass_edit.py --songs 200000
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import synthlib
+from synthlib import generate_from_args
+
+from quodlibet import config  # noqa
+from quodlibet.library import SongLibrary  # noqa
+from quodlibet.library.libraries import AlbumLibrary  # noqa
+
+
+def edit(library, songs, tag, value):
+    for song in songs:
+        song[tag] = value
+    start = time.perf_counter()
+    library.changed(songs)
+    return time.perf_counter() - start
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0])
+    synthlib.add_arguments(parser, songs=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("edited", nargs="*", type=int,
+                        default=[1, 100, 1000, 5000])
+    args = parser.parse_args(argv[1:])
+
+    config.init()
+    songs = generate_from_args(args)
+    library = SongLibrary()
+    library.add(songs)
+    albums = AlbumLibrary(library)
+
+    results = []
+    for count in args.edited:
+        edited = songs[:count]
+        retag = move = float("inf")
+        for i in range(args.repeat):
+            retag = min(retag, edit(library, edited, "comment", str(i)))
+            move = min(move, edit(library, edited, "album", "moved %d" % i))
+        result = {
+            "songs": len(library),
+            "albums": len(albums),
+            "edited": len(edited),
+            "retag": retag,
+            "move": move,
+        }
+        results.append(result)
+        print("%(edited)6d of %(songs)d songs: retag %(retag).4fs, "
+              "move %(move).4fs" % result, file=sys.stderr)
+
+    albums.destroy()
+    library.destroy()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Measures the memory needed for a loaded library.
+
+Compares loading a pickled library with and without sharing equal keys
+and values between songs (see `load_audio_files`). Each load happens in a
+fresh process and reports the memory in use by the loaded songs, the peak
+while loading and the total resident memory.
+
+    ./bench_memory.py 200000
+"""
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from synthlib import generate_songs
+
+from quodlibet.formats import load_audio_files, dump_audio_files  # noqa
+from quodlibet.util.picklehelper import pickle_loads, pickle_dumps  # noqa
+
+from bench_storage import get_rss  # noqa
+
+
+def unshare(songs):
+    """Returns copies of the songs not sharing any keys or values, like
+    songs which got read from files one by one.
+    """
+
+    return [pickle_loads(pickle_dumps(song, 2)) for song in songs]
+
+
+def measure_load(filename, share):
+    with open(filename, "rb") as h:
+        data = h.read()
+    start = time.perf_counter()
+    items = load_audio_files(data, share=share)
+    duration = time.perf_counter() - start
+
+    # freed memory doesn't get returned to the OS, so the resident memory
+    # only shows the peak. Count the memory still in use instead.
+    del items
+    tracemalloc.start()
+    items = load_audio_files(data, share=share)
+    del data
+    gc.collect()
+    memory, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"load": duration, "memory": memory, "peak": peak,
+            "rss": get_rss(), "loaded": len(items)}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sizes", type=int, nargs="*", default=[200000])
+    parser.add_argument("--load", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv[1:])
+
+    if args.load:
+        filename, share = args.load
+        print(json.dumps(measure_load(filename, share == "share")))
+        return
+
+    results = []
+    for count in args.sizes:
+        dir_ = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(dir_, "songs")
+            with open(filename, "wb") as h:
+                h.write(dump_audio_files(unshare(generate_songs(count))))
+
+            for mode in ["plain", "share"]:
+                output = subprocess.check_output(
+                    [sys.executable, os.path.abspath(__file__),
+                     "--load", filename, mode])
+                result = {"songs": count, "mode": mode}
+                result.update(json.loads(output.decode("utf-8")))
+                results.append(result)
+                print("%(mode)-5s %(songs)8d songs: load %(load).2fs, "
+                      "in use %(memory).1f MiB, peak %(peak).1f MiB, "
+                      "RSS %(rss).1f MiB" % dict(
+                          result, memory=result["memory"] / 2 ** 20,
+                          peak=result["peak"] / 2 ** 20,
+                          rss=result["rss"] / 2 ** 20),
+                      file=sys.stderr)
+        finally:
+            shutil.rmtree(dir_)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Compares matching queries node by node with compiled queries.
+
+For each query this measures how many songs per second get matched by the
+parsed query (`Node.filter`) and by the compiled one (`Query.filter`).
+
+    ./bench_query.py --songs 50000
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from synthlib import generate_songs
+
+from quodlibet import config  # noqa
+from quodlibet.query import Query  # noqa
+
+
+QUERIES = [
+    "love",
+    "dream night",
+    u"caf\xe9 !blue",
+    "artist=fire",
+    'genre="Jazz"',
+    "artist,album=|(moon, wolf)",
+    "~filename=/flac$/",
+    "#(playcount > 100)",
+    "#(added < 5 years)",
+    "#(length / 60 > 4)",
+    "&(genre=rock, #(rating >= 0.8), !title=love)",
+    "|(&(artist=ghost, #(playcount > 10)), &(album=moon, date=19))",
+]
+
+
+def measure(func, songs, repeat):
+    best = float("inf")
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func(songs)
+        best = min(best, time.perf_counter() - start)
+    return best, len(result)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--songs", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("queries", nargs="*", default=QUERIES)
+    args = parser.parse_args(argv[1:])
+
+    config.init()
+    songs = generate_songs(args.songs)
+
+    results = []
+    for text in args.queries:
+        query = Query(text)
+        start = time.perf_counter()
+        query.filter
+        compile_time = time.perf_counter() - start
+
+        nodes, count = measure(query._match.filter, songs, args.repeat)
+        compiled, count2 = measure(query.filter, songs, args.repeat)
+        assert count == count2
+
+        result = {
+            "query": text,
+            "songs": len(songs),
+            "matches": count,
+            "nodes": len(songs) / nodes,
+            "compiled": len(songs) / compiled,
+            "speedup": nodes / compiled,
+            "compile_time": compile_time,
+        }
+        results.append(result)
+        print("%(query)-45s %(nodes)10.0f -> %(compiled)10.0f songs/s "
+              "(%(speedup).2fx)" % result, file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
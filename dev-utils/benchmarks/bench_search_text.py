@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Measures searching for text with and without the folded search text of
+each song (the "search_text_index" option, see `SearchTextIndex`).
+
+For each query this measures how many songs per second `SongLibrary.query`
+searches, once matching every song and once only matching the songs whose
+folded text contains the search terms.
+
+    ./bench_search_text.py --songs 200000
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from synthlib import generate_songs
+
+from quodlibet import config  # noqa
+from quodlibet.library import SongLibrary  # noqa
+
+
+QUERIES = [
+    "love",
+    "dream night",
+    "ghost wolf moon",
+    u"caf\xe9 blue",
+    "cafe",
+    "uber",
+    "rock",
+    "nothing matches this",
+    "artist=echo",
+    "&(title=river, album=stone)",
+]
+
+
+def measure(library, text, repeat):
+    best = float("inf")
+    for i in range(repeat):
+        library._last_query = None
+        start = time.perf_counter()
+        result = library.query(text)
+        best = min(best, time.perf_counter() - start)
+    return best, len(result)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--songs", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("queries", nargs="*", default=QUERIES)
+    args = parser.parse_args(argv[1:])
+
+    config.init()
+    library = SongLibrary()
+    library.add(generate_songs(args.songs))
+
+    start = time.perf_counter()
+    library.get_text_index()
+    build_time = time.perf_counter() - start
+    print("building the index took %.3fs" % build_time, file=sys.stderr)
+
+    results = []
+    for text in args.queries:
+        config.set("library", "search_text_index", "false")
+        index, library._text_index = library._text_index, None
+        full, count = measure(library, text, args.repeat)
+        config.set("library", "search_text_index", "true")
+        library._text_index = index
+        indexed, count2 = measure(library, text, args.repeat)
+        assert count == count2
+
+        result = {
+            "query": text,
+            "songs": len(library),
+            "matches": count,
+            "full": len(library) / full,
+            "indexed": len(library) / indexed,
+            "speedup": full / indexed,
+            "build_time": build_time,
+        }
+        results.append(result)
+        print("%(query)-30s %(matches)7d matches %(full)10.0f -> "
+              "%(indexed)10.0f songs/s (%(speedup).2fx)" % result,
+              file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
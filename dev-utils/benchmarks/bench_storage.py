@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Compares the library storage formats.
+
+For each library size and format this measures the time for a full save,
+the time for saving a few changed songs, and the time and resident memory
+needed for loading the library in a fresh process.
+
+    ./bench_storage.py 10000 100000 500000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from synthlib import generate_songs
+
+from quodlibet.library.storage import PickleStorage, SQLiteStorage  # noqa
+
+
+STORAGES = {
+    "pickle": (PickleStorage, u"songs"),
+    "sqlite": (SQLiteStorage, u"songs.sqlite"),
+}
+
+
+def get_rss():
+    """Resident memory of this process in bytes"""
+
+    try:
+        with open("/proc/self/statm", "rb") as h:
+            return int(h.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except EnvironmentError:
+        import resource
+        # in KiB on Linux, bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure_load(name, filename):
+    storage = STORAGES[name][0](filename)
+    rss = get_rss()
+    start = time.perf_counter()
+    items = storage.load()
+    duration = time.perf_counter() - start
+    return {"load": duration, "load_rss": get_rss() - rss,
+            "loaded": len(items)}
+
+
+def run(name, count, songs, dir_):
+    type_, basename = STORAGES[name]
+    filename = os.path.join(dir_, basename)
+    storage = type_(filename)
+
+    start = time.perf_counter()
+    storage.write(songs)
+    result = {"storage": name, "songs": count,
+              "save": time.perf_counter() - start}
+
+    changed = songs[:100]
+    for song in changed:
+        song["~#playcount"] = song.get("~#playcount", 0) + 1
+    start = time.perf_counter()
+    storage.update([], changed)
+    result["update_100"] = time.perf_counter() - start
+    storage.close()
+    result["size"] = sum(
+        os.path.getsize(os.path.join(dir_, e)) for e in os.listdir(dir_))
+
+    # load in a new process, so the memory usage isn't skewed
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), "--load", name, filename])
+    result.update(json.loads(output.decode("utf-8")))
+    return result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sizes", type=int, nargs="*",
+                        default=[10000, 100000, 500000])
+    parser.add_argument("--storage", action="append",
+                        choices=sorted(STORAGES))
+    parser.add_argument("--load", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv[1:])
+
+    if args.load:
+        print(json.dumps(measure_load(*args.load)))
+        return
+
+    results = []
+    for count in args.sizes:
+        songs = generate_songs(count)
+        for name in (args.storage or sorted(STORAGES)):
+            dir_ = tempfile.mkdtemp()
+            try:
+                result = run(name, count, songs, dir_)
+            finally:
+                shutil.rmtree(dir_)
+            results.append(result)
+            print("%(storage)-7s %(songs)8d songs: save %(save).2fs, "
+                  "update 100 %(update_100).3fs, load %(load).2fs, "
+                  "load RSS %(load_rss)d MiB, %(size)d MiB on disk" % dict(
+                      result, load_rss=result["load_rss"] // 2 ** 20,
+                      size=result["size"] // 2 ** 20), file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Runs a set of benchmarks of the core library code, without Gtk.
+
+Each benchmark runs on the same synthetic library and measures the best of
+`--repeat` runs of one operation: parsing and searching queries, sorting
+like the song list does, formatting patterns, (un)pickling the library and
+sorting songs into albums.
+
+The results (and the commit they were measured on) get written as JSON,
+so two commits can be compared:
+
+    ./bench_suite.py --songs 50000 -o before.json
+    git checkout other-branch
+    ./bench_suite.py --songs 50000 -o after.json --compare before.json
+
+With --profile all benchmarks run under cProfile and the stats get saved
+for inspecting them with pstats or snakeviz.
+"""
+
+import argparse
+import cProfile
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import synthlib
+from synthlib import generate_from_args
+
+from quodlibet import config  # noqa
+from quodlibet.formats import AudioFile, load_audio_files  # noqa
+from quodlibet.formats import dump_audio_files  # noqa
+from quodlibet.library import SongLibrary  # noqa
+from quodlibet.library.libraries import AlbumLibrary  # noqa
+from quodlibet.pattern import Pattern, XMLFromMarkupPattern  # noqa
+from quodlibet.pattern import forget_formatted  # noqa
+from quodlibet.query import Query  # noqa
+
+
+QUERIES = [
+    "love",
+    "dream night",
+    u"caf\xe9 !blue",
+    "artist=fire",
+    "~filename=/flac$/",
+    "#(playcount > 100)",
+    "#(added < 5 years)",
+    "&(genre=rock, #(rating >= 0.8), !title=love)",
+    "|(&(artist=ghost, #(playcount > 10)), &(album=moon, date=19))",
+]
+
+SORT_TAGS = [
+    "",
+    "title",
+    "artist",
+    "album",
+    "~#length",
+    "~#playcount",
+    "~people",
+    "~filename",
+    "<artist> - <title>",
+]
+
+PATTERNS = [
+    (Pattern, "<artist> - <title>"),
+    (Pattern, "<tracknumber|<tracknumber>. ><~title~version>"),
+    (Pattern, "<~people> - <album|<album>|n/a> <~basename>"),
+    (XMLFromMarkupPattern,
+     "[b]<title>[/b] <~#length> <date| (<date>)>\n[small]<~people>[/small]"),
+]
+
+ALBUM_TAGS = ["~#rating", "~#playcount", "~length", "~people", "date",
+              "~#tracks", "genre"]
+
+
+def forget_cached(songs):
+    """Drops everything songs remember, so the first use is measured"""
+
+    for song in songs:
+        song.__dict__.clear()
+    forget_formatted()
+
+
+def best_of(repeat, func, setup=None):
+    """Returns the fastest of `repeat` runs of func() and its result"""
+
+    best = float("inf")
+    result = None
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_query(songs, repeat):
+    results = []
+    for text in QUERIES:
+        parse, query = best_of(repeat, lambda: Query(text))
+        compile_ = best_of(repeat, lambda: Query(text).search)[0]
+        filter_, matches = best_of(repeat, lambda: query.filter(songs))
+        results.append({
+            "case": text,
+            "time": filter_,
+            "parse": parse,
+            "compile": compile_,
+            "matches": len(matches),
+        })
+    return results
+
+
+def bench_sort(songs, repeat):
+    """Sorts by the default sort key and then by a column, like the
+    song list does when clicking on a column header"""
+
+    results = []
+    for tag in SORT_TAGS:
+        if "<" in tag:
+            key_func = AudioFile.sort_by_func(Pattern(tag).format)
+        elif tag:
+            key_func = AudioFile.sort_by_func(tag)
+        else:
+            key_func = None
+
+        def sort():
+            result = sorted(songs, key=lambda s: s.sort_key)
+            if key_func is not None:
+                result.sort(key=key_func)
+            return result
+
+        cold = best_of(repeat, sort, lambda: forget_cached(songs))[0]
+        warm = best_of(repeat, sort)[0]
+        results.append({"case": tag or "default", "time": cold,
+                        "warm": warm})
+    return results
+
+
+def bench_pattern(songs, repeat):
+    results = []
+    for kind, text in PATTERNS:
+        pattern = kind(text)
+        cold = best_of(repeat, lambda: list(map(pattern.format, songs)),
+                       lambda: forget_cached(songs))[0]
+        warm = best_of(repeat, lambda: list(map(pattern.format, songs)))[0]
+        results.append({"case": text, "time": cold, "warm": warm})
+    forget_formatted()
+    return results
+
+
+def bench_serialize(songs, repeat):
+    dump, data = best_of(repeat, lambda: dump_audio_files(songs))
+    load, loaded = best_of(repeat, lambda: load_audio_files(data))
+    assert len(loaded) == len(songs)
+    return [
+        {"case": "dump_audio_files", "time": dump, "bytes": len(data)},
+        {"case": "load_audio_files", "time": load},
+    ]
+
+
+def bench_albums(songs, repeat):
+    library = SongLibrary()
+    library.add(songs)
+
+    def create():
+        albums = AlbumLibrary(library)
+        albums.destroy()
+
+    create_ = best_of(repeat, create, lambda: forget_cached(songs))[0]
+    albums = AlbumLibrary(library)
+
+    def aggregate():
+        for album in albums.values():
+            album.finalize()
+            for tag in ALBUM_TAGS:
+                album(tag)
+
+    aggregate_ = best_of(repeat, aggregate)[0]
+
+    changed = songs[::max(1, len(songs) // 100)]
+
+    def change():
+        for song in changed:
+            song["~#playcount"] = song.get("~#playcount", 0) + 1
+        library.changed(changed)
+
+    change_ = best_of(repeat, change)[0]
+
+    changed_albums = {albums[song.album_key] for song in changed}
+
+    def change_aggregate():
+        change()
+        for album in changed_albums:
+            for tag in ALBUM_TAGS:
+                album(tag)
+
+    change_aggregate_ = best_of(repeat, change_aggregate)[0]
+    albums.destroy()
+    library.destroy()
+    return [
+        {"case": "create", "time": create_, "albums": len(albums)},
+        {"case": "aggregate", "time": aggregate_},
+        {"case": "change %d songs" % len(changed), "time": change_},
+        {"case": "change %d songs, aggregate" % len(changed),
+         "time": change_aggregate_},
+    ]
+
+
+BENCHMARKS = {
+    "query": bench_query,
+    "sort": bench_sort,
+    "pattern": bench_pattern,
+    "serialize": bench_serialize,
+    "albums": bench_albums,
+}
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=synthlib.ROOT, stderr=subprocess.DEVNULL,
+            universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(data, old):
+    """Prints how much faster each result got compared to an older run"""
+
+    if old["songs"] != data["songs"]:
+        print("warning: comparing %d songs to %d songs" % (
+            data["songs"], old["songs"]), file=sys.stderr)
+    results = data["results"]
+    old_times = {(r["benchmark"], r["case"]): r["time"]
+                 for r in old["results"]}
+    print("compared to %s:" % old.get("commit"), file=sys.stderr)
+    for result in results:
+        key = (result["benchmark"], result["case"])
+        if key in old_times:
+            print("  %-10s %-50.50s %8.4fs -> %8.4fs (%.2fx)" % (
+                key[0], key[1].replace("\n", " "), old_times[key],
+                result["time"], old_times[key] / result["time"]),
+                file=sys.stderr)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0])
+    synthlib.add_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("-o", "--output", help="write the results to a file "
+                        "instead of stdout")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="the results of an earlier run")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="save cProfile stats to a file")
+    parser.add_argument("benchmarks", nargs="*", default=list(BENCHMARKS),
+                        help="which ones to run: %s" % ", ".join(BENCHMARKS))
+    args = parser.parse_args(argv[1:])
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: %s" % name)
+
+    config.init()
+    songs = generate_from_args(args)
+
+    profile = cProfile.Profile() if args.profile else None
+    results = []
+    for name in args.benchmarks:
+        if profile:
+            profile.enable()
+        for result in BENCHMARKS[name](songs, args.repeat):
+            result["benchmark"] = name
+            results.append(result)
+            print("%-10s %-50.50s %8.4fs" % (
+                name, result["case"].replace("\n", " "), result["time"]),
+                file=sys.stderr)
+        if profile:
+            profile.disable()
+
+    if profile:
+        profile.dump_stats(args.profile)
+
+    data = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "songs": len(songs),
+        "args": vars(args),
+        "results": results,
+    }
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as h:
+            compare(data, json.load(h))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as h:
+            json.dump(data, h, indent=2)
+    else:
+        print(json.dumps(data, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Measures the latency of searching the library while typing a query.
+
+Each query gets typed one character at a time and the library searched after
+every keystroke, once searching all songs every time and once refining the
+previous result where possible (`SongLibrary.query`).
+
+    ./bench_typeahead.py --songs 100000
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from synthlib import generate_songs
+
+from quodlibet import config  # noqa
+from quodlibet.library import SongLibrary  # noqa
+
+
+QUERIES = [
+    "dream night",
+    "summer city ocean",
+    u"caf\xe9 blue",
+    "artist=ghost",
+    "&(genre=rock, #(playcount > 10), ri",
+]
+
+
+def type_query(library, text, refine):
+    """Returns the time each keystroke took"""
+
+    times = []
+    for i in range(1, len(text) + 1):
+        if not refine:
+            library._last_query = None
+        start = time.perf_counter()
+        library.query(text[:i])
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--songs", type=int, default=100000)
+    parser.add_argument("queries", nargs="*", default=QUERIES)
+    args = parser.parse_args(argv[1:])
+
+    config.init()
+    library = SongLibrary()
+    library.add(generate_songs(args.songs))
+
+    results = []
+    for text in args.queries:
+        full = type_query(library, text, False)
+        refined = type_query(library, text, True)
+        result = {
+            "query": text,
+            "songs": len(library),
+            "full": full,
+            "refined": refined,
+            "full_total": sum(full),
+            "refined_total": sum(refined),
+            "full_max": max(full),
+            "refined_max": max(refined),
+        }
+        results.append(result)
+        print("%(query)-40s total %(full_total).3fs -> %(refined_total).3fs, "
+              "worst keystroke %(full_max).3fs -> %(refined_max).3fs"
+              % result, file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
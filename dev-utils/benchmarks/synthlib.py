@@ -0,0 +1,129 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Generates synthetic libraries for benchmarking.
+
+Importing this sets up enough of quodlibet to use it without Gtk.
+"""
+
+import os
+import random
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, ROOT)
+
+import quodlibet  # noqa
+quodlibet.init_cli(no_translations=True)
+
+from quodlibet.formats import AudioFile  # noqa
+from senf import fsnative  # noqa
+
+
+GENRES = ["Rock", "Pop", "Jazz", "Classical", "Electronic", "Hip-Hop",
+          "Folk", "Metal", "Blues", "Ambient", "Soundtrack", "Country"]
+
+WORDS = ["love", "night", "blue", "fire", "dream", "heart", "road", "sky",
+         "time", "rain", "light", "dance", "river", "stone", "gold", "ghost",
+         "summer", "city", "ocean", "wolf", "mirror", "echo", "paper", "moon",
+         u"caf\xe9", u"\xfcber", u"na\xefve", u"日本", u"d\xe9j\xe0"]
+
+
+def _words(rand, count):
+    return " ".join(rand.choice(WORDS) for i in range(count)).capitalize()
+
+
+def generate_songs(count, seed=0, tracks_per_album=12, albums_per_artist=4,
+                   extra_tags=True):
+    """Returns a list of `count` AudioFiles with realistic looking tags.
+
+    Args:
+        count (int): number of songs
+        seed (int): the same seed gives the same library
+        tracks_per_album (int): average number of tracks in an album
+        albums_per_artist (int): average number of albums of an artist
+        extra_tags (bool): add comments, MusicBrainz IDs, replaygain etc.
+    """
+
+    rand = random.Random(seed)
+    num_albums = max(1, count // tracks_per_album)
+    num_artists = max(1, num_albums // albums_per_artist)
+    artists = [_words(rand, 2) for i in range(num_artists)]
+
+    albums = []
+    for i in range(num_albums):
+        artist = rand.choice(artists)
+        albums.append({
+            "album": _words(rand, rand.randint(1, 4)),
+            "artist": artist,
+            "albumartist": artist,
+            "date": str(rand.randint(1950, 2020)),
+            "genre": rand.choice(GENRES),
+            "musicbrainz_albumid": "%032x" % rand.getrandbits(128),
+        })
+
+    songs = []
+    for i in range(count):
+        album_index = i // tracks_per_album % num_albums
+        album = albums[album_index]
+        track = i % tracks_per_album + 1
+        song = AudioFile()
+        song.update(album)
+        filename = os.path.join(
+            fsnative(u"/music"), album["artist"], album["album"],
+            u"%02d - %d.flac" % (track, i))
+        song["~filename"] = fsnative(filename)
+        song["~mountpoint"] = fsnative(u"/")
+        song["title"] = _words(rand, rand.randint(1, 5))
+        song["tracknumber"] = "%d/%d" % (track, tracks_per_album)
+        song["~#length"] = rand.randint(60, 600)
+        song["~#added"] = rand.randint(1200000000, 1600000000)
+        song["~#mtime"] = song["~#added"] + rand.randint(0, 10000)
+        song["~#filesize"] = song["~#length"] * rand.randint(20000, 120000)
+        song["~#bitrate"] = rand.choice([128, 192, 256, 320, 900])
+        song["~format"] = "FLAC"
+        if rand.random() < 0.5:
+            song["~#playcount"] = rand.randint(1, 200)
+            song["~#lastplayed"] = song["~#added"] + rand.randint(0, 10 ** 7)
+        if rand.random() < 0.3:
+            song["~#rating"] = rand.choice([0.2, 0.4, 0.6, 0.8, 1.0])
+        if rand.random() < 0.2:
+            song["composer"] = rand.choice(artists)
+        if extra_tags:
+            song["musicbrainz_trackid"] = "%032x" % rand.getrandbits(128)
+            song["replaygain_track_gain"] = "%.2f dB" % rand.uniform(-12, 3)
+            song["replaygain_track_peak"] = "%.6f" % rand.random()
+            song["encoder"] = "libFLAC 1.3.%d" % rand.randint(0, 3)
+            if rand.random() < 0.3:
+                song["comment"] = _words(rand, rand.randint(3, 20))
+            if rand.random() < 0.05:
+                song["lyrics"] = "\n".join(
+                    _words(rand, 6) for j in range(rand.randint(10, 40)))
+        songs.append(song)
+    return songs
+
+
+def add_arguments(parser, songs=10000):
+    """Adds options for the size and tag distribution of the generated
+    library to an `argparse.ArgumentParser`
+    """
+
+    group = parser.add_argument_group("library")
+    group.add_argument("--songs", type=int, default=songs,
+                       help="number of songs (default: %(default)s)")
+    group.add_argument("--seed", type=int, default=0)
+    group.add_argument("--tracks-per-album", type=int, default=12)
+    group.add_argument("--albums-per-artist", type=int, default=4)
+    group.add_argument("--no-extra-tags", dest="extra_tags",
+                       action="store_false",
+                       help="leave out comments, MusicBrainz IDs etc.")
+
+
+def generate_from_args(args):
+    """Like generate_songs(), with the options from add_arguments()"""
+
+    return generate_songs(
+        args.songs, seed=args.seed, tracks_per_album=args.tracks_per_album,
+        albums_per_artist=args.albums_per_artist, extra_tags=args.extra_tags)
@@ -140,6 +140,7 @@ class Browser(Gtk.Box, Filter):
     __gsignals__ = {
         'songs-selected':
         (GObject.SignalFlags.RUN_LAST, None, (object, object)),
+        'songs-added': (GObject.SignalFlags.RUN_LAST, None, (object,)),
         'songs-activated': (GObject.SignalFlags.RUN_LAST, None, ()),
         'uri-received': (GObject.SignalFlags.RUN_LAST, None, (str,))
     }
@@ -161,15 +162,49 @@ class Browser(Gtk.Box, Filter):
     uses_main_library = True
     """Whether the browser has the main library as source"""
 
-    def songs_selected(self, songs, is_sorted=False):
+    completes_added = False
+    """True while songs-selected gets emitted for the songs already passed
+    by the previous songs-selected and the following songs-added signals,
+    so anything handling songs-added can ignore it.
+    """
+
+    partial = False
+    """True while songs-selected gets emitted for only the first songs,
+    the others following through songs-added.
+    """
+
+    def songs_selected(self, songs, is_sorted=False, completes_added=False,
+                       partial=False):
         """Emits the songs-selected signal.
 
         If is_sorted is True the songs will be put as is in the song list.
         In case it's False the songs will be sorted by the song list depending
         on its current sort configuration.
+
+        If completes_added is True the songs are all the ones passed to the
+        last songs_selected() and the following songs_added() calls, see
+        `completes_added`. If partial is True more songs will follow
+        through songs_added(), see `partial`.
+        """
+
+        self.completes_added = completes_added
+        self.partial = partial
+        try:
+            self.emit("songs-selected", songs, is_sorted)
+        finally:
+            self.completes_added = False
+            self.partial = False
+
+    def songs_added(self, songs):
+        """Emits the songs-added signal.
+
+        Adds songs to the ones passed to the last songs_selected() call,
+        e.g. while more of them are still being searched for. Once all are
+        added songs_selected() has to be called with all of them and
+        completes_added set, for everything only handling songs-selected.
         """
 
-        self.emit("songs-selected", songs, is_sorted)
+        self.emit("songs-added", songs)
 
     def songs_activated(self):
         """Call after calling songs_selected() to activate the songs
@@ -40,8 +40,10 @@ from quodlibet.qltk.x import SymbolicIconImage
 from quodlibet.qltk.searchbar import SearchBarBox
 from quodlibet.qltk.menubutton import MenuButton
 from quodlibet.qltk import Icons
-from quodlibet.util import copool, connect_destroy, cmp
+from quodlibet.util import connect_destroy, cmp
+from quodlibet.util.collection import precompute
 from quodlibet.util.library import background_filter
+from quodlibet.util.thread import AsyncFilter, AsyncQueue
 from quodlibet.util import connect_obj, DeferredSignal
 from quodlibet.qltk.cover import get_no_cover_pixbuf
 from quodlibet.qltk.image import add_border_widget, get_surface_for_pixbuf
@@ -214,19 +216,38 @@ def compare_avgplaycount(a1, a2):
             cmp(a1.key, a2.key))
 
 
+# The album values the sort functions compare which aren't cached
+# attributes of the album
+SORT_KEYS = {
+    compare_date: ["album", "date"],
+    compare_rating: ["album", "~#rating", "date"],
+    compare_avgplaycount: ["album", "~#playcount:avg", "date"],
+}
+
+
+def precompute_sort_keys(model, keys):
+    """Computes the values compared when sorting all albums in the model
+    up front, instead of one by one while comparing"""
+
+    if keys:
+        precompute((i.album for i in model.itervalues()
+                    if i.album is not None), keys)
+
+
 class PreferencesButton(Gtk.HBox):
     def __init__(self, browser, model):
         super().__init__()
 
         sort_orders = [
-            (_("_Title"), self.__compare_title),
-            (_("_Artist"), self.__compare_artist),
-            (_("_Date"), self.__compare_date),
-            (_("_Date Added"), self.__compare_date_added),
-            (_("_Original Date"), self.__compare_original_date),
-            (_("_Genre"), self.__compare_genre),
-            (_("_Rating"), self.__compare_rating),
-            (_("_Playcount"), self.__compare_avgplaycount),
+            (_("_Title"), self.__compare_title, None),
+            (_("_Artist"), self.__compare_artist, None),
+            (_("_Date"), self.__compare_date, compare_date),
+            (_("_Date Added"), self.__compare_date_added, None),
+            (_("_Original Date"), self.__compare_original_date, None),
+            (_("_Genre"), self.__compare_genre, None),
+            (_("_Rating"), self.__compare_rating, compare_rating),
+            (_("_Playcount"), self.__compare_avgplaycount,
+             compare_avgplaycount),
         ]
 
         menu = Gtk.Menu()
@@ -238,16 +259,18 @@ class PreferencesButton(Gtk.HBox):
         active = config.getint('browsers', 'album_sort', 1)
 
         item = None
-        for i, (label, func) in enumerate(sort_orders):
+        for i, (label, func, compare) in enumerate(sort_orders):
             item = RadioMenuItem(group=item, label=label,
                                  use_underline=True)
             model.set_sort_func(100 + i, func)
+            keys = SORT_KEYS.get(compare, [])
             if i == active:
+                precompute_sort_keys(model, keys)
                 model.set_sort_column_id(100 + i, Gtk.SortType.ASCENDING)
                 item.set_active(True)
             item.connect("toggled",
                          util.DeferredSignal(self.__sort_toggled_cb),
-                         model, i)
+                         model, i, keys)
             sort_menu.append(item)
 
         sort_item.set_submenu(sort_menu)
@@ -265,9 +288,10 @@ class PreferencesButton(Gtk.HBox):
         button.set_menu(menu)
         self.pack_start(button, True, True, 0)
 
-    def __sort_toggled_cb(self, item, model, num):
+    def __sort_toggled_cb(self, item, model, num, keys):
         if item.get_active():
             config.set("browsers", "album_sort", str(num))
+            precompute_sort_keys(model, keys)
             model.set_sort_column_id(100 + num, Gtk.SortType.ASCENDING)
 
     def __compare_title(self, model, i1, i2, data):
@@ -315,62 +339,74 @@ class VisibleUpdate:
         connect_destroy(
             sw.get_vadjustment(), "value-changed", self.__stop_update, view)
 
-        self.__pending_paths = []
+        self.__queue = AsyncQueue(done=self._rows_updated)
+        self.__cancel = Gio.Cancellable()
+        self.__background_cancel = Gio.Cancellable()
         self.__update_deferred = DeferredSignal(
             self.__update_visible_rows, timeout=50, priority=GLib.PRIORITY_LOW)
         self.__column = column
-        self.__first_expose = True
 
     def disable_row_update(self):
         if self.__update_deferred:
-            self.__update_deferred.abort
+            self.__update_deferred.abort()
             self.__update_deferred = None
 
-        if self.__pending_paths:
-            copool.remove(self.__scan_paths)
-
+        self.__cancel.cancel()
+        self.__background_cancel.cancel()
+        self.__queue.destroy()
         self.__column = None
-        self.__pending_paths = []
 
     def _row_needs_update(self, model, iter_):
         """Should return True if the rows should be updated"""
 
         raise NotImplementedError
 
-    def _update_row(self, model, iter_):
-        """Do whatever is needed to update the row."""
+    def _get_row_update(self, model, iter_):
+        """Should return (function, args, callback) for updating the row.
+
+        `function(*args)` gets called in a thread and `callback(result)` in
+        the main loop, unless the row got scrolled out of view before.
+        """
 
         raise NotImplementedError
 
+    def _rows_updated(self):
+        """Gets called after a batch of rows got updated"""
+
+        pass
+
+    def update_all_rows(self, model):
+        """Updates all rows of `model` in the background, while no visible
+        rows need an update.
+        """
+
+        self.__background_cancel.cancel()
+        self.__background_cancel = cancel = Gio.Cancellable()
+        for iter_, value in model.iterrows():
+            if self._row_needs_update(model, iter_):
+                self.__queue_update(model, iter_, cancel, True)
+
+    def stop_all_rows_update(self):
+        """Stops what update_all_rows() started"""
+
+        self.__background_cancel.cancel()
+
+    def __queue_update(self, model, iter_, cancellable, background=False):
+        function, args, callback = self._get_row_update(model, iter_)
+        self.__queue.put(model.get_value(iter_), function, args, callback,
+                         cancellable, background)
+
     def __stop_update(self, adj, view):
-        if self.__pending_paths:
-            copool.remove(self.__scan_paths)
-            self.__pending_paths = []
-            self.__update_visibility(view)
+        # rows which scroll out of view don't need to be updated,
+        # the visible ones get queued again once drawn
+        self.__cancel.cancel()
 
     def __update_visibility(self, view, *args):
         if not self.__column.get_visible():
             return
 
-        # update all visible rows on first expose event
-        if self.__first_expose:
-            self.__first_expose = False
-            self.__update_visible_rows(view, 0)
-            for i in self.__scan_paths():
-                pass
-
         self.__update_deferred(view, self.PRELOAD_COUNT)
 
-    def __scan_paths(self):
-        while self.__pending_paths:
-            model, path = self.__pending_paths.pop()
-            try:
-                iter_ = model.get_iter(path)
-            except ValueError:
-                continue
-            self._update_row(model, iter_)
-            yield True
-
     def __update_visible_rows(self, view, preload):
         vrange = view.get_visible_range()
         if vrange is None:
@@ -404,18 +440,21 @@ class VisibleUpdate:
 
         vlist_new = map(Gtk.TreePath, vlist_new)
 
-        visible_paths = []
+        visible_iters = []
         for path in vlist_new:
             try:
                 iter_ = model.get_iter(path)
             except ValueError:
                 continue
             if self._row_needs_update(model, iter_):
-                visible_paths.append((model, path))
+                visible_iters.append(iter_)
 
-        if not self.__pending_paths and visible_paths:
-            copool.add(self.__scan_paths)
-        self.__pending_paths = visible_paths
+        # rows not visible anymore get skipped
+        self.__cancel.cancel()
+        self.__cancel = cancel = Gio.Cancellable()
+        # the ones queued last get updated first
+        for iter_ in reversed(visible_iters):
+            self.__queue_update(model, iter_, cancel)
 
 
 class AlbumList(Browser, util.InstanceTracker, VisibleUpdate,
@@ -489,7 +528,7 @@ class AlbumList(Browser, util.InstanceTracker, VisibleUpdate,
         if self.__model is None:
             self._init_model(library)
 
-        self._cover_cancel = Gio.Cancellable()
+        self.__album_filter = AsyncFilter()
 
         sw = ScrolledWindow()
         sw.set_shadow_type(Gtk.ShadowType.IN)
@@ -633,26 +672,27 @@ class AlbumList(Browser, util.InstanceTracker, VisibleUpdate,
         item = model.get_value(iter_)
         return item.album is not None and not item.scanned
 
-    def _update_row(self, filter_model, iter_):
+    def _get_row_update(self, filter_model, iter_):
         sort_model = filter_model.get_model()
         model = sort_model.get_model()
         iter_ = filter_model.convert_iter_to_child_iter(iter_)
         iter_ = sort_model.convert_iter_to_child_iter(iter_)
         tref = Gtk.TreeRowReference.new(model, model.get_path(iter_))
 
-        def callback():
+        item = model.get_value(iter_)
+        scale_factor = self.get_scale_factor()
+        function, args, set_cover = item.get_cover_update(scale_factor)
+
+        def callback(cover):
+            set_cover(cover)
             path = tref.get_path()
             if path is not None:
-                model.row_changed(path, model.get_iter(path))
+                model.path_changed(path)
 
-        item = model.get_value(iter_)
-        scale_factor = self.get_scale_factor()
-        item.scan_cover(scale_factor=scale_factor,
-                        callback=callback,
-                        cancel=self._cover_cancel)
+        return function, args, callback
 
     def __destroy(self, browser):
-        self._cover_cancel.cancel()
+        self.__album_filter.cancel()
         self.disable_row_update()
 
         self.view.set_model(None)
@@ -661,13 +701,37 @@ class AlbumList(Browser, util.InstanceTracker, VisibleUpdate,
         if not klass.instances():
             klass._destroy_model()
 
-    def __update_filter(self, entry, text, scroll_up=True, restore=False):
+    def __update_filter(self, entry, text, scroll_up=True, restore=False,
+                        sync=False):
+        query = self.__search.get_query(star=["~people", "album"])
+        if query.matches_all:
+            self.__album_filter.cancel()
+            self.__set_filter(None, None, scroll_up, restore)
+            return
+
+        # search in the background while typing, keeping the old
+        # filter until done
+        albums = [item.album for item in self.__model.itervalues()
+                  if item.album is not None]
+        matches = []
+
+        def found(albums, done):
+            matches.extend(albums)
+            if done:
+                self.__set_filter(
+                    query.search, set(matches), scroll_up, restore)
+
+        # albums update their caches while searched and their songs change
+        # while scanning, so stay in the main thread
+        self.__album_filter.filter(
+            query.search, albums, found, sync=sync or restore, thread=False)
+
+    def __set_filter(self, search, matches, scroll_up, restore):
         model = self.view.get_model()
 
-        self.__filter = None
-        query = self.__search.get_query(star=["~people", "album"])
-        if not query.matches_all:
-            self.__filter = query.search
+        # refilter using the search result, albums changing later
+        # get searched again
+        self.__filter = search if matches is None else matches.__contains__
         self.__bg_filter = background_filter()
 
         self.__inhibit()
@@ -680,10 +744,11 @@ class AlbumList(Browser, util.InstanceTracker, VisibleUpdate,
             self.view.scroll_to_point(0, 0)
 
         # Don't filter on restore if there is nothing to filter
-        if not restore or self.__filter or self.__bg_filter:
+        if not restore or search or self.__bg_filter:
             model.refilter()
 
         self.__uninhibit()
+        self.__filter = search
 
     def __parse_query(self, model, iter_, data):
         f, b = self.__filter, self.__bg_filter
@@ -790,7 +855,7 @@ class AlbumList(Browser, util.InstanceTracker, VisibleUpdate,
     def filter_text(self, text):
         self.__search.set_text(text)
         if Query(text).is_parsable:
-            self.__update_filter(self.__search, text)
+            self.__update_filter(self.__search, text, sync=True)
             self.__inhibit()
             self.view.set_cursor((0,))
             self.__uninhibit()
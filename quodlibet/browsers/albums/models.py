@@ -27,20 +27,19 @@ class AlbumItem:
             size = 48
         return size
 
-    def scan_cover(self, force=False, scale_factor=1,
-            callback=None, cancel=None):
-        if (self.scanned and not force) or not self.album or \
-                not self.album.songs:
-            return
-        self.scanned = True
-
-        def set_cover_cb(pixbuf):
-            self.cover = pixbuf
-            callback()
+    def get_cover_update(self, scale_factor=1):
+        """Returns (function, args, callback) for loading the cover in a
+        thread and setting it, see VisibleUpdate._get_row_update()
+        """
 
         s = self.COVER_SIZE * scale_factor
-        app.cover_manager.get_pixbuf_many_async(
-            self.album.songs, s, s, cancel, set_cover_cb)
+        songs = list(self.album.songs)
+
+        def set_cover(pixbuf):
+            self.cover = pixbuf
+            self.scanned = True
+
+        return app.cover_manager.get_pixbuf_many, (songs, s, s), set_cover
 
     def __repr__(self):
         return repr(self.album)
@@ -12,13 +12,15 @@ from __future__ import absolute_import
 
 import os
 
-from gi.repository import Gtk, Pango, Gdk, Gio
+from gi.repository import Gtk, Pango, Gdk
 
 from .prefs import Preferences, DEFAULT_PATTERN_TEXT
 from quodlibet.browsers.albums.models import (AlbumModel,
     AlbumFilterModel, AlbumSortModel)
 from quodlibet.browsers.albums.main import (get_cover_size,
     AlbumTagCompletion, PreferencesButton as AlbumPreferencesButton, VisibleUpdate)
+from quodlibet.browsers.albums.main import (compare_date, compare_rating,
+    SORT_KEYS, precompute_sort_keys)
 
 import quodlibet
 from quodlibet import app
@@ -40,6 +42,7 @@ from quodlibet.qltk.menubutton import MenuButton
 from quodlibet.qltk import Icons
 from quodlibet.util import connect_destroy
 from quodlibet.util.library import background_filter
+from quodlibet.util.thread import AsyncFilter
 from quodlibet.util import connect_obj
 from quodlibet.qltk.cover import get_no_cover_pixbuf
 from quodlibet.qltk.image import add_border_widget, get_surface_for_pixbuf
@@ -51,11 +54,11 @@ class PreferencesButton(AlbumPreferencesButton):
         Gtk.HBox.__init__(self)
 
         sort_orders = [
-            (_("_Title"), self.__compare_title),
-            (_("_Artist"), self.__compare_artist),
-            (_("_Date"), self.__compare_date),
-            (_("_Genre"), self.__compare_genre),
-            (_("_Rating"), self.__compare_rating),
+            (_("_Title"), self.__compare_title, None),
+            (_("_Artist"), self.__compare_artist, None),
+            (_("_Date"), self.__compare_date, compare_date),
+            (_("_Genre"), self.__compare_genre, None),
+            (_("_Rating"), self.__compare_rating, compare_rating),
         ]
 
         menu = Gtk.Menu()
@@ -67,16 +70,18 @@ class PreferencesButton(AlbumPreferencesButton):
         active = config.getint('browsers', 'album_sort', 1)
 
         item = None
-        for i, (label, func) in enumerate(sort_orders):
+        for i, (label, func, compare) in enumerate(sort_orders):
             item = RadioMenuItem(group=item, label=label,
                                  use_underline=True)
             model.set_sort_func(100 + i, func)
+            keys = SORT_KEYS.get(compare, [])
             if i == active:
+                precompute_sort_keys(model, keys)
                 model.set_sort_column_id(100 + i, Gtk.SortType.ASCENDING)
                 item.set_active(True)
             item.connect("toggled",
                          util.DeferredSignal(self.__sort_toggled_cb),
-                         model, i)
+                         model, i, keys)
             sort_menu.append(item)
 
         sort_item.set_submenu(sort_menu)
@@ -185,6 +190,7 @@ class CoverGrid(Browser, util.InstanceTracker, VisibleUpdate,
             if album is not None:
                 item.scanned = False
                 model.row_changed(model.get_path(iter_), iter_)
+        self.preload_covers()
 
     @classmethod
     def _init_model(klass, library):
@@ -221,7 +227,7 @@ class CoverGrid(Browser, util.InstanceTracker, VisibleUpdate,
         if self.__model is None:
             self._init_model(library)
 
-        self._cover_cancel = Gio.Cancellable()
+        self.__album_filter = AsyncFilter()
 
         self.scrollwin = sw = ScrolledWindow()
         sw.set_shadow_type(Gtk.ShadowType.IN)
@@ -334,7 +340,8 @@ class CoverGrid(Browser, util.InstanceTracker, VisibleUpdate,
 
         self.enable_row_update(view, sw, self.view)
 
-        self.__update_filter()
+        self.__update_filter(sync=True)
+        self.preload_covers()
 
         self.connect('key-press-event', self.__key_pressed, library.librarian)
 
@@ -375,7 +382,7 @@ class CoverGrid(Browser, util.InstanceTracker, VisibleUpdate,
         item = model.get_value(iter_)
         return item.album is not None and not item.scanned
 
-    def _update_row(self, filter_model, iter_):
+    def _get_row_update(self, filter_model, iter_):
         sort_model = filter_model.get_model()
         model = sort_model.get_model()
         iter_ = filter_model.convert_iter_to_child_iter(iter_)
@@ -383,21 +390,34 @@ class CoverGrid(Browser, util.InstanceTracker, VisibleUpdate,
         tref = Gtk.TreeRowReference.new(model, model.get_path(iter_))
         mag = config.getfloat("browsers", "covergrid_magnification", 3.)
 
-        def callback():
+        item = model.get_value(iter_)
+        scale_factor = self.get_scale_factor() * mag
+        function, args, set_cover = item.get_cover_update(scale_factor)
+
+        def callback(cover):
+            set_cover(cover)
             path = tref.get_path()
             if path is not None:
-                model.row_changed(path, model.get_iter(path))
-            # XXX: icon view seems to ignore row_changed signals for pixbufs..
-            self.queue_draw()
+                model.path_changed(path)
 
-        item = model.get_value(iter_)
-        scale_factor = self.get_scale_factor() * mag
-        item.scan_cover(scale_factor=scale_factor,
-                        callback=callback,
-                        cancel=self._cover_cancel)
+        return function, args, callback
+
+    def _rows_updated(self):
+        # XXX: icon view seems to ignore row_changed signals for pixbufs..
+        self.queue_draw()
+
+    def preload_covers(self):
+        """Loads the covers of all shown albums in the background,
+        if enabled.
+        """
+
+        if config.getboolean("browsers", "covergrid_preload"):
+            self.update_all_rows(self.view.get_model())
+        else:
+            self.stop_all_rows_update()
 
     def __destroy(self, browser):
-        self._cover_cancel.cancel()
+        self.__album_filter.cancel()
         self.disable_row_update()
 
         self.view.set_model(None)
@@ -407,13 +427,35 @@ class CoverGrid(Browser, util.InstanceTracker, VisibleUpdate,
             klass._destroy_model()
 
     def __update_filter(self, entry=None, text=None, scroll_up=True,
-                        restore=False):
+                        restore=False, sync=False):
+        query = self.__search.get_query(self.STAR)
+        if query.matches_all:
+            self.__album_filter.cancel()
+            self.__set_filter(None, None, restore)
+            return
+
+        # search in the background while typing, keeping the old
+        # filter until done
+        albums = [item.album for item in self.__model.itervalues()
+                  if item.album is not None]
+        matches = []
+
+        def found(albums, done):
+            matches.extend(albums)
+            if done:
+                self.__set_filter(query.search, set(matches), restore)
+
+        # albums update their caches while searched and their songs change
+        # while scanning, so stay in the main thread
+        self.__album_filter.filter(
+            query.search, albums, found, sync=sync or restore, thread=False)
+
+    def __set_filter(self, search, matches, restore):
         model = self.view.get_model()
 
-        self.__filter = None
-        query = self.__search.get_query(self.STAR)
-        if not query.matches_all:
-            self.__filter = query.search
+        # refilter using the search result, albums changing later
+        # get searched again
+        self.__filter = search if matches is None else matches.__contains__
         self.__bg_filter = background_filter()
 
         self.__inhibit()
@@ -422,11 +464,12 @@ class CoverGrid(Browser, util.InstanceTracker, VisibleUpdate,
         # be something to filter ­— probably there's a better
         # way to implement this
 
-        if (not restore or self.__filter or self.__bg_filter) or (not
+        if (not restore or search or self.__bg_filter) or (not
             config.getboolean("browsers", "covergrid_all", True)):
             model.refilter()
 
         self.__uninhibit()
+        self.__filter = search
 
     def __parse_query(self, model, iter_, data):
         f, b = self.__filter, self.__bg_filter
@@ -564,7 +607,7 @@ class CoverGrid(Browser, util.InstanceTracker, VisibleUpdate,
     def filter_text(self, text):
         self.__search.set_text(text)
         if Query(text).is_parsable:
-            self.__update_filter(self.__search, text)
+            self.__update_filter(self.__search, text, sync=True)
             # self.__inhibit()
             #self.view.set_cursor((0,), None, False)
             # self.__uninhibit()
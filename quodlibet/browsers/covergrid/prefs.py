@@ -86,6 +86,13 @@ class Preferences(qltk.UniqueWindow, EditDisplayPatternMixin):
                    lambda s: browser.toggle_wide())
         vbox.pack_start(cb3, False, True, 0)
 
+        cb4 = ConfigCheckButton(
+            _("_Load all covers in the background"), "browsers",
+            "covergrid_preload")
+        cb4.set_active(config.getboolean("browsers", "covergrid_preload"))
+        cb4.connect('toggled', lambda s: browser.preload_covers())
+        vbox.pack_start(cb4, False, True, 0)
+
         # Redraws the covers only when the user releases the slider
         def mag_button_press(*_):
             self.mag_lock = True
@@ -20,6 +20,8 @@ from quodlibet.qltk.searchbar import MultiSearchBarBox
 from quodlibet.qltk.songlist import SongList
 from quodlibet.qltk.x import SymbolicIconImage
 from quodlibet.qltk import Icons
+from quodlibet.util import connect_destroy
+from quodlibet.util.thread import AsyncFilter
 
 
 class PreferencesButton(Gtk.HBox):
@@ -69,6 +71,13 @@ class TrackList(Browser):
 
         self._query = None
         self._library = library
+        # the last query and all songs it matched
+        self._last_query = None
+        self._last_songs = None
+        self._searched_query = None
+        self._filter = AsyncFilter()
+        for signal in ['added', 'changed', 'removed']:
+            connect_destroy(library, signal, self.__forget_songs)
 
         completion = LibraryTagCompletion(library.librarian)
         self.accelerators = Gtk.AccelGroup()
@@ -99,20 +108,57 @@ class TrackList(Browser):
         self._sb_box.set_text(text)
 
     def __destroy(self, *args):
+        self._filter.cancel()
         self._sb_box = None
 
     def __focus(self, widget, *args):
         qltk.get_top_parent(widget).songlist.grab_focus()
 
-    def _get_songs(self):
-        self._query = self._sb_box.get_query(SongList.star)
-        return self._query.filter(self._library) if self._query else None
+    def __forget_songs(self, library, songs):
+        self._last_query = None
+        self._last_songs = None
+        self._searched_query = None
 
     def activate(self):
-        songs = self._get_songs()
-        if songs is not None:
-            songs = self._sb_box.limit(songs)
-            GLib.idle_add(self.songs_selected, songs)
+        self._query = query = self._sb_box.get_query(SongList.star)
+        if not query:
+            return
+
+        # when narrowing down the search, only look at what matched before
+        last = self._last_query
+        if last is not None and query.is_refinement_of(last):
+            songs = self._last_songs
+            search = query.search
+        else:
+            library = self._library
+            songs, search = query.narrow(
+                library.values(), library.get_index, library.get_text_index,
+                library.get_columns)
+
+        # limiting needs all songs, otherwise show them as they are found
+        stream = not self._sb_box.limited
+        matches = []
+        self._searched_query = query
+
+        def found(songs, done):
+            if stream and matches:
+                GLib.idle_add(self.songs_added, songs)
+                if done:
+                    GLib.idle_add(
+                        self.songs_selected, matches + songs, False, True)
+            elif stream:
+                GLib.idle_add(
+                    self.songs_selected, list(songs), False, False, not done)
+            elif done:
+                GLib.idle_add(
+                    self.songs_selected, self._sb_box.limit(matches + songs))
+            matches.extend(songs)
+            # don't keep results from before the library changed
+            if done and self._searched_query is query:
+                self._last_query = query
+                self._last_songs = matches
+
+        self._filter.filter(search, songs, found)
 
     def __text_parse(self, bar, text):
         self.activate()
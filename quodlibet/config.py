@@ -47,6 +47,30 @@ INITIAL: Dict[str, Dict[str, str]] = {
     "library": {
         "exclude": "",
         "refresh_on_start": "true",
+
+        # how to store the library: "pickle" or "sqlite"
+        "storage": "pickle",
+
+        # only load commonly used tags at startup and the rest on demand
+        # (only with the sqlite storage)
+        "lazy_tags": "false",
+
+        # number of threads reading tags of new files, 0 for one per CPU
+        "scan_workers": "0",
+
+        # tags for which an index of their values gets kept in memory, to
+        # speed up listing values and searching
+        "indexed_tags": "genre,artist,albumartist,album,~people,"
+                        "~#added,~#lastplayed,~#playcount,~#rating",
+
+        # keep the folded text of all tags of each song in memory, to
+        # speed up searching for text (not with "lazy_tags"). Needs about
+        # as much memory again as the tags themselves.
+        "search_text_index": "false",
+
+        # keep the values of numeric tags of all songs in arrays, to
+        # compare them for all songs at once when searching (needs NumPy)
+        "numeric_columns": "true",
     },
 
     # State about the player, to restore on startup
@@ -157,6 +181,10 @@ INITIAL: Dict[str, Dict[str, str]] = {
 
         # show "all albums" in covergrid view
         "covergrid_all": "1",
+
+        # load the covers of all albums in covergrid view in the background,
+        # not only the ones scrolled to
+        "covergrid_preload": "0",
     },
 
     # Kind of a dumping ground right now, should probably be
@@ -277,6 +305,10 @@ INITIAL: Dict[str, Dict[str, str]] = {
         "force_filename": "false",
         "filename": "folder.jpg",
         "search_filenames": "cover.jpg,folder.jpg,.folder.jpg",
+
+        # how many MB the covers scaled for the album list and cover grid
+        # can take up on disk, 0 to not keep them
+        "thumbnail_cache_size": "100",
     },
 
     "display": {
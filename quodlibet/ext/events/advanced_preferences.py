@@ -95,7 +95,7 @@ class AdvancedPreferences(EventPlugin):
         vb = Gtk.VBox(spacing=12)
 
         # Tabulate all settings for neatness
-        table = Gtk.Table(n_rows=14, n_columns=4)
+        table = Gtk.Table(n_rows=17, n_columns=4)
         table.set_col_spacings(12)
         table.set_row_spacings(6)
         # We don't use translations as these things are internal
@@ -157,7 +157,23 @@ class AdvancedPreferences(EventPlugin):
             boolean_config(
                 "settings", "plugins_window_on_top",
                 "Plugin window on top: ",
-                "Toggles whether the plugin window appears on top of others")
+                "Toggles whether the plugin window appears on top of others"),
+            text_config(
+                "library", "storage",
+                "Library storage:",
+                ("How the library is stored, either \"pickle\" or \"sqlite\". "
+                 "Switching to sqlite migrates the existing library once "
+                 "(restart required)")),
+            boolean_config(
+                "library", "lazy_tags",
+                "Load tags on demand:",
+                ("Only load commonly used tags at startup, requires the "
+                 "sqlite library storage (restart required)")),
+            int_config(
+                "library", "scan_workers",
+                "Library scan threads:",
+                ("Number of files read at the same time when adding new "
+                 "files to the library, 0 for one per CPU")),
         ]
 
         for (row, (label, widget, button)) in enumerate(rows):
@@ -8,6 +8,8 @@
 """Code for serializing AudioFile instances"""
 
 import pickle
+import sys
+
 from senf import bytes2fsn, fsn2bytes
 
 from quodlibet.util.picklehelper import pickle_loads, pickle_dumps
@@ -19,13 +21,31 @@ class SerializationError(Exception):
     pass
 
 
-def _py2_to_py3(items):
+def shared_value(pool, value):
+    """Returns a value equal to `value` from `pool`, adds it if missing"""
+
+    type_ = type(value)
+    if type_ is str:
+        return pool.setdefault(value, value)
+    elif type_ is int or type_ is float:
+        # include the type, so 1 and 1.0 don't get mixed up
+        return pool.setdefault((type_, value), value)
+    return value
+
+
+def _py2_to_py3(items, share=False):
+    # After unpickling each item has its own copy of every key and value,
+    # though most of them (keys, artist, album, format, ...) are the same
+    # for many items. Sharing them saves lots of memory for large libraries.
+    pool = {}
+    intern = sys.intern
+
     for i in items:
         try:
             l = list(i.items())
         except AttributeError:
             raise SerializationError
-        i.clear()
+        new = {}
         for k, v in l:
             if isinstance(k, bytes):
                 k = k.decode("utf-8", "replace")
@@ -53,7 +73,14 @@ def _py2_to_py3(items):
                 except UnicodeEncodeError:
                     v = v.encode("utf-8", "replace").decode("utf-8")
 
-            i[k] = v
+            if share:
+                new[intern(k)] = shared_value(pool, v)
+            else:
+                new[k] = v
+
+        # rebuild it, assigning to an existing key would keep the old key
+        dict.clear(i)
+        dict.update(i, new)
 
     return items
 
@@ -63,8 +90,10 @@ def _py3_to_py2(items):
 
     new_list = []
     for i in items:
+        # items() first, it might change the class of lazily loaded items
+        values = list(i.items())
         inst = dict.__new__(i.__class__)
-        for key, value in i.items():
+        for key, value in values:
             if key in ("~filename", "~mountpoint") and not is_win:
                 value = fsn2bytes(value, None)
             try:
@@ -76,7 +105,7 @@ def _py3_to_py2(items):
     return new_list
 
 
-def load_audio_files(data, process=True):
+def load_audio_files(data, process=True, share=True):
     """unpickles the item list and if some class isn't found unpickle
     as a dict and filter them out afterwards.
 
@@ -87,6 +116,8 @@ def load_audio_files(data, process=True):
         data (bytes)
         process (bool): if the dict key/value types should be converted,
             either to be usable from py3 or to convert to newer types
+        share (bool): if equal keys and values should be shared between
+            the items to save memory, needs `process`
     Returns:
         List[AudioFile]
     Raises:
@@ -129,7 +160,7 @@ def load_audio_files(data, process=True):
                 "all class lookups failed. something is wrong")
 
     if process:
-        items = _py2_to_py3(items)
+        items = _py2_to_py3(items, share)
 
     try:
         for i in items:
@@ -13,13 +13,16 @@ the program when songs have been added, changed, or removed. They can
 also be queried in various ways.
 """
 
+import os
 import time
 
+from quodlibet import config
 from quodlibet import print_d
-
+from quodlibet.formats import SerializationError
 from quodlibet.library.libraries import SongFileLibrary, SongLibrary
 from quodlibet.library.librarians import SongLibrarian
-from quodlibet.util.path import mtime
+from quodlibet.library.storage import SQLiteStorage, migrate_storage
+from quodlibet.util import print_exc
 
 
 def init(cache_fn=None):
@@ -27,12 +30,29 @@ def init(cache_fn=None):
 
     Return a main library, and set a librarian for
     all future SongLibraries.
+
+    If the SQLite storage is configured, the library gets loaded from
+    `cache_fn` with an added extension instead, and an existing pickled
+    library at `cache_fn` gets migrated to it once. With "lazy_tags" set
+    only the commonly used tags get loaded at startup.
     """
 
     SongFileLibrary.librarian = SongLibrary.librarian = SongLibrarian()
     library = SongFileLibrary("main")
     if cache_fn:
-        library.load(cache_fn)
+        if config.get("library", "storage") == "sqlite":
+            db_fn = cache_fn + SQLiteStorage.EXTENSION
+            if not os.path.exists(db_fn) and os.path.exists(cache_fn):
+                try:
+                    migrate_storage(cache_fn, db_fn)
+                except (SerializationError, EnvironmentError):
+                    print_exc()
+                    # keep using the old library, try again next time
+                    db_fn = cache_fn
+            cache_fn = db_fn
+        library.load(cache_fn, config.getboolean("library", "lazy_tags"))
+        # rather now than on the first search
+        library.build_text_index()
     return library
 
 
@@ -40,7 +60,9 @@ def save(save_period=None):
     """Save all registered libraries that have a filename and are marked dirty.
 
     If `save_period` (seconds) is given the library will only be saved if
-    it hasn't been in the last `save_period` seconds.
+    it hasn't been in the last `save_period` seconds. Such periodic saves
+    only store the changes where possible, while a full save (e.g. on
+    shutdown) also merges a journal back into the library file.
     """
 
     print_d("Saving all libraries...")
@@ -51,5 +73,9 @@ def save(save_period=None):
         if not filename or not lib.dirty:
             continue
 
-        if not save_period or abs(time.time() - mtime(filename)) > save_period:
+        if not save_period:
             lib.save()
+            continue
+
+        if abs(time.time() - lib._storage.mtime) > save_period:
+            lib.save(compact=False)
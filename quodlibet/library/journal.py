@@ -0,0 +1,180 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""An append-only journal of library changes.
+
+Rewriting the whole library file on every save gets expensive for large
+libraries, so changes get appended to a journal next to it instead and
+only get merged into the library file once in a while (compaction).
+
+Each record in the journal consists of a small header containing the size
+of the two payloads, followed by the keys which were removed and the
+pickled items which were added or changed. Replaying a record first drops
+the removed keys and then (re)adds the items.
+
+Before a compaction replaces the library file, a marker record naming the
+new file (by its size and modification time) gets appended. The journal is
+only removed after the new file is in place, so if we crash in between,
+replaying skips everything before a marker matching the library file.
+"""
+
+import os
+import pickle
+import struct
+
+from quodlibet import util
+from quodlibet.formats import (load_audio_files, dump_audio_files,
+                               SerializationError)
+from quodlibet.util.dprint import print_d, print_w
+from quodlibet.util.picklehelper import pickle_loads, pickle_dumps
+from senf import fsnative
+
+
+_HEADER = struct.Struct("<4sII")
+_MAGIC = b"QLJ1"
+_BASE_MAGIC = b"QLJB"
+
+
+def _base_id(stat):
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+class LibraryJournal:
+    """A journal file for the library file `filename`"""
+
+    def __init__(self, filename):
+        assert isinstance(filename, fsnative)
+
+        self._base = filename
+        self.filename = filename + fsnative(u".journal")
+
+    @property
+    def size(self):
+        """The size of the journal in bytes, 0 if there is none"""
+
+        try:
+            return os.path.getsize(self.filename)
+        except EnvironmentError:
+            return 0
+
+    def append(self, removed, items):
+        """Append a record to the journal.
+
+        Args:
+            removed (Iterable[object]): keys of removed items
+            items (List[AudioFile]): added or changed items
+        Raises:
+            SerializationError
+            EnvironmentError
+        """
+
+        try:
+            removed_data = pickle_dumps(list(removed), 2)
+        except pickle.PicklingError as e:
+            raise SerializationError(e)
+        items_data = dump_audio_files(items)
+
+        self._write(_MAGIC, removed_data, items_data)
+
+    def mark_base(self, stat):
+        """Append a record noting that the library file which will have
+        the passed stat result contains all previous changes.
+
+        Raises:
+            EnvironmentError
+        """
+
+        self._write(_BASE_MAGIC, pickle_dumps(_base_id(stat), 2), b"")
+
+    def _write(self, magic, removed_data, items_data):
+        header = _HEADER.pack(magic, len(removed_data), len(items_data))
+        with open(self.filename, "ab") as fileobj:
+            fileobj.write(header + removed_data + items_data)
+            fileobj.flush()
+            os.fsync(fileobj.fileno())
+
+    def replay(self, items):
+        """Applies all records in the journal to the passed items.
+
+        In case the journal ends with a broken or incomplete record
+        (e.g. because we crashed while writing it) everything after the
+        last valid record gets dropped. If it contains a marker for the
+        current library file, only the records after it get applied.
+
+        Args:
+            items (List[AudioFile])
+        Returns:
+            List[AudioFile]: the updated items
+        """
+
+        try:
+            with open(self.filename, "rb") as fileobj:
+                data = fileobj.read()
+        except EnvironmentError:
+            return items
+
+        print_d("Replaying %d bytes of library journal" % len(data))
+
+        try:
+            base_id = _base_id(os.stat(self._base))
+        except EnvironmentError:
+            base_id = None
+
+        contents = {item.key: item for item in items}
+        offset = 0
+        while offset < len(data):
+            try:
+                magic, removed_size, items_size = _HEADER.unpack_from(
+                    data, offset)
+            except struct.error:
+                break
+            start = offset + _HEADER.size
+            end = start + removed_size + items_size
+            if magic not in (_MAGIC, _BASE_MAGIC) or end > len(data):
+                break
+
+            if magic == _BASE_MAGIC:
+                try:
+                    marked_id = tuple(pickle_loads(data[start:end]))
+                except (pickle.UnpicklingError, TypeError):
+                    util.print_exc()
+                    break
+                if marked_id == base_id:
+                    print_d("Skipping library journal entries already in %r"
+                            % self._base)
+                    contents = {item.key: item for item in items}
+                offset = end
+                continue
+
+            try:
+                removed = pickle_loads(data[start:start + removed_size])
+                changed = load_audio_files(data[start + removed_size:end])
+            except (pickle.UnpicklingError, SerializationError):
+                util.print_exc()
+                break
+
+            for key in removed:
+                contents.pop(key, None)
+            for item in changed:
+                contents[item.key] = item
+            offset = end
+
+        if offset != len(data):
+            print_w("Dropping broken library journal entries in %r" %
+                    self.filename)
+            try:
+                os.truncate(self.filename, offset)
+            except EnvironmentError:
+                util.print_exc()
+
+        return list(contents.values())
+
+    def clear(self):
+        """Removes the journal"""
+
+        try:
+            os.unlink(self.filename)
+        except FileNotFoundError:
+            pass
@@ -15,6 +15,7 @@ import itertools
 
 from gi.repository import GObject
 
+from quodlibet.pattern import forget_formatted
 from quodlibet.util.dprint import print_d
 
 
@@ -140,6 +141,14 @@ class Librarian(GObject.GObject):
 class SongLibrarian(Librarian):
     """A librarian for SongLibraries."""
 
+    def __init__(self):
+        super().__init__()
+        self.connect('changed', self.__forget_formatted)
+        self.connect('removed', self.__forget_formatted)
+
+    def __forget_formatted(self, librarian, songs):
+        forget_formatted(songs)
+
     def tag_values(self, tag):
         """Return a set of all values for the given tag."""
         return {value for lib in self.libraries.values()
@@ -164,6 +173,7 @@ class SongLibrarian(Librarian):
             except KeyError:
                 pass
             else:
+                library._forget_keys([song.key])
                 re_add.append(library)
         song.rename(newname)
         for library in re_add:
@@ -14,24 +14,39 @@ least useful but most content-agnostic.
 """
 
 import os
-import shutil
+import pickle
 import time
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from multiprocessing import cpu_count
 from typing import Set, Optional
 
 from gi.repository import GObject
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from quodlibet import _
+from quodlibet import config
 from quodlibet import formats
 from quodlibet import util
-from quodlibet.formats import (MusicFile, AudioFileError, load_audio_files,
-                               dump_audio_files, SerializationError)
+from quodlibet.util import copool
+from quodlibet.formats import MusicFile, AudioFileError, SerializationError, \
+    AudioFile
+from quodlibet.library.storage import get_storage
 from quodlibet.qltk.notif import Task
 from quodlibet.query import Query
-from quodlibet.util.atomic import atomic_save
+from quodlibet.unisearch.fold import fold, fold_cached
+from quodlibet.util.tags import MACHINE_TAGS
 from quodlibet.util.collection import Album
+from quodlibet.util.atomic import atomic_save
 from quodlibet.util.collections import DictMixin
 from quodlibet.util.dprint import print_d, print_w
-from quodlibet.util.path import unexpand, mkdir, normalize_path, ishidden, ismount
+from quodlibet.util.path import unexpand, normalize_path, ishidden, ismount
+from quodlibet.util.picklehelper import pickle_loads, pickle_dumps
 from senf import fsn2text, fsnative
 
 
@@ -203,71 +218,119 @@ class Library(GObject.GObject, DictMixin):
         return items
 
 
-def _load_items(filename):
-    """Load items from disk.
+class PicklingMixin:
+    """A mixin to provide persistence of a library by pickling to disk
 
-    In case of an error returns default or an empty list.
+    The file format depends on the file name, see `get_storage`. Once
+    loaded, changes reported through the library signals are tracked so
+    that `save()` can store only those where the format allows it.
     """
 
-    try:
-        with open(filename, "rb") as fp:
-            data = fp.read()
-    except EnvironmentError:
-        print_w("Couldn't load library file from: %r" % filename)
-        return []
-
-    try:
-        items = load_audio_files(data)
-    except SerializationError:
-        # there are too many ways this could fail
-        util.print_exc()
-
-        # move the broken file out of the way
-        try:
-            shutil.copy(filename, filename + ".not-valid")
-        except EnvironmentError:
-            util.print_exc()
-
-        return []
-
-    return items
-
-
-class PicklingMixin:
-    """A mixin to provide persistence of a library by pickling to disk"""
-
     filename = None
 
-    def load(self, filename):
+    _storage = None
+
+    def load(self, filename, lazy=False):
         """Load a library from a file, containing a picked list.
 
         Loading does not cause added, changed, or removed signals.
+        If `lazy` is True, rarely used tags may only get loaded once
+        they are accessed.
         """
 
         self.filename = filename
         print_d("Loading contents of %r." % filename, self)
 
-        items = _load_items(filename)
+        self._storage = get_storage(filename, lazy)
+        items = self._storage.load()
 
         # this loads all items without checking their validity, but makes
         # sure that non-mounted items are masked
         self._load_init(items)
 
+        self._pending_reset()
+        self.connect('added', self.__pending_changed)
+        self.connect('changed', self.__pending_changed)
+        self.connect('removed', self.__pending_removed)
+
         print_d(f"Done loading contents of {filename!r}", self._name)
 
-    def save(self, filename=None):
-        """Save the library to the given filename, or the default if `None`"""
+    def _pending_reset(self):
+        self._pending_items = {}
+        self._pending_removed = set()
+
+    def __pending_changed(self, library, items):
+        pending_items = self._pending_items
+        for item in items:
+            pending_items[item.key] = item
+
+    def __pending_removed(self, library, items):
+        self._pending_removed.update(item.key for item in items)
+
+    def _forget_keys(self, keys):
+        """Notes that the items for `keys` are gone without a 'removed'
+        signal, e.g. because a rename changed their key"""
+
+        if self._storage is not None:
+            self._pending_removed.update(keys)
+
+    def _is_persisted(self, key):
+        """If an item with `key` is part of what gets saved"""
+
+        return key in self
+
+    def _save_pending(self):
+        """Store all changes since the last save.
+
+        Returns True if the storage is up to date.
+        """
+
+        # items which got masked or re-added are still around
+        removed = {key for key in self._pending_removed
+                   if not self._is_persisted(key)}
+        items = [item for item in self._pending_items.values()
+                 if self._is_persisted(item.key)]
+        if not removed and not items:
+            return True
+
+        print_d(f"Saving {len(items)} changed and {len(removed)} "
+                f"removed items", self._name)
+
+        try:
+            self._storage.update(removed, items)
+        except SerializationError:
+            util.print_exc()
+            return False
+        except EnvironmentError:
+            print_w(f"Couldn't save changes to {self.filename!r}")
+            return False
+
+        self._pending_reset()
+        return True
+
+    def save(self, filename=None, compact=True):
+        """Save the library to the given filename, or the default if `None`
+
+        If the library was loaded from `filename` and `compact` is False,
+        only the changes since the last save are stored if possible.
+        """
 
         if filename is None:
             filename = self.filename
 
+        if filename == self.filename and self._storage is not None:
+            storage = self._storage
+            if not storage.needs_write(compact):
+                if self._save_pending():
+                    self.dirty = False
+                return
+        else:
+            storage = get_storage(filename)
+
         print_d(f"Saving contents to {filename!r}", self._name)
 
         try:
-            dirname = os.path.dirname(filename)
-            mkdir(dirname)
-            with atomic_save(filename, "wb") as fileobj:
-                fileobj.write(dump_audio_files(self.get_content()))
+            storage.write(self.get_content())
         except SerializationError:
             # Can happen when we try to pickle while the library is being
             # modified, like in the periodic 15min save.
@@ -276,6 +339,10 @@ class PicklingMixin:
         except EnvironmentError:
             print_w(f"Couldn't save library to path {filename!r}")
         else:
+            if storage is self._storage:
+                self._pending_reset()
+            else:
+                storage.close()
             self.dirty = False
 
 
@@ -304,6 +371,9 @@ class AlbumLibrary(Library):
             "AlbumLibrary for %s" % library._name)
 
         self._library = library
+        # the album each song is in by id(song), as its album_key might
+        # have changed since it got added
+        self._albums = {}
         self._asig = library.connect('added', self.__added)
         self._rsig = library.connect('removed', self.__removed)
         self._csig = library.connect('changed', self.__changed)
@@ -321,26 +391,31 @@ class AlbumLibrary(Library):
         return self._contents.get(item)
 
     def __add(self, items):
-        changed = set()
+        """Returns a dict mapping the already existing albums songs got
+        added to, to the songs added to each, and the set of new albums"""
+
+        added = {}
         new = set()
+        albums = self._albums
         for song in items:
             key = song.album_key
-            if key in self._contents:
-                changed.add(self._contents[key])
-            else:
+            album = self._contents.get(key)
+            if album is None:
                 album = Album(song)
                 self._contents[key] = album
                 new.add(album)
-            self._contents[key].songs.add(song)
-
-        changed -= new
-        return changed, new
+            elif album not in new:
+                added.setdefault(album, []).append(song)
+            album.songs.add(song)
+            albums[id(song)] = album
+        return added, new
 
     def __added(self, library, items, signal=True):
-        changed, new = self.__add(items)
+        added, new = self.__add(items)
 
-        for album in changed:
-            album.finalize()
+        changed = set(added)
+        for album, songs in added.items():
+            album.refresh(songs)
 
         if signal:
             if new:
@@ -349,21 +424,23 @@ class AlbumLibrary(Library):
                 self.emit('changed', changed)
 
     def __removed(self, library, items):
-        changed = set()
+        taken = {}
         removed = set()
         for song in items:
-            key = song.album_key
-            album = self._contents[key]
+            album = self._albums.pop(id(song), None)
+            if album is None:
+                continue
             album.songs.remove(song)
-            changed.add(album)
+            taken.setdefault(album, []).append(song)
             if not album.songs:
                 removed.add(album)
-                del self._contents[key]
-
-        changed -= removed
+                del self._contents[album.key]
 
-        for album in changed:
-            album.finalize()
+        changed = set()
+        for album, songs in taken.items():
+            if album not in removed:
+                album.refresh(removed=songs)
+                changed.add(album)
 
         if removed:
             self.emit('removed', removed)
@@ -371,40 +448,42 @@ class AlbumLibrary(Library):
             self.emit('changed', changed)
 
     def __changed(self, library, items):
-        """Album keys could change between already existing ones.. so we
-        have to do it the hard way and search by id."""
+        """Album keys could change between already existing ones, so songs
+        whose key changed get moved from the album they were in to the
+        one matching their new key."""
         print_d("Updating affected albums for %d items" % len(items))
-        changed = set()
+        updated = {}
+        taken = {}
         removed = set()
         to_add = []
         for song in items:
-            # in case the key hasn't changed
-            key = song.album_key
-            if key in self._contents and song in self._contents[key].songs:
-                changed.add(self._contents[key])
-            else:  # key changed.. look for it in each album
-                to_add.append(song)
-                for key, album in self._contents.items():
-                    if song in album.songs:
-                        album.songs.remove(song)
-                        if not album.songs:
-                            removed.add(album)
-                        else:
-                            changed.add(album)
-                        break
+            album = self._albums.get(id(song))
+            if album is not None and album.key == song.album_key:
+                updated.setdefault(album, []).append(song)
+                continue
+            to_add.append(song)
+            if album is not None:
+                del self._albums[id(song)]
+                album.songs.remove(song)
+                taken.setdefault(album, []).append(song)
+                if not album.songs:
+                    removed.add(album)
 
         # get new albums and changed ones because keys could have changed
-        add_changed, new = self.__add(to_add)
-        changed |= add_changed
+        added, new = self.__add(to_add)
+        for album, songs in added.items():
+            updated.setdefault(album, []).extend(songs)
 
         # check if albums that were empty at some point are still empty
         for album in removed:
             if not album.songs:
                 del self._contents[album.key]
-                changed.discard(album)
+                updated.pop(album, None)
+                taken.pop(album, None)
 
+        changed = set(updated) | set(taken)
         for album in changed:
-            album.finalize()
+            album.refresh(updated.get(album, ()), taken.get(album, ()))
 
         if removed:
             self.emit("removed", removed)
@@ -414,6 +493,390 @@ class AlbumLibrary(Library):
             self.emit("added", new)
 
 
+class TagIndex:
+    """An index of all values of a tag, mapping each value to the songs
+    having it. Listens to a SongLibrary and updates itself when songs
+    get added, changed or removed.
+    """
+
+    def __init__(self, library, tag):
+        print_d("Indexing %r of %r" % (tag, library._name))
+
+        self.tag = tag
+        self._library = library
+        self._values = {}
+        self._songs = {}
+        self._uncertain = set()
+        self._sigs = [
+            library.connect('added', self.__added),
+            library.connect('changed', self.__added),
+            library.connect('removed', self.__removed),
+        ]
+        self.__added(library, library.values())
+
+    def destroy(self):
+        for sig in self._sigs:
+            self._library.disconnect(sig)
+
+    def _get_values(self, song):
+        """The values of `song` to index it by"""
+
+        return tuple(song.list(self.tag))
+
+    def _is_uncertain(self, song):
+        """If searching the tag in a query (see `Tag.search`) looks at other
+        values of `song` than the indexed ones, which only happens if it
+        doesn't have the tag: then the title gets made up from the file
+        name and other tags fall back to the internal tag of the same name.
+        """
+
+        tag = self.tag
+        return tag[:1] != "~" and tag not in song and \
+            (tag == "title" or "~" + tag in song)
+
+    def __added(self, library, songs):
+        uncertain = self._uncertain
+        for song in songs:
+            if self._is_uncertain(song):
+                uncertain.add(song)
+            else:
+                uncertain.discard(song)
+            new = self._get_values(song)
+            old = self._songs.get(song, ())
+            if new == old:
+                continue
+            for value in old:
+                self._discard(value, song)
+            for value in new:
+                self._add(value, song)
+            if new:
+                self._songs[song] = new
+            else:
+                self._songs.pop(song, None)
+
+    def __removed(self, library, songs):
+        for song in songs:
+            self._uncertain.discard(song)
+            for value in self._songs.pop(song, ()):
+                self._discard(value, song)
+
+    def _add(self, value, song):
+        self._values.setdefault(value, set()).add(song)
+
+    def _discard(self, value, song):
+        songs = self._values.get(value)
+        if songs is not None:
+            songs.discard(song)
+            if not songs:
+                del self._values[value]
+
+    def values(self):
+        """A set of all values of the tag"""
+
+        return set(self._values)
+
+    def songs(self, value):
+        """A set of all songs having `value`, empty if there are none"""
+
+        return set(self._values.get(value, ()))
+
+    def uncertain(self):
+        """A set of all songs which a query searching the tag might match
+        for other values than the indexed ones, see `_is_uncertain`
+        """
+
+        return set(self._uncertain)
+
+    def search(self, func):
+        """A set of all songs having a value for which `func` returns True"""
+
+        result = set()
+        for value, songs in self._values.items():
+            if func(value):
+                result.update(songs)
+        return result
+
+    def __contains__(self, value):
+        return value in self._values
+
+    def __len__(self):
+        return len(self._values)
+
+
+class NumericIndex(TagIndex):
+    """An index of a numeric tag, which can also find songs in a range
+    of values.
+
+    Songs for which the value is computed (like the default rating) are
+    kept apart and are part of every range, since their value can change
+    without the song changing.
+    """
+
+    def __init__(self, library, tag):
+        self._sorted = []
+        self._computed = set()
+        super().__init__(library, tag)
+
+    def _get_values(self, song):
+        value = song(self.tag, None)
+        if value is None:
+            return ()
+        elif dict.get(song, self.tag) == value:
+            return (value,)
+        return (None,)
+
+    def _add(self, value, song):
+        if value is None:
+            self._computed.add(song)
+        else:
+            if value not in self._values:
+                insort(self._sorted, value)
+            super()._add(value, song)
+
+    def _discard(self, value, song):
+        if value is None:
+            self._computed.discard(song)
+        else:
+            super()._discard(value, song)
+            if value not in self._values:
+                del self._sorted[bisect_left(self._sorted, value)]
+
+    def values(self):
+        values = set(self._sorted)
+        values.update(song(self.tag) for song in self._computed)
+        return values
+
+    def range(self, low, high):
+        """A set of all songs with a value between `low` and `high`
+        (inclusive) or with a computed value.
+        """
+
+        result = set(self._computed)
+        values = self._values
+        start = bisect_left(self._sorted, low)
+        end = bisect_right(self._sorted, high)
+        for value in self._sorted[start:end]:
+            result.update(values[value])
+        return result
+
+
+_PATH_KEYS = ("~filename", "~mountpoint")
+_NOT_SEARCH_TEXT = set(MACHINE_TAGS) | set(_PATH_KEYS)
+
+
+class SearchTextIndex:
+    """The folded text (see `unisearch.fold`) of all tags of each song,
+    including the decoded file path but not machine tags like MusicBrainz
+    IDs. Listens to a SongLibrary and updates itself when songs get added,
+    changed or removed.
+
+    Used to rule out songs when searching for plain text: a song can only
+    match if its text contains the folded search term.
+    """
+
+    def __init__(self, library, build=True):
+        """If `build` is False only songs added or changed from now on get
+        indexed until `build_steps()` is done.
+        """
+
+        print_d("Indexing search text of %r" % library._name)
+
+        self._library = library
+        self._texts = {}
+        self._sigs = [
+            library.connect('added', self.__added),
+            library.connect('changed', self.__added),
+            library.connect('removed', self.__removed),
+        ]
+        if build:
+            self.__added(library, library.values())
+
+    def build_steps(self, step_size=500):
+        """Indexes all songs of the library, yielding after each
+        `step_size` of them (for `copool`).
+        """
+
+        library = self._library
+        texts = self._texts
+        get_text = self.get_text
+        for i, song in enumerate(list(library.values()), 1):
+            # changed or removed meanwhile
+            if id(song) not in texts and song in library:
+                texts[id(song)] = (song, get_text(song))
+            if not i % step_size:
+                yield
+
+    def destroy(self):
+        for sig in self._sigs:
+            self._library.disconnect(sig)
+
+    @staticmethod
+    def get_text(song):
+        """The folded text of all tags of `song`, one value per line"""
+
+        # paths are unique, don't fill up the cache with them
+        lines = [fold(fsn2text(song[key])) for key in _PATH_KEYS
+                 if key in song]
+        lines.extend(map(fold_cached, [
+            value for key, value in song.items()
+            if key[:2] != "~#" and key not in _NOT_SEARCH_TEXT and
+            isinstance(value, str)]))
+        return u"\n".join(lines)
+
+    def __added(self, library, songs):
+        texts = self._texts
+        get_text = self.get_text
+        for song in songs:
+            texts[id(song)] = (song, get_text(song))
+
+    def __removed(self, library, songs):
+        for song in songs:
+            self._texts.pop(id(song), None)
+
+    def search(self, texts):
+        """A set of all songs whose folded text contains all `texts`"""
+
+        items = self._texts.values()
+        for text in texts:
+            items = [item for item in items if text in item[1]]
+        return {song for song, t in items}
+
+    def __len__(self):
+        return len(self._texts)
+
+
+# the default rating is a setting, it can change without the song changing
+_VOLATILE_NUMERIC = {"~#rating"}
+
+
+class NumericColumns:
+    """The values of numeric tags of all songs as NumPy arrays, for
+    comparing them for all songs at once (see `query._planner`). Listens to
+    a SongLibrary and updates itself when songs get added, changed or
+    removed.
+
+    Each song has a position in all arrays, `songs()` maps positions back
+    to songs. The array for a tag gets created on first use.
+    """
+
+    def __init__(self, library):
+        print_d("Creating numeric columns of %r" % library._name)
+
+        self._library = library
+        self._songs = []
+        self._positions = {}
+        self._valid = numpy.zeros(0, dtype=bool)
+        self._columns = {}
+        self._sigs = [
+            library.connect('added', self.__added),
+            library.connect('changed', self.__added),
+            library.connect('removed', self.__removed),
+        ]
+        self.__added(library, library.values())
+
+    def destroy(self):
+        for sig in self._sigs:
+            self._library.disconnect(sig)
+
+    @staticmethod
+    def _get_values(songs, tag, computed=False):
+        """An array of the values of `tag`, NaN for songs without one or
+        None instead of a song. Computed values which could change without
+        the song changing are left out unless `computed` is True.
+        """
+
+        if tag in _VOLATILE_NUMERIC and not computed:
+            get = dict.get
+            values = [get(song, tag) if song is not None else None
+                      for song in songs]
+        else:
+            values = [song(tag, None) if song is not None else None
+                      for song in songs]
+        try:
+            return numpy.array(values, dtype=float)
+        except (TypeError, ValueError):
+            return numpy.array(
+                [v if isinstance(v, (int, float)) else None for v in values],
+                dtype=float)
+
+    def __added(self, library, songs):
+        positions = self._positions
+        new = []
+        changed = []
+        for song in songs:
+            pos = positions.get(id(song))
+            if pos is None:
+                positions[id(song)] = len(self._songs) + len(new)
+                new.append(song)
+            else:
+                changed.append(pos)
+
+        if changed:
+            changed_songs = list(map(self._songs.__getitem__, changed))
+            for tag, column in self._columns.items():
+                column[changed] = self._get_values(changed_songs, tag)
+
+        if new:
+            self._songs.extend(new)
+            self._valid = numpy.concatenate(
+                [self._valid, numpy.ones(len(new), dtype=bool)])
+            for tag, column in self._columns.items():
+                self._columns[tag] = numpy.concatenate(
+                    [column, self._get_values(new, tag)])
+
+    def __removed(self, library, songs):
+        removed = []
+        for song in songs:
+            pos = self._positions.pop(id(song), None)
+            if pos is not None:
+                self._songs[pos] = None
+                removed.append(pos)
+        self._valid[removed] = False
+        for column in self._columns.values():
+            column[removed] = numpy.nan
+
+        # don't let the holes pile up
+        if len(self._songs) > 2 * len(self._positions) + 1000:
+            keep = numpy.flatnonzero(self._valid)
+            self._songs = list(map(self._songs.__getitem__, keep.tolist()))
+            self._positions = {
+                id(song): i for i, song in enumerate(self._songs)}
+            self._valid = numpy.ones(len(self._songs), dtype=bool)
+            for tag, column in self._columns.items():
+                self._columns[tag] = column[keep]
+
+    @property
+    def valid(self):
+        """A bool array, True at all positions which belong to a song"""
+
+        return self._valid
+
+    def get(self, tag):
+        """An array of the values of `tag` at all positions, NaN if there is
+        no value. Must not be changed.
+        """
+
+        column = self._columns.get(tag)
+        if column is None:
+            column = self._columns[tag] = self._get_values(self._songs, tag)
+        if tag in _VOLATILE_NUMERIC:
+            missing = numpy.flatnonzero(numpy.isnan(column) & self._valid)
+            if len(missing):
+                column = column.copy()
+                column[missing] = self._get_values(
+                    list(map(self._songs.__getitem__, missing.tolist())),
+                    tag, computed=True)
+        return column
+
+    def songs(self, positions):
+        """A list of the songs at `positions` (an array of positions)"""
+
+        return list(map(self._songs.__getitem__, positions.tolist()))
+
+    def __len__(self):
+        return len(self._positions)
+
+
 class SongLibrary(PicklingLibrary):
     """A library for songs.
 
@@ -423,6 +886,21 @@ class SongLibrary(PicklingLibrary):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._indexes = {}
+        self._text_index = None
+        # the text index while getting built in the main loop
+        self._text_index_building = None
+        self._columns = None
+        # the last query and its result, to search refinements of it in
+        self._last_query = None
+        self._last_result = None
+        self._query_sigs = [
+            self.connect(signal, self.__forget_query)
+            for signal in ['added', 'changed', 'removed']]
+
+    def __forget_query(self, library, songs):
+        self._last_query = None
+        self._last_result = None
 
     @util.cached_property
     def albums(self):
@@ -430,11 +908,111 @@ class SongLibrary(PicklingLibrary):
 
     def destroy(self):
         super().destroy()
+        for sig in self._query_sigs:
+            self.disconnect(sig)
+        self.__forget_query(self, [])
         if "albums" in self.__dict__:
             self.albums.destroy()
+        for index in self._indexes.values():
+            index.destroy()
+        self._indexes.clear()
+        if self._text_index is not None:
+            self._text_index.destroy()
+            self._text_index = None
+        if self._text_index_building is not None:
+            copool.remove(self.__build_text_index)
+            self._text_index_building.destroy()
+            self._text_index_building = None
+        if self._columns is not None:
+            self._columns.destroy()
+            self._columns = None
+
+    def get_index(self, tag):
+        """Returns a `TagIndex` for `tag` if the tag is indexed (see the
+        "indexed_tags" option), otherwise None.
+
+        The index gets created on first use and then kept up to date.
+        """
+
+        try:
+            return self._indexes[tag]
+        except KeyError:
+            try:
+                tags = config.getstringlist("library", "indexed_tags")
+            except config.Error:
+                tags = []
+            if tag not in tags:
+                return None
+            if tag.startswith("~#"):
+                index = NumericIndex(self, tag)
+            else:
+                index = TagIndex(self, tag)
+            self._indexes[tag] = index
+            return index
+
+    def __text_index_enabled(self):
+        try:
+            enabled = config.getboolean("library", "search_text_index")
+        except config.Error:
+            enabled = False
+        # it would load all tags of lazily loaded songs
+        if self._storage is not None and self._storage.lazy:
+            enabled = False
+        return enabled and fold(u"") is not None
+
+    def get_text_index(self):
+        """Returns a `SearchTextIndex` of all songs if enabled (see the
+        "search_text_index" option) and text can be folded, otherwise None.
+
+        The index gets created on first use and then kept up to date.
+        While it gets built in the background (see `build_text_index`)
+        this returns None.
+        """
+
+        if self._text_index is None and self._text_index_building is None:
+            if self.__text_index_enabled():
+                self._text_index = SearchTextIndex(self)
+        return self._text_index
+
+    def build_text_index(self):
+        """Builds the `SearchTextIndex` in the main loop in small steps if
+        enabled, instead of all at once on first use.
+        """
+
+        if self._text_index is not None or \
+                self._text_index_building is not None or \
+                not self.__text_index_enabled():
+            return
+        self._text_index_building = SearchTextIndex(self, build=False)
+        copool.add(self.__build_text_index, funcid=self.__build_text_index)
+
+    def __build_text_index(self):
+        index = self._text_index_building
+        yield from index.build_steps()
+        self._text_index = index
+        self._text_index_building = None
+
+    def get_columns(self):
+        """Returns `NumericColumns` of all songs if enabled (see the
+        "numeric_columns" option) and NumPy is available, otherwise None.
+
+        The columns get created on first use and then kept up to date.
+        """
+
+        if self._columns is None and numpy is not None:
+            try:
+                enabled = config.getboolean("library", "numeric_columns")
+            except config.Error:
+                enabled = False
+            if enabled:
+                self._columns = NumericColumns(self)
+        return self._columns
 
     def tag_values(self, tag):
         """Return a set of all values for the given tag."""
+        index = self.get_index(tag)
+        if index is not None:
+            return index.values()
         return {value for song in self.values()
                 for value in song.list(tag)}
 
@@ -455,6 +1033,7 @@ class SongLibrary(PicklingLibrary):
             return
         print_d(f"Renaming {song.key!r} to {new_name!r}", self)
         del self._contents[song.key]
+        self._forget_keys([song.key])
         song.rename(new_name)
         self._contents[song.key] = song
         if changed is not None:
@@ -463,17 +1042,42 @@ class SongLibrary(PicklingLibrary):
             self.changed({song})
 
     def query(self, text, sort=None, star=Query.STAR):
-        """Query the library and return matching songs."""
+        """Query the library and return matching songs, in the order of
+        the library.
+
+        If the query narrows down the previous one, only the songs matching
+        the previous one get searched.
+        """
         if isinstance(text, bytes):
             text = text.decode('utf-8')
 
         songs = self.values()
         if text != "":
-            songs = list(filter(Query(text, star).search, songs))
+            query = Query(text, star)
+            last = self._last_query
+            if last is not None and query.is_refinement_of(last):
+                songs = query.filter(self._last_result)
+            else:
+                found = query.filter_indexed(
+                    songs, self.get_index, self.get_text_index,
+                    self.get_columns)
+                # in the library order, like filtering all songs
+                if len(found) > 1:
+                    found = set(found)
+                    found = [song for song in songs if song in found]
+                songs = found
+            self._last_query = query
+            self._last_result = songs
+            songs = list(songs)
         return songs
 
 
-def iter_paths(root, exclude=[], skip_hidden=True):
+# Directories changed this recently could change again without their mtime
+# changing on file systems with a coarse mtime resolution
+_UNSETTLED = 2
+
+
+def iter_paths(root, exclude=[], skip_hidden=True, index=None):
     """yields paths contained in root (symlinks dereferenced)
 
     Any path starting with any of the path parts included in exclude
@@ -486,10 +1090,26 @@ def iter_paths(root, exclude=[], skip_hidden=True):
         exclude (List[fsnative])
         skip_hidden (bool): Ignore files which are hidden or where any
             of the parent directories are hidden.
+        index (Optional[Dict[fsnative, object]]): The state of directories
+            (by their real path) when they were last visited. Files in
+            directories which haven't changed since (no files were added,
+            removed or renamed) are skipped. Gets updated with the current
+            state of directories where no files were skipped.
     Yields:
         fsnative: absolute dereferenced paths
     """
 
+    for dirname, path in _walk_paths(root, exclude, skip_hidden, index,
+                                     index):
+        yield path
+
+
+def _walk_paths(root, exclude, skip_hidden, index, states):
+    """Like iter_paths(), but yields (dirname, path) tuples, `dirname`
+    being the real path of the directory the file was found in, and puts
+    the new states into `states`.
+    """
+
     assert isinstance(root, fsnative)
     assert all((isinstance(p, fsnative) for p in exclude))
     assert os.path.abspath(root)
@@ -503,18 +1123,90 @@ def iter_paths(root, exclude=[], skip_hidden=True):
     if skip_hidden and ishidden(root):
         return
 
+    def get_state(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        # the inode changes if the directory got replaced
+        return (stat.st_mtime_ns, stat.st_ino)
+
+    # The state of each directory before os.walk() lists it, so files
+    # added in between make it look changed the next time
+    before = {}
+    if index is not None:
+        before[root] = get_state(root)
+
     for path, dnames, fnames in os.walk(root):
         if skip_hidden:
             dnames[:] = list(filter(
                 lambda d: not ishidden(os.path.join(path, d)), dnames))
+        dirname = os.path.realpath(path)
+        state = None
+        if index is not None:
+            # the subdirectories get listed once this one is done
+            for dname in dnames:
+                sub_path = os.path.join(path, dname)
+                before[sub_path] = get_state(sub_path)
+            state = before.pop(path, None)
+            if state is not None and index.get(dirname) == state:
+                continue
+        skipped = False
         for filename in fnames:
             fullfilename = os.path.join(path, filename)
             if skip(fullfilename):
+                skipped = True
                 continue
             fullfilename = os.path.realpath(fullfilename)
             if skip(fullfilename):
+                skipped = True
                 continue
-            yield fullfilename
+            yield dirname, fullfilename
+        # files skipped now might not be once the settings change, and
+        # files added right now might not change the mtime
+        if state is not None and not skipped and \
+                time.time() - state[0] / 1e9 > _UNSETTLED:
+            states[dirname] = state
+
+
+def _get_workers():
+    """Number of threads for reading files, see the "scan_workers" option"""
+
+    workers = config.getint("library", "scan_workers", 0)
+    if workers <= 0:
+        try:
+            workers = cpu_count()
+        except NotImplementedError:
+            workers = 2
+    return workers
+
+
+def _find_invalid(dirname, items):
+    """Returns the items which changed on disk, like `AudioFile.valid()`.
+
+    All items have to be in `dirname`, which gets listed only once.
+    """
+
+    names = {os.path.basename(item["~filename"]) for item in items}
+    mtimes = {}
+    try:
+        with os.scandir(dirname) as entries:
+            for entry in entries:
+                if entry.name in names:
+                    try:
+                        mtimes[entry.name] = entry.stat().st_mtime
+                    except OSError:
+                        pass
+    except OSError:
+        pass
+
+    invalid = []
+    for item in items:
+        mtime = item.get("~#mtime", 0)
+        name = os.path.basename(item["~filename"])
+        if not mtime or mtime != mtimes.get(name, 0):
+            invalid.append(item)
+    return invalid
 
 
 class FileLibrary(PicklingLibrary):
@@ -527,6 +1219,31 @@ class FileLibrary(PicklingLibrary):
     def __init__(self, name=None):
         super().__init__(name)
         self._masked = {}
+        self._dir_index = None
+        # directory states of finished scans, stored once the songs are
+        self._dir_states = {}
+        # directories forgotten during a running scan
+        self._dirs_forgotten = None
+
+    def load(self, filename, lazy=False):
+        super().load(filename, lazy)
+        # The songs file got lost, replaced or couldn't be loaded, so the
+        # directories it was scanned from have to be scanned again
+        if not self._contents and not self._masked and \
+                self._get_dir_index():
+            self._set_dir_index({})
+
+    def save(self, filename=None, compact=True):
+        super().save(filename, compact)
+        if not self.dirty and filename in (None, self.filename):
+            self._save_dir_states()
+
+    def _save_dir_states(self):
+        if self._dir_states:
+            index = dict(self._get_dir_index())
+            index.update(self._dir_states)
+            self._dir_states = {}
+            self._set_dir_index(index)
 
     def _load_init(self, items):
         """Add many items to the library, check if the
@@ -639,10 +1356,12 @@ class FileLibrary(PicklingLibrary):
         This generator rebuilds the library over the course of iteration.
 
         Any paths given will be scanned for new files, using the 'scan'
-        method.
+        method. With `force` all directories get scanned again as well.
 
         Only items present in the library when the rebuild is started
-        will be checked.
+        will be checked. Checking happens in worker threads, listing each
+        directory only once, and only changed items get reloaded.
+        The time spent in each phase gets logged.
 
         If this function is copooled, set "cofuncid" to enable pause/stop
         buttons in the UI.
@@ -650,6 +1369,7 @@ class FileLibrary(PicklingLibrary):
 
         print_d(f"Rebuilding, force is {force}", self._name)
 
+        start = time.time()
         task = Task(_("Library"), _("Checking mount points"))
         if cofuncid:
             task.copool(cofuncid)
@@ -660,14 +1380,40 @@ class FileLibrary(PicklingLibrary):
                 self.emit('added', list(items.values()))
                 yield True
 
+        print_d("Checked mount points in %.2fs" % (time.time() - start),
+                self._name)
+
+        start = time.time()
+        if force:
+            invalid = list(self.values())
+        else:
+            task = Task(_("Library"), _("Checking for changes"))
+            if cofuncid:
+                task.copool(cofuncid)
+            with task:
+                items = list(self.values())
+                invalid = []
+                done = 0
+                for count, found in self._check_items(items):
+                    done += count
+                    task.update(float(done) / max(len(items), 1))
+                    invalid.extend(found)
+                    yield True
+        print_d("Found %d changed items in %.2fs" % (
+            len(invalid), time.time() - start), self._name)
+
+        start = time.time()
         task = Task(_("Library"), _("Scanning library"))
         if cofuncid:
             task.copool(cofuncid)
         changed, removed = set(), set()
-        for i, (key, item) in task.list(enumerate(sorted(self.items()))):
-            if key in self._contents and force or not item.valid():
+        # sorting by key (often the filename) makes use of the file system
+        # cache when reloading
+        invalid.sort(key=lambda item: item.key)
+        for i, item in task.list(enumerate(invalid)):
+            if item.key in self._contents:
                 self.reload(item, changed, removed)
-                # These numbers are pretty empirical. We should yield more
+            # These numbers are pretty empirical. We should yield more
             # often than we emit signals; that way the main loop stays
             # interactive and doesn't get bogged down in updates.
             if len(changed) > 100:
@@ -683,9 +1429,58 @@ class FileLibrary(PicklingLibrary):
             self.emit('removed', removed)
         if changed:
             self.emit('changed', changed)
+        print_d("Reloaded changed items in %.2fs" % (time.time() - start),
+                self._name)
 
-        for value in self.scan(paths, exclude, cofuncid):
+        start = time.time()
+        for value in self.scan(paths, exclude, cofuncid, force):
             yield value
+        print_d("Scanned for new files in %.2fs" % (time.time() - start),
+                self._name)
+
+    def _check_items(self, items):
+        """Finds items which changed on disk in worker threads.
+
+        Items get grouped by directory so each directory only gets listed
+        once. Yields tuples of the number of checked items and a list of
+        the invalid ones among them. Closing the generator stops checking.
+        """
+
+        groups = {}
+        others = []
+        for item in items:
+            if type(item).valid is AudioFile.valid:
+                dirname = os.path.dirname(item["~filename"])
+                groups.setdefault(dirname, []).append(item)
+            else:
+                others.append(item)
+
+        def check_others(items):
+            return [item for item in items if not item.valid()]
+
+        executor = ThreadPoolExecutor(_get_workers())
+        pending = [executor.submit(_find_invalid, dirname, group)
+                   for dirname, group in groups.items()]
+        pending.append(executor.submit(check_others, others))
+        sizes = {future: len(group)
+                 for future, group in zip(pending, groups.values())}
+        sizes[pending[-1]] = len(others)
+        try:
+            while pending:
+                # don't block the main loop for too long
+                done, not_done = wait(pending, timeout=0.015)
+                pending = list(not_done)
+                invalid = []
+                for future in done:
+                    try:
+                        invalid.extend(future.result())
+                    except Exception:
+                        util.print_exc()
+                yield sum(sizes[future] for future in done), invalid
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
 
     def add_filename(self, filename, add=True):
         """Add a file based on its filename.
@@ -704,7 +1499,54 @@ class FileLibrary(PicklingLibrary):
 
         raise NotImplementedError
 
-    def scan(self, paths, exclude=[], cofuncid=None):
+    def _get_dir_index(self):
+        """The state of all directories at the end of the last complete
+        scan with its songs saved, see `iter_paths`. Stored next to the
+        library file.
+        """
+
+        if self._dir_index is None:
+            self._dir_index = {}
+            if self.filename:
+                try:
+                    with open(self.filename + fsnative(u".dirs"), "rb") as h:
+                        self._dir_index = pickle_loads(h.read())
+                except EnvironmentError:
+                    pass
+                except pickle.UnpicklingError:
+                    util.print_exc()
+        return self._dir_index
+
+    def _set_dir_index(self, index):
+        self._dir_index = index
+        if self.filename:
+            try:
+                with atomic_save(self.filename + fsnative(u".dirs"), "wb") as h:
+                    h.write(pickle_dumps(index, 2))
+            except EnvironmentError:
+                util.print_exc()
+
+    def _forget_dirs(self, dirs):
+        """Makes the next scan look at all files in `dirs` (real paths)
+        again"""
+
+        if self._dirs_forgotten is not None:
+            self._dirs_forgotten.update(dirs)
+        for dir_ in dirs:
+            self._dir_states.pop(dir_, None)
+        index = self._get_dir_index()
+        if any(dir_ in index for dir_ in dirs):
+            index = dict(index)
+            for dir_ in dirs:
+                index.pop(dir_, None)
+            self._set_dir_index(index)
+
+    def scan(self, paths, exclude=[], cofuncid=None, force=False):
+        """Adds new files in `paths` to the library.
+
+        Directories which didn't change since the last complete scan get
+        skipped, unless `force` is True.
+        """
 
         def need_yield(last_yield=[0]):
             current = time.time()
@@ -720,8 +1562,14 @@ class FileLibrary(PicklingLibrary):
                 return True
             return False
 
-        # first scan each path for new files
+        # first scan each path for new files. Only remember the state of
+        # the directories once all new files in them are added.
+        index = {} if force else {**self._get_dir_index(),
+                                  **self._dir_states}
+        states = {}
+        self._dirs_forgotten = set()
         paths_to_load = []
+        dirs_to_load = []
         for scan_path in paths:
             print_d(f"Scanning {scan_path}", self._name)
             desc = _("Scanning %s") % (fsn2text(unexpand(scan_path)))
@@ -729,7 +1577,8 @@ class FileLibrary(PicklingLibrary):
                 if cofuncid:
                     task.copool(cofuncid)
 
-                for real_path in iter_paths(scan_path, exclude=exclude):
+                for dirname, real_path in _walk_paths(
+                        scan_path, exclude, True, index, states):
                     if need_yield():
                         task.pulse()
                         yield
@@ -740,6 +1589,7 @@ class FileLibrary(PicklingLibrary):
                     if self.contains_filename(real_path):
                         continue
                     paths_to_load.append(real_path)
+                    dirs_to_load.append(dirname)
 
         yield
 
@@ -749,21 +1599,83 @@ class FileLibrary(PicklingLibrary):
                 task.copool(cofuncid)
 
             added = []
-            for real_path in task.gen(paths_to_load):
-                item = self.add_filename(real_path, False)
-                if item is not None:
-                    added.append(item)
-                    if len(added) > 100 or need_added():
-                        self.add(added)
-                        added = []
-                        yield
-                if added and need_yield():
+            done = 0
+            for items in self._read_items(paths_to_load):
+                if items:
+                    for i, item in enumerate(items, done):
+                        if item is None:
+                            # try again next time
+                            states.pop(dirs_to_load[i], None)
+                    done += len(items)
+                    task.update(float(done) / len(paths_to_load))
+                    added.extend(item for item in items if item is not None)
+                if added and (len(added) > 100 or need_added()):
+                    self.add(added)
+                    added = []
+                    yield
+                elif need_yield():
                     yield
             if added:
                 self.add(added)
                 added = []
                 yield True
 
+        # changed while scanning, see _forget_dirs()
+        for dirname in self._dirs_forgotten:
+            states.pop(dirname, None)
+        self._dirs_forgotten = None
+        if force:
+            self._set_dir_index({})
+            self._dir_states = {}
+        # stored with the next save(), once the new songs are
+        self._dir_states.update(states)
+        if not self.dirty:
+            self._save_dir_states()
+
+    def _read_items(self, paths):
+        """Reads the files in worker threads (see the "scan_workers"
+        option) using `add_filename()`.
+
+        Yields lists of results in the order of `paths`, empty while the
+        next file is still being read. Closing the generator, e.g. when
+        the scan gets stopped, drops all files not being read yet.
+        """
+
+        workers = _get_workers()
+        paths = iter(paths)
+        pending = deque()
+        executor = ThreadPoolExecutor(workers)
+        try:
+            while True:
+                # only read a bit ahead, so pausing and stopping take
+                # effect soon and we don't hold too many unadded items
+                while len(pending) < workers * 4:
+                    path = next(paths, None)
+                    if path is None:
+                        break
+                    pending.append(
+                        executor.submit(self.add_filename, path, False))
+                if not pending:
+                    break
+
+                # don't block the main loop for too long
+                wait([pending[0]], timeout=0.015)
+                items = []
+                while pending and pending[0].done():
+                    try:
+                        items.append(pending.popleft().result())
+                    except Exception:
+                        util.print_exc()
+                        items.append(None)
+                yield items
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _is_persisted(self, key):
+        return key in self._contents or bool(self.masked(key))
+
     def get_content(self):
         """Return visible and masked items"""
 
@@ -821,7 +1733,8 @@ class FileLibrary(PicklingLibrary):
     def remove_masked(self, mount_point):
         """Remove all songs for a masked point"""
 
-        self._masked.pop(mount_point, {})
+        items = self._masked.pop(mount_point, {})
+        self._forget_keys(items.keys())
 
 
 class SongFileLibrary(SongLibrary, FileLibrary):
@@ -831,6 +1744,13 @@ class SongFileLibrary(SongLibrary, FileLibrary):
     def __init__(self, name=None):
         print_d(f"Initializing {type(self)}: {name!r}")
         super().__init__(name)
+        self.connect('removed', self.__songs_removed)
+
+    def __songs_removed(self, library, songs):
+        # so that scanning adds them again, like it used to
+        self._forget_dirs(
+            {os.path.realpath(os.path.dirname(song("~filename")))
+             for song in songs if isinstance(song, AudioFile)})
 
     def contains_filename(self, filename):
         key = normalize_path(filename, True)
@@ -0,0 +1,563 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""File formats for persisting the content of a library.
+
+`PickleStorage` keeps all items in one pickle file and appends changes to a
+journal next to it until they get merged back. `SQLiteStorage` keeps one
+row per item in an SQLite database, so changes can be written in place,
+and can load rarely used tags on demand.
+"""
+
+import importlib
+import os
+import pickle
+import shutil
+import sqlite3
+import sys
+import threading
+
+from quodlibet import util
+from quodlibet.formats import (load_audio_files, dump_audio_files,
+                               SerializationError)
+from quodlibet.formats._serialize import shared_value
+from quodlibet.library.journal import LibraryJournal
+from quodlibet.util.atomic import atomic_save
+from quodlibet.util.dprint import print_d, print_w
+from quodlibet.util.path import mkdir, mtime
+from quodlibet.util.picklehelper import pickle_loads, pickle_dumps
+from senf import fsnative
+
+
+class LibraryStorage:
+    """A file containing library items"""
+
+    lazy = False
+    """If loaded items can be missing tags until they are needed"""
+
+    def __init__(self, filename):
+        assert isinstance(filename, fsnative)
+
+        self.filename = filename
+
+    @property
+    def mtime(self):
+        """The time of the last save, 0 if unknown"""
+
+        return mtime(self.filename)
+
+    def load(self):
+        """Load all items.
+
+        In case of an error returns an empty list.
+
+        Returns:
+            List[AudioFile]
+        """
+
+        raise NotImplementedError
+
+    def write(self, items):
+        """Replace the stored items with `items`
+
+        Raises:
+            SerializationError
+            EnvironmentError
+        """
+
+        raise NotImplementedError
+
+    def update(self, removed, items):
+        """Remove the items for the keys in `removed`, then add or replace
+        `items`.
+
+        Raises:
+            SerializationError
+            EnvironmentError
+        """
+
+        raise NotImplementedError
+
+    def needs_write(self, compact):
+        """If the next save should `write` everything instead of passing
+        only the changes to `update`.
+
+        Args:
+            compact (bool): if a full write is preferred
+        """
+
+        return True
+
+    def close(self):
+        """Release any resources, the storage can still be used afterwards"""
+
+        pass
+
+    def _move_invalid(self):
+        # move the broken file out of the way
+        try:
+            shutil.copy(self.filename, self.filename + ".not-valid")
+        except EnvironmentError:
+            util.print_exc()
+
+
+class PickleStorage(LibraryStorage):
+    """A pickled list of all items plus a journal of later changes"""
+
+    journal_min_size = 4 * 1024 * 1024
+    """Journals smaller than this never trigger a compaction"""
+
+    journal_max_ratio = 0.5
+    """Compact once the journal is bigger than this fraction of the
+    library file"""
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self.journal = LibraryJournal(filename)
+
+    @property
+    def mtime(self):
+        return max(mtime(self.filename), mtime(self.journal.filename))
+
+    def load(self):
+        try:
+            with open(self.filename, "rb") as fp:
+                data = fp.read()
+        except EnvironmentError:
+            print_w("Couldn't load library file from: %r" % self.filename)
+            return self.journal.replay([])
+
+        try:
+            items = load_audio_files(data)
+        except SerializationError:
+            # there are too many ways this could fail
+            util.print_exc()
+            self._move_invalid()
+            return self.journal.replay([])
+
+        return self.journal.replay(items)
+
+    def write(self, items):
+        mkdir(os.path.dirname(self.filename))
+        with atomic_save(self.filename, "wb") as fileobj:
+            fileobj.write(dump_audio_files(items))
+            fileobj.flush()
+            # Replaying the journal on top of the new file could revert
+            # newer changes, so mark which file contains them in case we
+            # crash before the journal is gone.
+            self.journal.mark_base(os.fstat(fileobj.fileno()))
+        self.journal.clear()
+
+    def update(self, removed, items):
+        self.journal.append(removed, items)
+
+    def needs_write(self, compact):
+        if compact:
+            return True
+        size = self.journal.size
+        if size < self.journal_min_size:
+            return False
+        try:
+            base_size = os.path.getsize(self.filename)
+        except EnvironmentError:
+            return True
+        return size > base_size * self.journal_max_ratio
+
+
+HOT_TAGS = {
+    "title", "version", "artist", "albumartist", "album", "discsubtitle",
+    "date", "originaldate", "genre", "tracknumber", "discnumber", "composer",
+    "performer", "conductor", "grouping", "artistsort", "albumartistsort",
+    "albumsort", "titlesort", "composersort", "performersort",
+    "musicbrainz_albumid", "musicbrainz_artistid", "labelid",
+    "album_grouping_key", "website",
+}
+"""Tags which get loaded at startup when loading lazily, in addition to
+all internal ones (starting with '~')"""
+
+
+def _split_tags(values):
+    hot = {}
+    cold = {}
+    for key, value in values.items():
+        if key[:1] == "~" or key in HOT_TAGS:
+            hot[key] = value
+        else:
+            cold[key] = value
+    return hot, cold
+
+
+class LazyItemMixin:
+    """Gets mixed into the type of items which are missing some tags.
+
+    The names of the missing tags are stored with the item. As soon as
+    any of them is needed, or the item is used as a whole, all of them get
+    loaded from the storage and the item gets its real type back.
+    """
+
+    _storage = None
+    _real_type = None
+
+    def _fault(self):
+        storage = self._storage
+        # other threads keep seeing the tags as missing and wait here
+        # until they are loaded, instead of seeing them as not set
+        with storage._lock:
+            missing = self.__dict__.get("_lazy_keys")
+            if missing is None:
+                return
+            for key, value in storage.load_missing(self.key).items():
+                # values set in the meantime are newer
+                if key in missing and not dict.__contains__(self, key):
+                    dict.__setitem__(self, key, value)
+            self.__class__ = self._real_type
+            pop = self.__dict__.pop
+            pop("_lazy_keys")
+            # could be based on the tags looking unset
+            pop("album_key", None)
+            pop("sort_key", None)
+            pop("_synthetic", None)
+            pop("revision", None)
+
+    def _is_missing(self, key):
+        return key in self.__dict__.get("_lazy_keys", ())
+
+    def __call__(self, key, *args, **kwargs):
+        real_type = self._real_type
+        if self._is_missing(key):
+            self._fault()
+        return real_type.__call__(self, key, *args, **kwargs)
+
+    def __getitem__(self, key):
+        if self._is_missing(key):
+            self._fault()
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if self._is_missing(key):
+            self._fault()
+        return dict.get(self, key, default)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or self._is_missing(key)
+
+    def __iter__(self):
+        yield from list(dict.__iter__(self))
+        yield from self.__dict__.get("_lazy_keys", ())
+
+    def __len__(self):
+        return dict.__len__(self) + len(self.__dict__.get("_lazy_keys", ()))
+
+    def __setitem__(self, key, value):
+        real_type = self._real_type
+        if self._is_missing(key):
+            self._fault()
+        real_type.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        real_type = self._real_type
+        if self._is_missing(key):
+            self._fault()
+        real_type.__delitem__(self, key)
+
+    def pop(self, key, *args):
+        if self._is_missing(key):
+            self._fault()
+        return self._real_type.pop(self, key, *args)
+
+    def setdefault(self, key, default=None):
+        if self._is_missing(key):
+            self._fault()
+        return self._real_type.setdefault(self, key, default)
+
+    def clear(self):
+        self.__dict__.pop("_lazy_keys", None)
+        self.__class__ = self._real_type
+        self.clear()
+
+    def _whole(name):
+        def func(self, *args, **kwargs):
+            self._fault()
+            return getattr(self, name)(*args, **kwargs)
+        return func
+
+    keys = _whole("keys")
+    values = _whole("values")
+    items = _whole("items")
+    copy = _whole("copy")
+    update = _whole("update")
+    popitem = _whole("popitem")
+    __repr__ = _whole("__repr__")
+    __reduce_ex__ = _whole("__reduce_ex__")
+
+    del _whole
+
+
+def _is_corrupt(error):
+    """If the database can't be used anymore, in contrast to temporary
+    errors like it being locked"""
+
+    if not isinstance(error, sqlite3.DatabaseError):
+        return False
+    message = str(error)
+    return "malformed" in message or "not a database" in message
+
+
+def _encode_key(key):
+    if isinstance(key, str):
+        return key.encode("utf-8", "surrogatepass")
+    return pickle_dumps(key, 2)
+
+
+def _type_name(type_):
+    return "%s.%s" % (type_.__module__, type_.__name__)
+
+
+class SQLiteStorage(LibraryStorage):
+    """An SQLite database containing one row per item.
+
+    Each row contains the pickled tags of one item, so changing an item
+    only rewrites its own row. Tags not in `HOT_TAGS` are stored
+    separately, so that with `lazy` they only get loaded once needed.
+    """
+
+    EXTENSION = fsnative(u".sqlite")
+
+    # the database and the files SQLite keeps next to it in WAL mode
+    _SUFFIXES = [fsnative(u""), fsnative(u"-wal"), fsnative(u"-shm")]
+
+    def __init__(self, filename, lazy=False):
+        super().__init__(filename)
+        self.lazy = lazy
+        self._conn = None
+        # if loading failed without the database being broken
+        self._failed = False
+        self._lazy_types = {}
+        # missing tags can get loaded from any thread
+        self._lock = threading.RLock()
+
+    @property
+    def mtime(self):
+        return max(mtime(self.filename),
+                   mtime(self.filename + fsnative(u"-wal")))
+
+    def _connect(self):
+        if self._conn is None:
+            mkdir(os.path.dirname(self.filename))
+            conn = sqlite3.connect(self.filename, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                "key BLOB PRIMARY KEY, type TEXT NOT NULL, data BLOB NOT NULL, "
+                "extra BLOB, extra_keys BLOB)")
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _move_invalid(self):
+        # committed changes can still be in the WAL file, keep all of them
+        for suffix in self._SUFFIXES:
+            source = self.filename + suffix
+            if not os.path.exists(source):
+                continue
+            try:
+                shutil.copy(source, self.filename + ".not-valid" + suffix)
+            except EnvironmentError:
+                util.print_exc()
+
+    def _check_loaded(self):
+        if self._failed:
+            raise EnvironmentError(
+                "%r couldn't be loaded, not saving" % self.filename)
+
+    def _get_lazy_type(self, type_):
+        try:
+            return self._lazy_types[type_]
+        except KeyError:
+            lazy_type = type(type_.__name__, (LazyItemMixin, type_), {
+                "_storage": self, "_real_type": type_})
+            self._lazy_types[type_] = lazy_type
+            return lazy_type
+
+    def load(self):
+        if self.lazy:
+            query = "SELECT type, data, extra_keys FROM items"
+        else:
+            query = "SELECT type, data, extra FROM items"
+
+        try:
+            with self._lock:
+                rows = self._connect().execute(query).fetchall()
+        except (sqlite3.Error, EnvironmentError) as e:
+            util.print_exc()
+            self.close()
+            if not _is_corrupt(e):
+                # e.g. locked by another instance, don't touch anything
+                # and don't save over it either
+                self._failed = True
+                return []
+            self._move_invalid()
+            # start over with an empty database
+            for suffix in self._SUFFIXES:
+                try:
+                    os.unlink(self.filename + suffix)
+                except EnvironmentError:
+                    pass
+            return []
+
+        types = {}
+        items = []
+        intern = sys.intern
+        # share equal keys and values, like load_audio_files()
+        pool = {}
+        for type_name, data, extra in rows:
+            try:
+                type_ = types[type_name]
+            except KeyError:
+                module, name = type_name.rsplit(".", 1)
+                try:
+                    type_ = getattr(importlib.import_module(module), name)
+                except (ImportError, AttributeError):
+                    print_w("Skipping items of unknown type %r" % type_name)
+                    type_ = None
+                types[type_name] = type_
+            if type_ is None:
+                continue
+
+            try:
+                values = pickle_loads(data)
+                if extra is not None:
+                    extra = pickle_loads(extra)
+            except pickle.UnpicklingError:
+                util.print_exc()
+                continue
+
+            # like unpickling, don't go through __init__ and __setitem__
+            if extra is None:
+                item = dict.__new__(type_)
+            elif self.lazy:
+                item = dict.__new__(self._get_lazy_type(type_))
+                item.__dict__["_lazy_keys"] = tuple(map(intern, extra))
+            else:
+                item = dict.__new__(type_)
+                values.update(extra)
+            values = {intern(k): shared_value(pool, v)
+                      for k, v in values.items()}
+            dict.update(item, values)
+            items.append(item)
+
+        print_d("Loaded %d items from %r" % (len(items), self.filename))
+        return items
+
+    def load_missing(self, key):
+        """Returns the tags of an item which weren't loaded lazily"""
+
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT extra FROM items WHERE key = ?",
+                    (_encode_key(key),)).fetchone()
+            if row is not None and row[0] is not None:
+                return pickle_loads(row[0])
+        except (sqlite3.Error, pickle.UnpicklingError):
+            util.print_exc()
+        return {}
+
+    def _rows(self, items):
+        rows = []
+        try:
+            for item in items:
+                # loads everything in case the item is lazy
+                hot, cold = _split_tags(dict(item))
+                if cold:
+                    extra = pickle_dumps(cold, 2)
+                    extra_keys = pickle_dumps(tuple(cold.keys()), 2)
+                else:
+                    extra = extra_keys = None
+                rows.append((_encode_key(item.key), _type_name(type(item)),
+                             pickle_dumps(hot, 2), extra, extra_keys))
+        except pickle.PicklingError as e:
+            raise SerializationError(e)
+        return rows
+
+    def write(self, items):
+        self._check_loaded()
+        rows = self._rows(items)
+        try:
+            with self._lock, self._connect() as conn:
+                conn.execute("DELETE FROM items")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO items VALUES (?,?,?,?,?)", rows)
+        except sqlite3.Error as e:
+            raise SerializationError(e)
+
+    def update(self, removed, items):
+        self._check_loaded()
+        rows = self._rows(items)
+        try:
+            with self._lock, self._connect() as conn:
+                conn.executemany("DELETE FROM items WHERE key = ?",
+                                 [(_encode_key(k),) for k in removed])
+                conn.executemany(
+                    "INSERT OR REPLACE INTO items VALUES (?,?,?,?,?)", rows)
+        except sqlite3.Error as e:
+            raise SerializationError(e)
+
+    def needs_write(self, compact):
+        # everything gets updated in place
+        return False
+
+
+def get_storage(filename, lazy=False):
+    """Returns a `LibraryStorage` for `filename` based on its extension.
+
+    If `lazy` is True and the format supports it, only the `HOT_TAGS`
+    get loaded at first.
+    """
+
+    if filename.endswith(SQLiteStorage.EXTENSION):
+        return SQLiteStorage(filename, lazy)
+    return PickleStorage(filename)
+
+
+def migrate_storage(source, target):
+    """Copies all items from the library file `source` to `target`,
+    which may use a different format.
+
+    Raises:
+        SerializationError
+        EnvironmentError
+    """
+
+    print_d("Migrating library from %r to %r" % (source, target))
+
+    # so a failed migration doesn't leave a usable looking target behind
+    base, ext = os.path.splitext(target)
+    temp = base + fsnative(u".migrating") + ext
+
+    def remove_temp():
+        for path in [temp, temp + fsnative(u"-wal"), temp + fsnative(u"-shm"),
+                     temp + fsnative(u".journal")]:
+            try:
+                os.unlink(path)
+            except EnvironmentError:
+                pass
+
+    remove_temp()
+    target_storage = get_storage(temp)
+    try:
+        target_storage.write(get_storage(source).load())
+        target_storage.close()
+        os.replace(temp, target)
+    except Exception:
+        target_storage.close()
+        remove_temp()
+        raise
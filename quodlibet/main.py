@@ -109,6 +109,7 @@ def main(argv=None):
     from quodlibet.util.cover import CoverManager
     app.cover_manager = CoverManager()
     app.cover_manager.init_plugins()
+    app.cover_manager.init_cache(library.librarian)
 
     from quodlibet.plugins.playlist import PLAYLIST_HANDLER
     PLAYLIST_HANDLER.init_plugins()
@@ -210,6 +211,7 @@ def main(argv=None):
 
     tracker.destroy()
     quodlibet.library.save()
+    app.cover_manager.save_cache()
 
     config.save()
 
@@ -5,7 +5,7 @@
 
 from ._pattern import (Pattern, FileFromPattern, XMLFromPattern,
     XMLFromMarkupPattern, error,
-    ArbitraryExtensionFileFromPattern, URLFromPattern)
+    ArbitraryExtensionFileFromPattern, URLFromPattern, forget_formatted)
 
 
 URLFromPattern
@@ -15,3 +15,4 @@ Pattern
 XMLFromMarkupPattern
 XMLFromPattern
 error
+forget_formatted
@@ -13,6 +13,8 @@
 
 import os
 import re
+import threading
+from collections import OrderedDict
 from re import Scanner  # type: ignore
 from urllib.parse import quote_plus
 
@@ -26,6 +28,10 @@ from quodlibet.formats._audio import decode_value, FILESYSTEM_TAGS
 # Token types.
 (OPEN, CLOSE, TEXT, COND, EOF) = range(5)
 
+VOLATILE_TAGS = {"~#rating", "~rating", "~lyrics", "~playlists"}
+"""Tags which can change without the song changing, patterns using them
+don't get their output remembered"""
+
 
 class error(ValueError):
     pass
@@ -181,16 +187,83 @@ class PatternParser:
             self.lookahead = PatternLexeme(EOF, "")
 
 
+class _RenderCache:
+    """Remembers what patterns returned for the most recently formatted
+    songs, as long as the songs don't change.
+
+    Songs (and albums) provide a `revision` attribute for that, which gets
+    replaced by a new object whenever they change. Everything else doesn't
+    get remembered.
+
+    Thread-safe, e.g. for cover sources formatting patterns in threads.
+    """
+
+    def __init__(self, max_songs):
+        self.max_songs = max_songs
+        self._lock = threading.Lock()
+        # id(song) -> (song, revision, {key: value})
+        self._songs = OrderedDict()
+
+    def __len__(self):
+        return len(self._songs)
+
+    def get(self, song):
+        """Returns a dict for storing values for the song as it is now, or
+        None if it can't be remembered.
+        """
+
+        revision = getattr(song, "revision", None)
+        if revision is None:
+            return None
+        with self._lock:
+            songs = self._songs
+            entry = songs.get(id(song))
+            if entry is None:
+                if len(songs) >= self.max_songs:
+                    songs.popitem(last=False)
+            elif entry[0] is song and entry[1] is revision:
+                songs.move_to_end(id(song))
+                return entry[2]
+            entry = songs[id(song)] = (song, revision, {})
+            return entry[2]
+
+    def forget(self, songs=None):
+        """Forget the values for the passed songs, or for all songs"""
+
+        with self._lock:
+            if songs is None:
+                self._songs.clear()
+                return
+            pop = self._songs.pop
+            for song in songs:
+                pop(id(song), None)
+
+
+_render_cache = _RenderCache(5000)
+
+
+def forget_formatted(songs=None):
+    """Forget what patterns returned for the passed songs (or for all songs
+    if None), e.g. after they got changed or removed from the library.
+
+    Changed songs don't get formatted from memory anyway, this mainly frees
+    the memory.
+    """
+
+    _render_cache.forget(songs)
+
+
 class PatternFormatter:
     _format = None
     _post = None
     _text = None
 
-    def __init__(self, func, list_func, tags):
+    def __init__(self, func, list_func, tags, cached=False):
         self.__func = func
         self.__list_func = list_func
         self.tags = util.list_unique(tags)
-        self.format(self.Dummy())  # Validate string
+        self.__cached = cached
+        self.__format(self.Dummy())  # Validate string
 
     class Dummy(dict):
 
@@ -242,6 +315,24 @@ class PatternFormatter:
             return values
 
     def format(self, song):
+        if self.__cached:
+            values = _render_cache.get(song)
+            if values is not None:
+                try:
+                    return values[self]
+                except KeyError:
+                    value = values[self] = self.__format(song)
+                    return value
+        return self.__format(song)
+
+    def format_songs(self, songs):
+        """Like format(), but returns a list of values for all passed songs
+        """
+
+        format_ = self.format
+        return [format_(song) for song in songs]
+
+    def __format(self, song):
         value = u"".join(self.__func(self.SongProxy(song, self._format)))
         if self._post:
             return self._post(value, song)
@@ -252,6 +343,18 @@ class PatternFormatter:
         combinations always returns pairs of display and sort values. The
         returned set will never be empty (e.g. for an empty pattern).
         """
+        if self.__cached:
+            values = _render_cache.get(song)
+            if values is not None:
+                key = (self, "list")
+                try:
+                    return values[key]
+                except KeyError:
+                    value = values[key] = self.__format_list(song)
+                    return value
+        return self.__format_list(song)
+
+    def __format_list(self, song):
         vals = [(u"", u"")]
         for val in self.__list_func(self.SongProxy(song, self._format)):
             if not val:
@@ -361,14 +464,40 @@ class PatternCompiler:
         return text
 
 
+def _is_volatile_tag(tag):
+    if tag[:1] == "~" and "~" in tag[1:]:
+        return any(map(_is_volatile_tag, util.tagsplit(tag)))
+    return tag in VOLATILE_TAGS
+
+
+def _is_volatile(node):
+    """If the output can change without the song changing"""
+
+    if isinstance(node, PatternNode):
+        return any(map(_is_volatile, node.children))
+    elif isinstance(node, TagNode):
+        return _is_volatile_tag(node.tag)
+    elif isinstance(node, ConditionNode):
+        # queries can depend on anything, e.g. the current time
+        if Query.StrictQueryMatcher(node.expr) is not None:
+            return True
+        return _is_volatile_tag(node.expr) or _is_volatile(node.ifcase) or \
+            (node.elsecase is not None and _is_volatile(node.elsecase))
+    return False
+
+
 def Pattern(string, Kind=PatternFormatter, MAX_CACHE_SIZE=100, cache={}):
     if (Kind, string) not in cache:
         if len(cache) > MAX_CACHE_SIZE:
             cache.clear()
-        comp = PatternCompiler(PatternParser(PatternLexer(string)))
+            # the values of the dropped patterns are of no use anymore
+            _render_cache.forget()
+        parser = PatternParser(PatternLexer(string))
+        comp = PatternCompiler(parser)
         func, tags = comp.compile("comma", Kind._text)
         list_func, tags = comp.compile("list_separate", Kind._text)
-        cache[(Kind, string)] = Kind(func, list_func, tags)
+        cached = not _is_volatile(parser.node)
+        cache[(Kind, string)] = Kind(func, list_func, tags, cached)
     return cache[(Kind, string)]
 
 
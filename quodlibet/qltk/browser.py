@@ -292,6 +292,7 @@ class LibraryBrowser(Window, util.InstanceTracker, PersistentWindowMixin):
         bottom.show()
 
         browser.connect('songs-selected', self.__browser_cb)
+        browser.connect('songs-added', self.__browser_added_cb)
         browser.finalize(False)
         view.connect('popup-menu', self.__menu, library)
         view.connect('drag-data-received', self.__drag_data_recv)
@@ -311,12 +312,21 @@ class LibraryBrowser(Window, util.InstanceTracker, PersistentWindowMixin):
         self._filter_menu.destroy()
 
     def __browser_cb(self, browser, songs, sorted):
+        if browser.completes_added:
+            return
         if browser.background:
             bg = background_filter()
             if bg:
                 songs = list(filter(bg, songs))
         self.songlist.set_songs(songs, sorted)
 
+    def __browser_added_cb(self, browser, songs):
+        if browser.background:
+            bg = background_filter()
+            if bg:
+                songs = list(filter(bg, songs))
+        self.songlist.add_songs(songs)
+
     def __enqueue(self, view, path, column, player):
         app.window.playlist.enqueue([view.get_model()[path][0]])
         if player.song is None:
@@ -1105,6 +1105,7 @@ class QuodLibetWindow(Window, PersistentWindowMixin, AppWindow):
         self.browser = Browser(library)
         self.browser.connect('songs-selected',
             self.__browser_cb, library, player)
+        self.browser.connect('songs-added', self.__browser_added_cb)
         self.browser.connect('songs-activated', self.__browser_activate)
         if restore:
             self.browser.restore()
@@ -1330,18 +1331,27 @@ class QuodLibetWindow(Window, PersistentWindowMixin, AppWindow):
     def __browser_activate(self, browser):
         app.player._reset()
 
-    def __browser_cb(self, browser, songs, sorted, library, player):
+    def __browser_added_cb(self, browser, songs):
         if browser.background:
             bg = background_filter()
             if bg:
                 songs = list(filter(bg, songs))
-        self.songlist.set_songs(songs, sorted)
+        self.songlist.add_songs(songs)
+
+    def __browser_cb(self, browser, songs, sorted, library, player):
+        if not browser.completes_added:
+            if browser.background:
+                bg = background_filter()
+                if bg:
+                    songs = list(filter(bg, songs))
+            self.songlist.set_songs(songs, sorted)
 
         # After the first time the browser activates, which should always
         # happen if we start up and restore, restore the playing song.
         # Because the browser has send us songs we can be sure it has
-        # registered all its libraries.
-        if self.__first_browser_set:
+        # registered all its libraries. Wait for all of them, so the
+        # playlist is complete.
+        if self.__first_browser_set and not browser.partial:
             self.__first_browser_set = False
 
             song = library.librarian.get(config.get("memory", "song"))
@@ -253,6 +253,11 @@ class LimitSearchBarBox(SearchBarBox):
     def __limit_changed(self, *args):
         self.changed()
 
+    @property
+    def limited(self):
+        """Whether limit() only returns some of the songs"""
+        return self.__limit.get_visible()
+
     def limit(self, songs):
         if self.__limit.get_visible():
             return limit_songs(songs, self.__limit.value,
@@ -9,6 +9,10 @@
 # the Free Software Foundation; either version 2 of the License, or
 # (at your option) any later version.
 
+from bisect import bisect_right
+from functools import partial
+from itertools import accumulate, filterfalse, repeat
+from operator import add, mul, ne, sub
 from typing import List, Tuple
 
 from gi.repository import Gtk, GLib, Gdk, GObject
@@ -34,7 +38,7 @@ from quodlibet.qltk.delete import trash_songs
 from quodlibet.formats._audio import TAG_TO_SORT, AudioFile
 from quodlibet.qltk.x import SeparatorMenuItem
 from quodlibet.qltk.songlistcolumns import create_songlist_column, SongListColumn
-from quodlibet.util import connect_destroy
+from quodlibet.util import connect_destroy, human_sort_key as human
 
 
 DND_QL, DND_URI_LIST = range(2)
@@ -137,35 +141,43 @@ def set_columns(vals):
     config.setstringlist("settings", "columns", vals)
 
 
+# sort keys to use instead of these tags, empty for the default one
+_SORT_REPLACE_ORDER = {
+    "~#track": "",
+    "~#disc": "",
+    "~length": "~#length"
+}
+
+
+def get_sort_pattern(tag):
+    """Returns the pattern to sort by for the given pattern column tag"""
+
+    for key, value in _SORT_REPLACE_ORDER.items():
+        tag = tag.replace("<%s>" % key, "<%s>" % value)
+    for key, value in TAG_TO_SORT.items():
+        tag = tag.replace("<%s>" % key,
+                           "<{1}|<{1}>|<{0}>>".format(key, value))
+    return Pattern(tag)
+
+
 def get_sort_tag(tag):
     """Returns a tag that can be used for sorting for the given column tag.
 
     Returns '' if the default sort key should be used.
     """
 
-    replace_order = {
-        "~#track": "",
-        "~#disc": "",
-        "~length": "~#length"
-    }
-
     if tag == "~title~version":
         tag = "title"
     elif tag == "~album~discsubtitle":
         tag = "album"
 
     if "<" in tag:
-        for key, value in replace_order.items():
-            tag = tag.replace("<%s>" % key, "<%s>" % value)
-        for key, value in TAG_TO_SORT.items():
-            tag = tag.replace("<%s>" % key,
-                               "<{1}|<{1}>|<{0}>>".format(key, value))
-        tag = Pattern(tag).format
+        tag = get_sort_pattern(tag).format
     else:
         tags = util.tagsplit(tag)
         sort_tags = []
         for tag in tags:
-            tag = replace_order.get(tag, tag)
+            tag = _SORT_REPLACE_ORDER.get(tag, tag)
             tag = TAG_TO_SORT.get(tag, tag)
             if tag not in sort_tags:
                 sort_tags.append(tag)
@@ -187,6 +199,77 @@ def header_tag_split(header):
         return util.tagsplit(header)
 
 
+class SortRanks:
+    """Caches the sort keys of songs for one tag, together with their rank
+    among all the songs seen so far.
+
+    Sorting by the rank gives the same order as sorting by the key, but
+    comparing numbers is a lot faster than comparing (nested) sort keys.
+    """
+
+    def __init__(self, key_func, keys_func=None):
+        """`keys_func(songs)` can return the keys of many songs at once,
+        instead of calling `key_func(song)` for each.
+        """
+
+        if keys_func is None:
+            keys_func = partial(map, key_func)
+        self._keys_func = keys_func
+        # songs are keyed by id() since hashing them is slow
+        self._songs = {}
+        self._keys = {}
+        self._ranks = {}
+        self._order = []
+        self._count = 0
+
+    def forget(self, songs):
+        """Forget the keys of the passed songs, e.g. after they changed"""
+
+        for song in songs:
+            self._songs.pop(id(song), None)
+            self._keys.pop(id(song), None)
+
+    @property
+    def count(self):
+        """The number of different ranks, after the last `get`"""
+
+        return self._count
+
+    def get(self, songs):
+        """Returns a list of ranks for the passed songs"""
+
+        keys = self._keys
+        ids = list(map(id, songs))
+        if len(self._ranks) == len(keys):
+            try:
+                return list(map(self._ranks.__getitem__, ids))
+            except KeyError:
+                pass
+
+        missing = list(dict.fromkeys(filterfalse(keys.__contains__, ids)))
+        self._songs.update(zip(ids, songs))
+        new = list(map(self._songs.__getitem__, missing))
+        keys.update(zip(missing, self._keys_func(new)))
+        get_key = keys.__getitem__
+
+        # merging the new songs into the sorted ones is cheap
+        order = list(filter(keys.__contains__, self._order))
+        if order:
+            missing.sort(key=get_key)
+        order.extend(missing)
+        order.sort(key=get_key)
+
+        # equal keys get the same rank
+        sorted_keys = list(map(get_key, order))
+        ranks = [0]
+        ranks.extend(accumulate(map(ne, sorted_keys[1:], sorted_keys)))
+
+        self._order = order
+        self._ranks = dict(zip(order, ranks))
+        self._count = ranks[-1] + 1
+        return list(map(self._ranks.__getitem__, ids))
+
+
 class SongListDnDMixin:
     """DnD support for the SongList class"""
 
@@ -409,6 +492,8 @@ class SongList(AllTreeView, SongListDnDMixin, DragScroll,
         # A priority list of how to apply the sort keys.
         # might contain column header names not present...
         self._sort_sequence = []
+        # sort tag -> SortRanks, for the currently sorted columns
+        self.__sort_ranks = {}
         self.set_column_headers(self.headers)
         librarian = library.librarian or library
 
@@ -747,33 +832,100 @@ class SongList(AllTreeView, SongListDnDMixin, DragScroll,
             return []
         return model.get()
 
-    def _sort_songs(self, songs):
-        """Sort passed songs in place based on the column sort orders"""
+    def _get_sort_passes(self):
+        """Returns a list of (tags, reverse) for sorting songs in the column
+        sort orders, with one stable sort per entry, by the tags from last
+        to first.
+        """
 
-        last_tag = None
-        last_order = None
-        first = True
-        for tag, reverse in self.get_sort_orders():
-            tag = get_sort_tag(tag)
+        passes = []
+        last = None
+        for header, reverse in self.get_sort_orders():
+            tag = get_sort_tag(header)
+            if not isinstance(tag, str):
+                tag = header
 
             # always sort using the default sort key first
-            if first:
-                first = False
-                songs.sort(key=lambda s: s.sort_key, reverse=reverse)
-                last_order = reverse
-                last_tag = ""
+            if not passes:
+                passes.append(([""], reverse))
+                last = ("", reverse)
 
             # no need to sort twice in a row with the same key/order
-            if tag == last_tag and last_order == reverse:
+            if (tag, reverse) == last:
                 continue
-            last_order = reverse
-            last_tag = tag
+            last = (tag, reverse)
 
+            # sorting by one key after another in the same direction is
+            # the same as sorting once by all of them
+            if passes[-1][1] == reverse:
+                passes[-1][0].append(tag)
+            else:
+                passes.append(([tag], reverse))
+        return passes
+
+    def _get_sort_ranks(self, tag):
+        """Returns the SortRanks for a tag or pattern, as returned by
+        `_get_sort_passes`.
+
+        The keys get cached until the songs change or the column isn't
+        sorted anymore.
+        """
+
+        ranks = self.__sort_ranks.get(tag)
+        if ranks is None:
+            keys_func = None
             if tag == "":
-                songs.sort(key=lambda s: s.sort_key, reverse=reverse)
+                def key_func(song):
+                    return song.sort_key
+            elif "<" in tag:
+                pattern = get_sort_pattern(tag)
+                key_func = AudioFile.sort_by_func(pattern.format)
+
+                # format all songs in one go
+                def keys_func(songs):
+                    return map(human, pattern.format_songs(songs))
             else:
-                sort_func = AudioFile.sort_by_func(tag)
-                songs.sort(key=sort_func, reverse=reverse)
+                key_func = AudioFile.sort_by_func(tag)
+            ranks = self.__sort_ranks[tag] = SortRanks(key_func, keys_func)
+        return ranks
+
+    def _get_sort_keys(self, songs):
+        """Returns a list of numbers to sort the songs by, which gives the
+        same order as sorting by all the sort passes one after another,
+        or None if nothing is sorted.
+        """
+
+        passes = self._get_sort_passes()
+
+        # forget the keys of columns no longer sorted
+        tags = {tag for tags, reverse in passes for tag in tags}
+        for tag in list(self.__sort_ranks):
+            if tag not in tags:
+                del self.__sort_ranks[tag]
+
+        # the last sorted tag decides first
+        keys = None
+        for tags, reverse in reversed(passes):
+            for tag in reversed(tags):
+                ranks = self._get_sort_ranks(tag)
+                values = ranks.get(songs)
+                count = ranks.count
+                if reverse:
+                    values = list(map(sub, repeat(count - 1), values))
+                if keys is None:
+                    keys = values
+                else:
+                    keys = list(map(add, map(mul, keys, repeat(count)), values))
+        return keys
+
+    def _sort_songs(self, songs):
+        """Sort passed songs in place based on the column sort orders"""
+
+        keys = self._get_sort_keys(songs)
+        if keys is None:
+            return
+        order = sorted(range(len(songs)), key=keys.__getitem__)
+        songs[:] = map(songs.__getitem__, order)
 
     def add_songs(self, songs):
         """Add songs to the list in the right order and position"""
@@ -790,14 +942,25 @@ class SongList(AllTreeView, SongListDnDMixin, DragScroll,
             model.append_many(songs)
             return
 
-        # FIXME: Replace with something fast
         old_songs = self.get_songs()
-        old_songs.extend(songs)
-
-        self._sort_songs(old_songs)
-
-        for index, song in sorted(zip(map(old_songs.index, songs), songs)):
-            model.insert(index, row=[song])
+        keys = self._get_sort_keys(old_songs + songs)
+        old_keys = keys[:len(old_songs)]
+        new_keys = keys[len(old_songs):]
+
+        # insert after equal songs, in the order they were passed
+        order = sorted(range(len(songs)), key=new_keys.__getitem__)
+        positions = [bisect_right(old_keys, new_keys[i]) for i in order]
+        new_songs = [songs[i] for i in order]
+
+        # insert songs ending up next to each other in one go
+        inserted = 0
+        start = 0
+        for end in range(1, len(new_songs) + 1):
+            if end == len(new_songs) or positions[end] != positions[start]:
+                model.insert_many(
+                    positions[start] + inserted, new_songs[start:end])
+                inserted += end - start
+                start = end
 
     def set_songs(self, songs, sorted=False, scroll=True, scroll_select=False):
         """Fill the song list.
@@ -898,11 +1061,17 @@ class SongList(AllTreeView, SongListDnDMixin, DragScroll,
         selection.selected_foreach(func, None)
         return songs
 
+    def __forget_sort_keys(self, songs):
+        for ranks in self.__sort_ranks.values():
+            ranks.forget(songs)
+
     def __song_updated(self, librarian, songs):
         """Only update rows that are currently displayed.
         Warning: This makes the row-changed signal useless.
         """
 
+        self.__forget_sort_keys(songs)
+
         vrange = self.get_visible_range()
         if vrange is None:
             return
@@ -927,6 +1096,8 @@ class SongList(AllTreeView, SongListDnDMixin, DragScroll,
             for song in songs:
                 player.remove(song)
 
+        self.__forget_sort_keys(songs)
+
         # The selected songs are removed from the library and should
         # be removed from the view.
 
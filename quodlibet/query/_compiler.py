@@ -0,0 +1,301 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Compiling queries to Python functions.
+
+Matching a query node by node means a method call for each node and song
+and working out the same things (which tags to look at, how to get their
+values, which numbers are constant) for every song again. Like
+`PatternCompiler` does for patterns, this instead generates the source of
+functions specialised for one query, with all of that resolved beforehand.
+
+Each `Inter` or `Union` becomes a function returning as soon as the result
+is known, tag searches and numeric comparisons get inlined into it.
+Nodes it doesn't know (like plugin extensions) get called as they are.
+"""
+
+import math
+import operator
+import time
+
+from senf import fsn2text, fsnative
+
+from quodlibet import print_w
+from quodlibet.formats import FILESYSTEM_TAGS, TIME_TAGS
+from quodlibet.util import parse_date
+from ._match import Tag, Numcmp, Inter, Union, Neg, True_, False_, \
+    NumexprTag, NumexprUnary, NumexprBinary, NumexprGroup, NumexprNumber, \
+    NumexprNow, NumexprNumberOrDate
+
+
+_COMPARISONS = {
+    operator.lt: "<",
+    operator.le: "<=",
+    operator.gt: ">",
+    operator.ge: ">=",
+    operator.eq: "==",
+    operator.ne: "!=",
+}
+
+_ARITHMETIC = {
+    operator.neg: "-",
+    operator.sub: "-",
+    operator.add: "+",
+    operator.mul: "*",
+    operator.floordiv: "//",
+}
+
+
+def _date(value):
+    if not value:
+        return None
+    try:
+        return round(parse_date(value), 2)
+    except ValueError:
+        return None
+
+
+def _is_constant(expr):
+    if isinstance(expr, (NumexprNumber, NumexprNumberOrDate)):
+        return True
+    elif isinstance(expr, (NumexprUnary, NumexprGroup)):
+        return _is_constant(expr._expr)
+    elif isinstance(expr, NumexprBinary):
+        return _is_constant(expr._expr) and _is_constant(expr._expr2)
+    return False
+
+
+def _flatten(node):
+    """Yields the children of an Inter or Union, including the ones of
+    nested nodes of the same type"""
+
+    for child in node.res:
+        child = child._unpack()
+        if type(child) is type(node):
+            yield from _flatten(child)
+        else:
+            yield child
+
+
+class QueryCompiler:
+    """Generates a function matching the same as the query `node`"""
+
+    def __init__(self, node, now=None):
+        self.__root = node._unpack()
+        self.__scope = {
+            "_time": time.time if now is None else (lambda: now),
+            "_fsn2text": fsn2text,
+            "_fs_default": fsnative(),
+            "_date": _date,
+            "_inf": float("inf"),
+        }
+        self.__functions = []
+        self.__count = 0
+
+    def compile(self):
+        """Returns the search function for the query"""
+
+        if not isinstance(self.__root, (Tag, Numcmp, Inter, Union, Neg,
+                                        True_, False_)):
+            return self.__root.search
+
+        name = self.__function(self.__root)
+        code = "\n".join(
+            line for function in self.__functions for line in function)
+        exec(compile(code, "<query>", "exec"), self.__scope)
+        return self.__scope[name]
+
+    def __name(self, prefix):
+        self.__count += 1
+        return "%s%d" % (prefix, self.__count)
+
+    def __constant(self, value):
+        if type(value) in (int, float) and math.isfinite(value):
+            return repr(value)
+        name = self.__name("c")
+        self.__scope[name] = value
+        return name
+
+    def __function(self, node):
+        """Adds a function for the node and returns its name"""
+
+        # which values the function needs: s.get and the current time
+        needs = set()
+        if isinstance(node, (Inter, Union)):
+            match = isinstance(node, Inter)
+            body = []
+            for child in _flatten(node):
+                body.extend(self.__match(child, needs))
+                body.append("if %sm:" % ("not " if match else ""))
+                body.append("  return %s" % (not match))
+            body.append("return %s" % match)
+        else:
+            body = self.__match(node, needs)
+            body.append("return True if m else False")
+
+        name = self.__name("f")
+        function = ["def %s(s):" % name]
+        if "get" in needs:
+            function.append("  g = s.get")
+        if "time" in needs:
+            function.append("  t = _time()")
+        function.extend("  " + line for line in body)
+        self.__functions.append(function)
+        return name
+
+    def __search(self, node):
+        """Returns the name of a function matching the node"""
+
+        node = node._unpack()
+        if isinstance(node, (Inter, Union, Neg, True_, False_)):
+            return self.__function(node)
+        return self.__constant(node.search)
+
+    def __match(self, node, needs):
+        """Returns lines setting `m` to whether the node matches `s`"""
+
+        node = node._unpack()
+        if isinstance(node, True_):
+            return ["m = True"]
+        elif isinstance(node, False_):
+            return ["m = False"]
+        elif isinstance(node, Neg):
+            return self.__match(node.res, needs) + ["m = not m"]
+        elif isinstance(node, Tag):
+            return self.__tag(node, needs)
+        elif isinstance(node, Numcmp) and node._op in _COMPARISONS:
+            return self.__numcmp(node, needs)
+        elif isinstance(node, (Inter, Union)) and len(node.res) == 1:
+            return self.__match(node.res[0], needs)
+        return ["m = %s(s)" % self.__search(node)]
+
+    def __tag(self, node, needs):
+        search = self.__search(node.res)
+        lines = []
+        for name in node.tags:
+            if name in FILESYSTEM_TAGS:
+                value = ["v = _fsn2text(s(%r, _fs_default))" % name]
+            elif name[:1] == "~":
+                value = ["v = s(%r)" % name]
+            else:
+                needs.add("get")
+                if name in ("filename", "mountpoint"):
+                    default = "_fsn2text(g(%r, _fs_default))" % ("~" + name)
+                else:
+                    default = "g(%r, u'')" % ("~" + name)
+                value = ["v = g(%r)" % name, "if v is None:",
+                         "  v = %s" % default]
+            value.append("m = %s(v)" % search)
+            if lines:
+                lines.append("if not m:")
+                value = ["  " + line for line in value]
+            lines.extend(value)
+        return lines or ["m = False"]
+
+    def __numcmp(self, node, needs):
+        use_date = node._expr.use_date() or node._expr2.use_date()
+        lines = []
+        left, left_none = self.__numexpr(node._expr, use_date, lines, needs)
+        right, right_none = self.__numexpr(
+            node._expr2, use_date, lines, needs)
+        checks = []
+        if left_none:
+            checks.append("%s is not None" % left)
+        if right_none:
+            checks.append("%s is not None" % right)
+        checks.append("%s %s %s" % (left, _COMPARISONS[node._op], right))
+        lines.append("m = " + " and ".join(checks))
+        return lines
+
+    def __numexpr(self, expr, use_date, lines, needs):
+        """Adds lines evaluating the numeric expression.
+
+        Returns the expression for the value and if it can be None.
+        """
+
+        if _is_constant(expr):
+            return self.__constant(expr.evaluate(None, None, use_date)), False
+        elif isinstance(expr, NumexprGroup):
+            return self.__numexpr(expr._expr, use_date, lines, needs)
+        elif isinstance(expr, NumexprNow):
+            needs.add("time")
+            return "(t - %s)" % self.__constant(expr._offset), False
+
+        var = self.__name("n")
+        if isinstance(expr, NumexprTag):
+            if expr._tag == "date":
+                lines.append("%s = _date(s('date'))" % var)
+            else:
+                lines.append("%s = s(%r, None)" % (var, expr._ftag))
+                lines.append("if %s is not None:" % var)
+                if expr._ftag.split(":")[0] in TIME_TAGS:
+                    needs.add("time")
+                    lines.append("  %s = round(t - %s, 2)" % (var, var))
+                else:
+                    lines.append("  %s = round(%s, 2)" % (var, var))
+        elif isinstance(expr, NumexprUnary) and expr._op in _ARITHMETIC:
+            value, none = self.__numexpr(expr._expr, use_date, lines, needs)
+            if not none:
+                return "(%s%s)" % (_ARITHMETIC[expr._op], value), False
+            lines.append("%s = None if %s is None else %s%s" % (
+                var, value, _ARITHMETIC[expr._op], value))
+        elif isinstance(expr, NumexprBinary) and expr._op in _ARITHMETIC:
+            left, left_none = self.__numexpr(
+                expr._expr, use_date, lines, needs)
+            right, right_none = self.__numexpr(
+                expr._expr2, use_date, lines, needs)
+            value = "%s %s %s" % (left, _ARITHMETIC[expr._op], right)
+            checks = [v + " is not None" for v, none in
+                      [(left, left_none), (right, right_none)] if none]
+            division = expr._op is operator.floordiv
+            if not checks and not division:
+                return "(%s)" % value, False
+            indent = ""
+            if checks:
+                lines.append("%s = None" % var)
+                lines.append("if %s:" % " and ".join(checks))
+                indent = "  "
+            if division:
+                lines.append(indent + "try:")
+                lines.append(indent + "  %s = %s" % (var, value))
+                lines.append(indent + "except ZeroDivisionError:")
+                lines.append(indent + "  %s = %s * _inf" % (var, left))
+            else:
+                lines.append(indent + "%s = %s" % (var, value))
+            if not checks:
+                return var, False
+        else:
+            needs.add("time")
+            lines.append("%s = %s.evaluate(s, t, %r)" % (
+                var, self.__constant(expr), use_date))
+        return var, True
+
+
+def compile_search(node, now=None):
+    """Returns a function matching the same as `node.search`.
+
+    If `now` is given, time relative comparisons use it as the current time.
+    """
+
+    try:
+        return QueryCompiler(node, now).compile()
+    except RecursionError:
+        print_w("Query too complex to compile: %r" % node)
+        return node.search
+
+
+def compile_filter(node):
+    """Returns a function like `node.filter`, using a compiled search"""
+
+    node = node._unpack()
+    if isinstance(node, (True_, False_)):
+        return node.filter
+
+    search = compile_search(node)
+
+    def filter_(sequence):
+        return list(filter(search, sequence))
+
+    return filter_
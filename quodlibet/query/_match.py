@@ -17,7 +17,7 @@ from numbers import Real
 from typing import TypeVar, List, Iterable
 
 from quodlibet.formats import FILESYSTEM_TAGS, TIME_TAGS
-from quodlibet.unisearch import compile
+from quodlibet.unisearch import compile, folded_text
 from quodlibet.util import parse_date
 from senf import fsn2text, fsnative
 
@@ -69,6 +69,8 @@ class Regex(Node):
         try:
             re = compile(self.pattern, ignore_case, dot_all, asym)
             self.search = re  # type: ignore
+            self.folded = folded_text(
+                self.pattern, ignore_case, dot_all, asym)
         except ValueError:
             raise ParseError(
                 "The regular expression /%s/ is invalid." % self.pattern)
@@ -251,6 +253,10 @@ class Numcmp(Node):
         return "<Numcmp expr=%r, op=%r, expr2=%r>" % (
             self._expr, self._op.__name__, self._expr2)
 
+    def uses_time(self):
+        """Whether the result depends on the current time"""
+        return self._expr.uses_time() or self._expr2.uses_time()
+
     def __and__(self, other):
         other = other._unpack()
         if isinstance(other, True_):
@@ -282,6 +288,10 @@ class Numexpr:
         values instead of the number values."""
         return False
 
+    def uses_time(self) -> bool:
+        """Returns whether the value depends on the current time."""
+        return False
+
 
 class NumexprTag(Numexpr):
     """Numeric tag"""
@@ -316,6 +326,9 @@ class NumexprTag(Numexpr):
     def use_date(self):
         return self._tag == 'date'
 
+    def uses_time(self):
+        return self._ftag.split(":", 1)[0] in TIME_TAGS
+
 
 class NumexprUnary(Numexpr):
     """Unary numeric operation (like -)"""
@@ -325,20 +338,23 @@ class NumexprUnary(Numexpr):
     }
 
     def __init__(self, op: str, expr: Numexpr):
-        self.__op = self.operators[op]
-        self.__expr = expr
+        self._op = self.operators[op]
+        self._expr = expr
 
     def evaluate(self, data, time, use_date):
-        val = self.__expr.evaluate(data, time, use_date)
+        val = self._expr.evaluate(data, time, use_date)
         if val is not None:
-            return self.__op(val)
+            return self._op(val)
         return None
 
     def __repr__(self):
-        return "<NumexprUnary op=%r expr=%r>" % (self.__op, self.__expr)
+        return "<NumexprUnary op=%r expr=%r>" % (self._op, self._expr)
 
     def use_date(self):
-        return self.__expr.use_date()
+        return self._expr.use_date()
+
+    def uses_time(self):
+        return self._expr.uses_time()
 
 
 class NumexprBinary(Numexpr):
@@ -359,51 +375,57 @@ class NumexprBinary(Numexpr):
     }
 
     def __init__(self, op: str, expr: Numexpr, expr2: Numexpr):
-        self.__op = self.operators[op]
-        self.__expr = expr
-        self.__expr2 = expr2
+        self._op = self.operators[op]
+        self._expr = expr
+        self._expr2 = expr2
         # Rearrange expressions for operator precedence
         if (isinstance(expr, NumexprBinary)
-                and self.precedence[expr.__op] < self.precedence[self.__op]):
-            self.__expr = expr.__expr
-            self.__op = expr.__op
-            expr.__expr = expr.__expr2
-            expr.__op = self.operators[op]
-            expr.__expr2 = expr2
-            self.__expr2 = expr
+                and self.precedence[expr._op] < self.precedence[self._op]):
+            self._expr = expr._expr
+            self._op = expr._op
+            expr._expr = expr._expr2
+            expr._op = self.operators[op]
+            expr._expr2 = expr2
+            self._expr2 = expr
 
     def evaluate(self, data, time, use_date):
-        val = self.__expr.evaluate(data, time, use_date)
-        val2 = self.__expr2.evaluate(data, time, use_date)
+        val = self._expr.evaluate(data, time, use_date)
+        val2 = self._expr2.evaluate(data, time, use_date)
         if val is not None and val2 is not None:
             try:
-                return self.__op(val, val2)
+                return self._op(val, val2)
             except ZeroDivisionError:
                 return val * float('inf')
         return None
 
     def __repr__(self):
         return "<NumexprBinary op=%r expr=%r expr2=%r>" % (
-            self.__op, self.__expr, self.__expr2)
+            self._op, self._expr, self._expr2)
 
     def use_date(self):
-        return self.__expr.use_date() or self.__expr2.use_date()
+        return self._expr.use_date() or self._expr2.use_date()
+
+    def uses_time(self):
+        return self._expr.uses_time() or self._expr2.uses_time()
 
 
 class NumexprGroup(Numexpr):
     """Parenthesized group in numeric expression"""
 
     def __init__(self, expr: Numexpr):
-        self.__expr = expr
+        self._expr = expr
 
     def evaluate(self, data, time, use_date):
-        return self.__expr.evaluate(data, time, use_date)
+        return self._expr.evaluate(data, time, use_date)
 
     def __repr__(self):
-        return "<NumexprGroup expr=%r>" % (self.__expr)
+        return "<NumexprGroup expr=%r>" % (self._expr)
 
     def use_date(self):
-        return self.__expr.use_date()
+        return self._expr.use_date()
+
+    def uses_time(self):
+        return self._expr.uses_time()
 
 
 class NumexprNumber(Numexpr):
@@ -423,13 +445,16 @@ class NumexprNow(Numexpr):
     """Current time, with optional offset"""
 
     def __init__(self, offset=0):
-        self.__offset = offset
+        self._offset = offset
 
     def evaluate(self, data, time, use_date):
-        return time - self.__offset
+        return time - self._offset
 
     def __repr__(self):
-        return "<NumexprNow offset=%r>" % (self.__offset)
+        return "<NumexprNow offset=%r>" % (self._offset)
+
+    def uses_time(self):
+        return True
 
 
 class NumexprNumberOrDate(Numexpr):
@@ -556,6 +581,12 @@ class Tag(Node):
 
         return False
 
+    @property
+    def tags(self):
+        """All tags which get searched"""
+
+        return self._names + self.__intern + self.__fs
+
     def __repr__(self):
         names = self._names + self.__intern
         return ("<Tag names=%r, res=%r>" % (names, self.res))
@@ -0,0 +1,508 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Resolving queries using indexes of tag values.
+
+Instead of matching every song, the parts of a query which can be answered
+by an index (see `SongLibrary.get_index`) get resolved to sets of candidate
+songs first and only what remains of the query gets matched against those.
+
+Supported are tag queries on indexed tags where the value can only match
+within a single line (like `artist="x"` or `genre=/rock/`), numeric
+comparisons of an indexed numeric tag with a constant (like `#(rating > 0.5)`)
+and intersections and unions of those.
+
+Searches for plain text (like the free-text query "foo bar") can also use
+the folded text of all songs (see `SongLibrary.get_text_index`), which only
+gives a rough selection of songs containing the text somewhere.
+
+Numeric comparisons and their combinations can be evaluated for all songs at
+once using arrays of the values of numeric tags (see
+`SongLibrary.get_columns`, needs NumPy), giving the exact result.
+"""
+
+import operator
+import re
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from quodlibet.formats import FILESYSTEM_TAGS, TIME_TAGS
+from quodlibet.util.tags import MACHINE_TAGS
+from ._compiler import compile_search
+from ._match import Tag, Numcmp, NumexprTag, Inter, Union, Regex, False_, \
+    Neg, NumexprUnary, NumexprBinary, NumexprGroup
+
+
+_ESCAPED = re.compile(r"\\[^A-Za-z0-9]")
+
+_FLIPPED = {
+    operator.lt: operator.gt,
+    operator.le: operator.ge,
+    operator.gt: operator.lt,
+    operator.ge: operator.le,
+    operator.eq: operator.eq,
+}
+
+# Numcmp rounds values to two decimals
+_ROUNDING = 0.01
+
+# synthetic tags whose values are (lines of) values of other tags
+_TEXT_TAGS = FILESYSTEM_TAGS | {"~people", "~people:real"}
+
+
+class _NotConstant(Exception):
+    pass
+
+
+class _NotVectorizable(Exception):
+    pass
+
+
+def _no_song(*args, **kwargs):
+    raise _NotConstant
+
+
+def _is_line_regex(node):
+    """If the regex can't match across lines, so it matches a multi-value
+    tag if and only if it matches one of the values.
+    """
+
+    if not isinstance(node, Regex) or "s" in node.mod_string:
+        return False
+    pattern = _ESCAPED.sub("", node.pattern)
+    return not any(c in pattern for c in ["\\", "[^", "(?", "\n"])
+
+
+def _plan_tag(node, get_index):
+    res = node.res
+    regexes = res.res if isinstance(res, Union) else [res]
+    if not all(_is_line_regex(r) for r in regexes):
+        return None
+
+    search = res.search
+    # songs without the tag would match
+    if search(u""):
+        return None
+
+    candidates = set()
+    residual = None
+    for tag in node.tags:
+        # searched using the file name, or a tied tag
+        if tag in FILESYSTEM_TAGS or tag in ("filename", "mountpoint") or \
+                "~" in tag[1:] and tag[:1] != "~":
+            return None
+        index = get_index(tag)
+        if index is None:
+            return None
+        candidates |= index.search(search)
+        # songs which might match other values need to be checked again
+        uncertain = index.uncertain()
+        if uncertain:
+            candidates |= uncertain
+            residual = node
+    return candidates, residual
+
+
+def _get_texts(node):
+    """The folded texts of which the text of a song matching the tag query
+    contains at least one (see `SearchTextIndex`), or None if unknown.
+    """
+
+    if not isinstance(node, Tag):
+        return None
+    if not all(tag[:1] != "~" and tag not in MACHINE_TAGS or
+               tag in _TEXT_TAGS for tag in node.tags):
+        return None
+
+    res = node.res
+    regexes = res.res if isinstance(res, Union) else [res]
+    if not all(isinstance(r, Regex) for r in regexes):
+        return None
+    texts = [r.folded for r in regexes]
+    if any(text is None or "\n" in text for text in texts):
+        return None
+    return texts
+
+
+def _plan_text(node, get_text_index):
+    texts = _get_texts(node)
+    if texts is None:
+        return None
+    index = get_text_index()
+    if index is None:
+        return None
+
+    candidates = set()
+    for text in texts:
+        candidates |= index.search([text])
+    # only a rough selection, the tags need to be checked again
+    return candidates, node
+
+
+def _plan_inter_text(nodes, get_index, get_text_index, now):
+    """Candidates for songs matching all nodes, or None"""
+
+    candidates = None
+    texts = []
+    for node in nodes:
+        alternatives = _get_texts(node._unpack())
+        if alternatives is not None and len(alternatives) == 1:
+            texts.extend(alternatives)
+            continue
+        result = plan(node, get_index, get_text_index, now=now)
+        if result is not None:
+            songs = result[0]
+            candidates = songs if candidates is None else candidates & songs
+
+    if texts:
+        index = get_text_index()
+        if index is not None:
+            # all texts at once, to only go through the songs once
+            songs = index.search(texts)
+            candidates = songs if candidates is None else candidates & songs
+    return candidates
+
+
+def _plan_numcmp(node, get_index, now):
+    left, op, right = node._expr, node._op, node._expr2
+    use_date = left.use_date() or right.use_date()
+
+    if not isinstance(left, NumexprTag):
+        left, right = right, left
+        op = _FLIPPED.get(op)
+    if not isinstance(left, NumexprTag) or op is None:
+        return None
+
+    tag = left._tag
+    if tag == "date" or ":" in tag:
+        return None
+    index = get_index(left._ftag)
+    if index is None:
+        return None
+
+    try:
+        value = right.evaluate(_no_song, now, use_date)
+    except _NotConstant:
+        return None
+    if value is None:
+        return None
+
+    # the range the value compared has to be in
+    low, high = float("-inf"), float("inf")
+    if op in (operator.lt, operator.le):
+        high = value
+    elif op in (operator.gt, operator.ge):
+        low = value
+    elif op is operator.eq:
+        low = high = value
+    else:
+        return None
+    low -= _ROUNDING
+    high += _ROUNDING
+
+    # for time tags the time since then gets compared
+    if left._ftag in TIME_TAGS:
+        low, high = now - high, now - low
+
+    # only a rough selection, the comparison needs to be checked again
+    return index.range(low, high), node
+
+
+def _is_numeric(node):
+    """If the query only consists of numeric comparisons"""
+
+    if isinstance(node, Numcmp):
+        return True
+    elif isinstance(node, (Inter, Union)):
+        return all(_is_numeric(child._unpack()) for child in node.res)
+    elif isinstance(node, Neg):
+        return _is_numeric(node.res._unpack())
+    return False
+
+
+def _near_half(values):
+    """Where rounding to two decimals could differ from round()"""
+
+    with numpy.errstate(invalid="ignore"):
+        scaled = values * 100
+        return abs(scaled - numpy.floor(scaled) - 0.5) < 1e-6
+
+
+def _evaluate_vector(expr, columns, now, use_date):
+    """Like `Numexpr.evaluate` for the songs at all positions of the
+    columns.
+
+    Returns a tuple of the values, where they are missing (evaluate would
+    return None) and where they aren't certain, each either an array or a
+    single value for all songs.
+    """
+
+    if isinstance(expr, NumexprTag):
+        tag = expr._ftag
+        if expr._tag == "date" or ":" in tag:
+            raise _NotVectorizable
+        values = columns.get(tag)
+        missing = numpy.isnan(values)
+        if tag in TIME_TAGS:
+            values = now - values
+        return numpy.round(values, 2), missing, _near_half(values)
+    elif isinstance(expr, NumexprGroup):
+        return _evaluate_vector(expr._expr, columns, now, use_date)
+    elif isinstance(expr, NumexprUnary):
+        values, missing, unsure = _evaluate_vector(
+            expr._expr, columns, now, use_date)
+        return expr._op(values), missing, unsure
+    elif isinstance(expr, NumexprBinary):
+        values, missing, unsure = _evaluate_vector(
+            expr._expr, columns, now, use_date)
+        values2, missing2, unsure2 = _evaluate_vector(
+            expr._expr2, columns, now, use_date)
+        with numpy.errstate(all="ignore"):
+            # dividing by zero gives infinity (with the sign of the
+            # divident) like in evaluate
+            result = expr._op(values, values2)
+        return result, missing | missing2, unsure | unsure2
+
+    try:
+        value = expr.evaluate(_no_song, now, use_date)
+    except _NotConstant:
+        raise _NotVectorizable
+    no = numpy.bool_(False)
+    if value is None:
+        return numpy.float64(0), ~no, no
+    return numpy.float64(value), no, no
+
+
+def _mask_vector(node, columns, now):
+    """Returns where `node` matches for the songs at all positions of the
+    columns and where it isn't certain, as two bool arrays.
+    """
+
+    if isinstance(node, Numcmp):
+        use_date = node._expr.use_date() or node._expr2.use_date()
+        values, missing, unsure = _evaluate_vector(
+            node._expr, columns, now, use_date)
+        values2, missing2, unsure2 = _evaluate_vector(
+            node._expr2, columns, now, use_date)
+        with numpy.errstate(invalid="ignore"):
+            matches = node._op(values, values2)
+        present = ~(missing | missing2) & columns.valid
+        unsure = (unsure | unsure2) & present
+        return matches & present & ~unsure, unsure
+    elif isinstance(node, Neg):
+        matches, unsure = _mask_vector(node.res._unpack(), columns, now)
+        return ~(matches | unsure) & columns.valid, unsure
+    elif isinstance(node, Inter):
+        matches = possible = columns.valid
+        for child in node.res:
+            child_matches, child_unsure = _mask_vector(
+                child._unpack(), columns, now)
+            matches = matches & child_matches
+            possible = possible & (child_matches | child_unsure)
+        return matches, possible & ~matches
+    elif isinstance(node, Union):
+        matches = unsure = ~columns.valid
+        for child in node.res:
+            child_matches, child_unsure = _mask_vector(
+                child._unpack(), columns, now)
+            matches = matches | child_matches
+            unsure = unsure | child_unsure
+        matches &= columns.valid
+        return matches, unsure & columns.valid & ~matches
+
+    raise _NotVectorizable
+
+
+def _plan_columns(node, get_columns, now):
+    """The songs matching a query of numeric comparisons, evaluated for all
+    songs at once, or None.
+    """
+
+    columns = get_columns()
+    if columns is None:
+        return None
+
+    try:
+        matches, unsure = _mask_vector(node, columns, now)
+    except _NotVectorizable:
+        return None
+
+    candidates = set(columns.songs(numpy.flatnonzero(matches)))
+    # values which might get rounded differently, check them one by one
+    search = node.search
+    candidates.update(
+        filter(search, columns.songs(numpy.flatnonzero(unsure))))
+    return candidates, None
+
+
+def plan(node, get_index, get_text_index=None, get_columns=None, now=None):
+    """Resolves the parts of the query which can use indexes.
+
+    Time relative comparisons get resolved for the time `now` (defaults to
+    the current time), so the remaining query has to be matched using the
+    same time (see `compile_residual`).
+
+    Args:
+        node (Node): the query
+        get_index (Callable[[str], Optional[TagIndex]]): returns an index
+            for a tag or None
+        get_text_index (Optional[Callable[[], Optional[SearchTextIndex]]]):
+            returns the folded text of the songs or None
+        get_columns (Optional[Callable[[], Optional[NumericColumns]]]):
+            returns the values of numeric tags of the songs or None
+    Returns:
+        Optional[Tuple[Set[AudioFile], Optional[Node]]]: None if no index
+            could be used. Otherwise candidates for the matching songs and
+            the query they still have to match, or None if all of them
+            match.
+    """
+
+    node = node._unpack()
+    if now is None:
+        now = time.time()
+
+    if get_columns is not None and _is_numeric(node):
+        result = _plan_columns(node, get_columns, now)
+        if result is not None:
+            return result
+
+    if isinstance(node, False_):
+        return set(), None
+    elif isinstance(node, Tag):
+        result = _plan_tag(node, get_index)
+        if result is None and get_text_index is not None:
+            result = _plan_text(node, get_text_index)
+        return result
+    elif isinstance(node, Numcmp):
+        return _plan_numcmp(node, get_index, now)
+    elif isinstance(node, Inter):
+        candidates = None
+        residual = []
+        children = node.res
+        if get_columns is not None:
+            # all numeric comparisons at once
+            numeric = [c for c in children if _is_numeric(c._unpack())]
+            if 1 < len(numeric) < len(children):
+                children = [c for c in children
+                            if not any(c is n for n in numeric)]
+                children.append(Inter(numeric))
+        for child in children:
+            result = plan(
+                child, get_index, get_columns=get_columns, now=now)
+            if result is None:
+                residual.append(child)
+                continue
+            songs, rest = result
+            if candidates is None:
+                candidates = songs
+            else:
+                candidates &= songs
+            if rest is not None:
+                residual.append(rest)
+        # going through the text of all songs is only worth it if
+        # nothing else could narrow them down
+        if candidates is None and get_text_index is not None:
+            candidates = _plan_inter_text(
+                residual, get_index, get_text_index, now)
+        if candidates is None:
+            return None
+        elif not residual:
+            return candidates, None
+        elif len(residual) == 1:
+            return candidates, residual[0]
+        return candidates, Inter(residual)
+    elif isinstance(node, Union):
+        candidates = set()
+        exact = True
+        for child in node.res:
+            result = plan(
+                child, get_index, get_text_index, get_columns, now)
+            if result is None:
+                return None
+            songs, rest = result
+            candidates |= songs
+            exact = exact and rest is None
+        return candidates, (None if exact else node)
+
+    return None
+
+
+def narrow(node, songs, get_index, get_text_index=None, get_columns=None,
+           now=None):
+    """Returns the songs which can match the query, using indexes where
+    possible, and the query they still have to match at the time `now`
+    (see `plan`), or None if all of them match.
+
+    `songs` has to be all the songs the indexes contain.
+    """
+
+    result = plan(node, get_index, get_text_index, get_columns, now)
+    if result is None:
+        return songs, node
+    return result
+
+
+def _uses_time(node):
+    """If the result of the query depends on the current time"""
+
+    if isinstance(node, Numcmp):
+        return node.uses_time()
+    elif isinstance(node, (Inter, Union)):
+        return any(_uses_time(child._unpack()) for child in node.res)
+    elif isinstance(node, (Neg, Tag)):
+        return _uses_time(node.res._unpack())
+    return False
+
+
+def _residual_key(node):
+    # intersections get created while planning, the rest are parts of
+    # the query
+    if isinstance(node, Inter):
+        return (Inter, tuple(_residual_key(c._unpack()) for c in node.res))
+    return id(node)
+
+
+def compile_residual(residual, now, cache=None):
+    """Returns a compiled search for what remains of a query after `plan`,
+    matching time relative comparisons at the time `now` used for planning.
+
+    Searches for queries not depending on the time get kept in the dict
+    `cache` if given, for planning the same query again.
+    """
+
+    residual = residual._unpack()
+    if _uses_time(residual):
+        return compile_search(residual, now)
+    if cache is None:
+        return compile_search(residual)
+    key = _residual_key(residual)
+    try:
+        return cache[key][1]
+    except KeyError:
+        search = compile_search(residual)
+        # keeps the nodes alive, so their ids stay unique
+        cache[key] = (residual, search)
+        return search
+
+
+def filter_indexed(node, songs, get_index, get_text_index=None,
+                   get_columns=None, cache=None):
+    """Like `node.filter(songs)` but using indexes where possible.
+
+    `songs` has to be all the songs the indexes contain.
+    The order of the result is undefined. See `compile_residual` for
+    `cache`.
+    """
+
+    now = time.time()
+    candidates, residual = narrow(
+        node, songs, get_index, get_text_index, get_columns, now)
+    if residual is None:
+        return list(candidates)
+    return list(filter(compile_residual(residual, now, cache), candidates))
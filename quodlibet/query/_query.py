@@ -10,6 +10,7 @@
 
 from __future__ import annotations
 
+import time
 from enum import Enum, auto
 from typing import Optional, Type, Iterable, TypeVar
 
@@ -18,6 +19,9 @@ from quodlibet.util import re_escape, cached_property
 from . import _match as match
 from ._match import Error, Node, False_
 from ._parser import QueryParser
+from ._compiler import compile_search, compile_filter
+from ._planner import filter_indexed, narrow, compile_residual
+from ._refine import refines
 
 T = TypeVar("T")
 
@@ -117,11 +121,56 @@ class Query(Node):
 
     @cached_property
     def search(self):
-        return self._match.search
+        return compile_search(self._match)
 
     @cached_property
     def filter(self):
-        return self._match.filter
+        return compile_filter(self._match)
+
+    @cached_property
+    def _residuals(self):
+        # searches for what remained of the query after using indexes
+        return {}
+
+    def filter_indexed(self, songs, get_index, get_text_index=None,
+                       get_columns=None):
+        """Like filter(), but resolves parts of the query using indexes
+        where possible. The order of the result is undefined.
+
+        :param songs: All songs the indexes contain
+        :param get_index: Returns an index for a tag, or None
+        :param get_text_index: Returns the folded text of the songs, or None
+        :param get_columns: Returns the numeric columns of the songs, or None
+        """
+        return filter_indexed(
+            self._match, songs, get_index, get_text_index, get_columns,
+            self._residuals)
+
+    def narrow(self, songs, get_index, get_text_index=None,
+               get_columns=None):
+        """Returns the songs which can match, using indexes where possible,
+        and a function returning if one of them matches.
+
+        :param songs: All songs the indexes contain
+        :param get_index: Returns an index for a tag, or None
+        :param get_text_index: Returns the folded text of the songs, or None
+        :param get_columns: Returns the numeric columns of the songs, or None
+        """
+        now = time.time()
+        songs, residual = narrow(
+            self._match, songs, get_index, get_text_index, get_columns, now)
+        if residual is None:
+            return songs, match.True_().search
+        return songs, compile_residual(residual, now, self._residuals)
+
+    def is_refinement_of(self, other: Node) -> bool:
+        """Whether this query can only match what `other` matches, e.g.
+        because it extends one of its search terms or adds another one.
+
+        If True, filtering the result of `other` gives the same songs as
+        filtering all of them.
+        """
+        return refines(self._match, other)
 
     @property
     def valid(self) -> bool:
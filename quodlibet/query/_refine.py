@@ -0,0 +1,127 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Finding out if a query can only match a subset of another one.
+
+While typing a search each new query mostly narrows down the previous one,
+by extending a search term or by adding another one. Songs which didn't match
+the previous query can't match the new one either, so only the previous
+result needs to be searched again.
+
+The check is conservative: if `refines` returns False the query might still
+be a refinement, it just can't tell.
+"""
+
+import re
+import unicodedata
+
+from quodlibet.unisearch.db import get_replacement_mapping
+from quodlibet.util import re_escape
+from ._match import Tag, Inter, Union, Neg, Regex, True_, False_, Numcmp, \
+    Extension
+
+
+_LITERAL = re.compile(r"(?:[^\\.^$*+?{}\[\]|()]|\\[^A-Za-z0-9])*")
+_ESCAPED = re.compile(r"\\(.)", re.DOTALL)
+
+_sequences = None
+
+
+def _get_sequences():
+    """A regex finding character sequences which get replaced as a whole
+    when searching with diacritic variants (like "ae" also matching "æ")
+    """
+
+    global _sequences
+
+    if _sequences is None:
+        keys = [k for k in get_replacement_mapping() if len(k) > 1]
+        _sequences = re.compile(u"|".join(
+            map(re_escape, sorted(keys, key=len, reverse=True))))
+    return _sequences
+
+
+def _literal(regex):
+    """The text the regex searches for, or None if it isn't a plain text"""
+
+    if not _LITERAL.fullmatch(regex.pattern):
+        return None
+    text = _ESCAPED.sub(r"\1", regex.pattern)
+    if unicodedata.normalize("NFC", text) != text:
+        return None
+    return text
+
+
+def _contains(text, other, variants):
+    """If everything containing `text` also contains `other`"""
+
+    if not variants:
+        return other in text
+
+    # Character sequences get replaced as a whole, e.g. "fae" also matches
+    # "fæ" while "fa" doesn't. So `other` has to be in `text` in a place
+    # where it doesn't cut through one of them.
+    spans = [m.span() for m in _get_sequences().finditer(text)]
+    start = text.find(other)
+    while start != -1:
+        end = start + len(other)
+        if not any(s < start < e or s < end < e for s, e in spans):
+            return True
+        start = text.find(other, start + 1)
+    return False
+
+
+def _refines_regex(node, other):
+    if set(node.mod_string) != set(other.mod_string):
+        return False
+    text = _literal(node)
+    other_text = _literal(other)
+    if text is None or other_text is None:
+        return False
+    return _contains(text, other_text, "d" in node.mod_string)
+
+
+def _is_volatile(node):
+    """If `node` can match other things later on, without them changing"""
+
+    if isinstance(node, Extension):
+        return True
+    elif isinstance(node, Numcmp):
+        return node.uses_time()
+    elif isinstance(node, (Inter, Union)):
+        return any(_is_volatile(child) for child in node.res)
+    elif isinstance(node, (Neg, Tag)):
+        return _is_volatile(node.res)
+    return False
+
+
+def refines(node, other):
+    """Returns True if `node` can only match things `other` matches"""
+
+    node = node._unpack()
+    other = other._unpack()
+
+    if isinstance(other, True_) or isinstance(node, False_):
+        return True
+    elif node is other:
+        # things matching a time relative query or a plugin query before
+        # might not match it now
+        return not _is_volatile(node)
+    elif isinstance(other, Inter):
+        return all(refines(node, child) for child in other.res)
+    elif isinstance(node, Union):
+        return all(refines(child, other) for child in node.res)
+    elif isinstance(node, Inter):
+        return any(refines(child, other) for child in node.res)
+    elif isinstance(other, Union):
+        return any(refines(node, child) for child in other.res)
+    elif isinstance(node, Neg) and isinstance(other, Neg):
+        return refines(other.res, node.res)
+    elif isinstance(node, Tag) and isinstance(other, Tag):
+        return set(node.tags) <= set(other.tags) and \
+            refines(node.res, other.res)
+    elif isinstance(node, Regex) and isinstance(other, Regex):
+        return _refines_regex(node, other)
+    return False
@@ -19,7 +19,8 @@ The goal is to make searching easy using a english keyboard without any
 knowledge of other languages.
 """
 
-from .parser import compile
+from .parser import compile, folded_text
 
 
 compile
+folded_text
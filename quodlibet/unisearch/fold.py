@@ -0,0 +1,179 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Folding text so that diacritic-insensitive searches can be pre-checked
+with a plain substring test.
+
+Folding maps all characters a pattern character can match with
+`compile(.., ignore_case=True, asym=True)` to the same text, e.g. "Ä", "ä"
+and "a" all to "a" and "æ" to "ae". So if such a search for a plain text
+matches, the folded pattern is contained in the folded text. The other way
+around doesn't hold ("ﬀ" folds to "ff", but a search for "f" doesn't match
+it), so this can only rule out matches.
+"""
+
+import re
+import unicodedata
+from typing import Dict, Optional
+
+from quodlibet import print_w
+
+from .db import get_replacement_mapping
+
+try:
+    from re._casefix import _EXTRA_CASES as _CASE_FIXES
+except ImportError:
+    try:
+        from sre_compile import _ignorecase_fixes as _CASE_FIXES
+    except ImportError:
+        # without them folding could miss matches, so don't fold at all
+        _CASE_FIXES = None
+
+
+_MAX_CACHED = 100000
+
+
+def _lower(char: str) -> str:
+    # re uses the simple lowercase mapping, which is the same as
+    # str.lower() except for the few chars getting longer, like "İ"
+    return char.lower()[:1] or char
+
+
+class _Unfoldable(Exception):
+    pass
+
+
+def _get_folds() -> Dict[str, str]:
+    """Returns a dict mapping lowercase characters to their folded text,
+    for all characters which don't just fold to their lowercase version.
+
+    Raises _Unfoldable
+    """
+
+    if _CASE_FIXES is None:
+        raise _Unfoldable("re case fixes not found")
+
+    mapping = get_replacement_mapping()
+    parent: Dict[str, str] = {}
+
+    def find(char):
+        while parent.get(char, char) != char:
+            char = parent[char]
+        return char
+
+    def union(a, b):
+        a, b = find(a), find(b)
+        if a != b:
+            # prefer base letters like "a" as representative
+            if (b not in mapping, b) < (a not in mapping, a):
+                a, b = b, a
+            parent[b] = a
+            parent.setdefault(a, a)
+
+    # characters re considers equal when ignoring case
+    for code, others in _CASE_FIXES.items():
+        for other in others:
+            union(chr(code), chr(other))
+
+    for key, variants in mapping.items():
+        if len(key) == 1:
+            for variant in variants:
+                union(_lower(key), _lower(variant))
+
+    # characters matching a sequence, like "æ" for "ae"
+    expansions: Dict[str, str] = {}
+    for key, variants in mapping.items():
+        if len(key) > 1:
+            for variant in variants:
+                root = find(_lower(variant))
+                expansion = u"".join(find(_lower(c)) for c in key)
+                if expansions.setdefault(root, expansion) != expansion:
+                    raise _Unfoldable(variant)
+
+    def resolve(char, seen):
+        if char not in expansions:
+            return char
+        if char in seen:
+            raise _Unfoldable(char)
+        seen = seen | {char}
+        return u"".join(resolve(c, seen) for c in expansions[char])
+
+    folds = {}
+    for char in set(parent) | set(expansions):
+        folded = resolve(find(char), frozenset())
+        if folded != char:
+            folds[char] = folded
+    return folds
+
+
+class _FoldTable(dict):
+    """A str.translate() table, filled on demand"""
+
+    def __init__(self, folds):
+        super().__init__()
+        self._folds = folds
+
+    def __missing__(self, code):
+        lower = _lower(chr(code))
+        folded = self._folds.get(lower, lower)
+        self[code] = folded
+        return folded
+
+
+_table: Optional[_FoldTable] = None
+_available = True
+_cache: Dict[str, str] = {}
+
+# ascii characters which don't just fold to their lowercase version
+_ascii_folded: Optional[re.Pattern] = None
+
+
+def _get_table() -> Optional[_FoldTable]:
+    global _table, _available, _ascii_folded
+
+    if _table is None and _available:
+        try:
+            table = _FoldTable(_get_folds())
+        except _Unfoldable as e:
+            print_w("Can't fold text for searching: %r" % e)
+            _available = False
+        else:
+            chars = [chr(c) for c in range(128)
+                     if table[c] != chr(c).lower()]
+            _ascii_folded = re.compile(
+                u"[%s]" % re.escape(u"".join(chars)) if chars else u"(?!)")
+            _table = table
+    return _table
+
+
+def fold(text: str) -> Optional[str]:
+    """Returns the folded text, or None if folding isn't possible"""
+
+    table = _get_table()
+    if table is None:
+        return None
+    if text.isascii():
+        # translating is slow, most ascii text only needs lowering
+        text = text.lower()
+        if _ascii_folded.search(text) is None:
+            return text
+        return text.translate(table)
+    return unicodedata.normalize("NFC", text).translate(table)
+
+
+def fold_cached(text: str) -> str:
+    """Like fold(), but keeps the result for each text. Tag values get
+    searched over and over again, this way they only get folded once.
+
+    Only call if fold() doesn't return None.
+    """
+
+    try:
+        return _cache[text]
+    except KeyError:
+        if len(_cache) >= _MAX_CACHED:
+            _cache.clear()
+        folded = _cache[text] = fold(text)
+        return folded
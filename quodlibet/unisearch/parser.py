@@ -5,7 +5,8 @@
 # the Free Software Foundation; either version 2 of the License, or
 # (at your option) any later version.
 
-from typing import List, Dict, Callable
+from functools import lru_cache
+from typing import List, Dict, Callable, Optional, Tuple
 import re
 import sre_parse
 import sre_constants
@@ -15,6 +16,7 @@ from quodlibet import print_d
 from quodlibet.util import re_escape
 
 from .db import get_replacement_mapping
+from .fold import fold, fold_cached
 
 
 def _fixup_literal(literal, in_seq, mapping):
@@ -270,26 +272,40 @@ def re_add_variants(text: str) -> str:
     return re_replace_literals(text, get_replacement_mapping())
 
 
-def compile(pattern: str, ignore_case: bool = True, dot_all: bool = False,
-            asym: bool = False) -> Callable[[str], bool]:
-    """
-    Args:
-        pattern (str): a unicode regex
-        ignore_case (bool): if case shouuld be ignored when matching
-        dot_all (bool): if "." should match newlines
-        asym (bool): if ascii should match similar looking unicode chars
-    Returns:
-        A callable which will return True if the pattern is contained in
-        the passed text.
-    Raises:
-        ValueError: In case the regex is invalid
-    """
+def _get_literal(pattern: str) -> Optional[str]:
+    """Returns the text the regex matches if it is a plain text"""
+
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return None
+
+    chars = []
+    for op, av in parsed:
+        if op != sre_constants.LITERAL:
+            return None
+        chars.append(chr(av))
+    return u"".join(chars)
 
-    assert isinstance(pattern, str)
+
+@lru_cache(maxsize=512)
+def _compile(pattern: str, ignore_case: bool, dot_all: bool,
+             asym: bool) -> Tuple[re.Pattern, Optional[str]]:
+    """Returns the compiled regex and, if the regex searches for a plain
+    text, the folded text to pre-check with.
+
+    Raises ValueError
+    """
 
     pattern = unicodedata.normalize("NFC", pattern)
 
+    folded = None
     if asym:
+        if ignore_case:
+            text = _get_literal(pattern)
+            if text is not None:
+                folded = fold(text)
+
         try:
             pattern = re_add_variants(pattern)
         except NotImplementedError:
@@ -305,12 +321,53 @@ def compile(pattern: str, ignore_case: bool = True, dot_all: bool = False,
         mods |= re.DOTALL
 
     try:
-        reg = re.compile(pattern, mods)
+        return re.compile(pattern, mods), folded
     except re.error as e:
         raise ValueError(e)
+
+
+def folded_text(pattern: str, ignore_case: bool = True, dot_all: bool = False,
+                asym: bool = False) -> Optional[str]:
+    """Returns a folded text (see `fold`) which the folded version of every
+    text the search matches contains, or None if there is none.
+
+    Raises:
+        ValueError: In case the regex is invalid
+    """
+
+    return _compile(pattern, ignore_case, dot_all, asym)[1]
+
+
+def compile(pattern: str, ignore_case: bool = True, dot_all: bool = False,
+            asym: bool = False) -> Callable[[str], bool]:
+    """
+    Args:
+        pattern (str): a unicode regex
+        ignore_case (bool): if case shouuld be ignored when matching
+        dot_all (bool): if "." should match newlines
+        asym (bool): if ascii should match similar looking unicode chars
+    Returns:
+        A callable which will return True if the pattern is contained in
+        the passed text.
+    Raises:
+        ValueError: In case the regex is invalid
+    """
+
+    assert isinstance(pattern, str)
+
+    # expanding and compiling diacritic-insensitive regexes is slow
+    # and the same ones get used over and over again while typing
+    reg, folded = _compile(pattern, ignore_case, dot_all, asym)
     normalize = unicodedata.normalize
 
-    def search(text: str):
-        return bool(reg.search(normalize("NFC", text)))
+    if folded is None:
+        def search(text: str):
+            return bool(reg.search(normalize("NFC", text)))
+    else:
+        # Matching the huge regexes is slow, so first rule out texts
+        # which don't contain the folded pattern (most of them).
+        def search(text: str):
+            return (folded in fold_cached(text) and
+                    bool(reg.search(normalize("NFC", text))))
 
     return search
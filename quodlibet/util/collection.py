@@ -10,8 +10,10 @@
 from __future__ import absolute_import
 from __future__ import annotations
 
+import math
 import os
 import random
+from collections import OrderedDict
 from typing import Any, Set, Union, MutableSequence
 from urllib.parse import quote
 
@@ -85,6 +87,198 @@ NUM_FUNCS = {
 }
 
 
+class _Counts:
+    """Counts the values of one key over the songs of a collection.
+
+    Keeps what got counted for each song, so adding, removing or changing a
+    song only has to look at that song and not at all the others. Changes
+    get applied the next time the counts are needed. Songs with the same
+    values share them.
+    """
+
+    def __init__(self, key, songs):
+        self.key = key
+        self._counts = {}
+        self._songs = stored = {}
+        self._pending = {}
+        shared = {}
+        # songs in playlists can be there more than once, count them each time
+        get_values = self._get_values
+        count = self._count
+        for song in songs:
+            values = tuple(get_values(song))
+            values = stored[id(song)] = shared.setdefault(values, values)
+            count(values, 1)
+
+    def _get_values(self, song):
+        """The values to count for the song"""
+
+        return song.list(self.key)
+
+    def _count(self, values, sign):
+        counts = self._counts
+        for value in values:
+            count = counts.get(value, 0) + sign
+            if count:
+                counts[value] = count
+            else:
+                del counts[value]
+
+    def forget(self, changed=(), removed=()):
+        """Marks songs as changed (or added) and removed"""
+
+        pending = self._pending
+        for song in removed:
+            pending[id(song)] = None
+        for song in changed:
+            pending[id(song)] = song
+
+    def _apply_pending(self):
+        songs = self._songs
+        for key, song in self._pending.items():
+            old = songs.pop(key, None)
+            if old is not None:
+                self._count(old, -1)
+            if song is not None:
+                values = songs[key] = tuple(self._get_values(song))
+                self._count(values, 1)
+        self._pending.clear()
+
+    @property
+    def counts(self):
+        """A dict mapping each value to how often it occurs"""
+
+        if self._pending:
+            self._apply_pending()
+        return self._counts
+
+    def _first_seen(self, songs, key=None):
+        """A dict mapping each value to the position of its first
+        appearance in `songs`, for ranking values counted the same"""
+
+        stored = self._songs
+        order = {}
+        for song in songs:
+            for value in stored.get(id(song), ()):
+                if key is not None:
+                    value = key(value)
+                if value not in order:
+                    order[value] = len(order)
+        return order
+
+    def ranked(self):
+        """All values, the most frequent ones first"""
+
+        return [value for value, count in
+                sorted(self.counts.items(), key=lambda x: (-x[1], x[0]))]
+
+
+class _NumericCounts(_Counts):
+    # 1 and 1.0 are the same dict key, so count each value together with
+    # its type to get the same types as when going through all values
+
+    def _get_values(self, song):
+        value = song(self.key)
+        return () if value == "" else ((value, isinstance(value, float)),)
+
+    def _items(self):
+        return list(self.counts.items())
+
+    def aggregate(self, func, songs):
+        """Like NUM_FUNCS[func] applied to the values of `songs`,
+        None if there are none"""
+
+        items = self._items()
+        if not items:
+            return None
+        if func in ("max", "min"):
+            best = (max if func == "max" else min)(k[0] for k, c in items)
+            found = [k for k, c in items if k[0] == best]
+            if len(found) > 1:
+                # an int and a float: the first one wins, like with max()
+                order = self._first_seen(songs)
+                found.sort(key=lambda k: order.get(k, len(order)))
+            return found[0][0]
+
+        total = [value * count for (value, is_float), count in items]
+        if any(is_float for (value, is_float), count in items):
+            # independent of the order the counts got updated in
+            total = math.fsum(total)
+        else:
+            total = sum(total)
+        if func == "sum":
+            return total
+        number = sum(count for key, count in items)
+        if func == "avg":
+            return float(total) / number
+        m = config.RATINGS.default
+        c = config.getfloat("settings", "bayesian_rating_factor", 0.0)
+        return float(m * c + total) / (c + number)
+
+
+class _RatingCounts(_NumericCounts):
+    # The default rating can change, so only set ratings get counted and
+    # the default is filled in when asked for
+
+    def _get_values(self, song):
+        value = song.get("~#rating")
+        return ((value, isinstance(value, float)),)
+
+    def _default(self):
+        default = config.RATINGS.default
+        return (default, isinstance(default, float))
+
+    def _items(self):
+        counts = dict(self.counts)
+        unrated = counts.pop((None, False), 0)
+        if unrated:
+            default = self._default()
+            counts[default] = counts.get(default, 0) + unrated
+        return list(counts.items())
+
+    def _first_seen(self, songs, key=None):
+        default = self._default()
+        return super()._first_seen(
+            songs, lambda value: default if value[0] is None else value)
+
+
+class _PeopleCounts(_Counts):
+    # Ranks people by "relevance" -- artists before composers
+    # before performers, then by number of appearances.
+
+    def _get_values(self, song):
+        sort = self.key == "~peoplesort"
+        values = []
+        for score, key in zip(PEOPLE_SCORE, ELPOEP):
+            persons = song.list(key)
+            if sort and key in TAG_TO_SORT:
+                persons = song.list(TAG_TO_SORT[key]) or persons
+            if persons:
+                values.extend((person, score) for person in persons)
+        return values
+
+    def _count(self, values, sign):
+        counts = self._counts
+        for value, score in values:
+            count = counts.get(value, 0) + sign * score
+            if count:
+                counts[value] = count
+            else:
+                del counts[value]
+
+    def ranked(self, songs):
+        """The first 100 people of `songs`, the most relevant ones first
+        and in order of appearance if equally relevant"""
+
+        counts = self.counts
+        ranked = sorted(counts, key=lambda value: -counts[value])
+        top = ranked[:101]
+        if any(counts[a] == counts[b] for a, b in zip(top, top[1:])):
+            order = self._first_seen(songs, key=lambda value: value[0])
+            ranked.sort(key=lambda value: (-counts[value], order[value]))
+        return ranked[:100]
+
+
 class Collection:
     """A collection of songs which implements some methods similar to the
     AudioFile class.
@@ -97,18 +291,38 @@ class Collection:
     songs = ()
 
     def __init__(self):
-        """Cache in _cache, LRU key order in _used, keys that return default
-        are in _default"""
-        self.__cache = {}
+        """Cache in _cache (least recently used first, None if it needs to
+        be computed again), keys that return default are in _default, the
+        counted values of the songs for each key in _counts, kept as long
+        as a cached value was computed using them (see _used)"""
+        self.__cache = OrderedDict()
         self.__default = set()
-        self.__used = []
+        self.__counts = {}
+        self.__used = {}
+        self.__using = set()
 
     def finalize(self):
         """Finalize the collection.
         Call this after songs get added or removed"""
         self.__cache.clear()
         self.__default.clear()
-        self.__used = []
+        self.__counts.clear()
+        self.__used.clear()
+
+    def refresh(self, changed=(), removed=()):
+        """Like finalize(), but only looks at the songs which got added or
+        changed (`changed`) and the ones which got removed (`removed`)
+        instead of going through all songs again.
+
+        Only works if `songs` contains each song once.
+        """
+        cache = self.__cache
+        # keep the order, so the counts get dropped with their values
+        for key in cache:
+            cache[key] = None
+        self.__default.clear()
+        for counts in self.__counts.values():
+            counts.forget(changed, removed)
 
     def get(self, key, default=u"", connector=u" - "):
         if not self.songs:
@@ -151,24 +365,44 @@ class Collection:
         return [] if v == "" else str(v).split("\n")
 
     def __get_cached_value(self, key):
-        if key in self.__cache:
-            self.__used.remove(key)
-            self.__used.insert(0, key)
-            return self.__cache[key]
+        cache = self.__cache
+        val = cache.get(key)
+        if val is not None:
+            cache.move_to_end(key)
+            return val
         elif key in self.__default:
             return None
+
+        used = self.__used
+        self.__using = used[key] = set()
+        val = self.__get_value(key)
+        if val is None:
+            self.__default.add(key)
+            cache.pop(key, None)
+            del used[key]
         else:
-            val = self.__get_value(key)
-            if val is None:
-                self.__default.add(key)
-            else:
-                self.__used.insert(0, key)
-                self.__cache[key] = val
+            cache[key] = val
+            cache.move_to_end(key)
             # Remove the oldest if the cache is full
-            if len(self.__used) > self._cache_size:
-                self.__cache.pop(self.__used.pop(-1))
+            while len(cache) > self._cache_size:
+                del used[cache.popitem(last=False)[0]]
+
+        # only keep the counts needed to update the cached values
+        needed = set().union(*used.values())
+        for counts_key in list(self.__counts):
+            if counts_key not in needed:
+                del self.__counts[counts_key]
         return val
 
+    def __get_counts(self, key, cls=_Counts):
+        """The counts for `key`, for the value getting computed"""
+
+        self.__using.add(key)
+        counts = self.__counts.get(key)
+        if counts is None:
+            counts = self.__counts[key] = cls(key, self.songs)
+        return counts
+
     def __get_value(self, key):
         """This is similar to __call__ in the AudioFile class.
         All internal tags are changed to represent a collection of songs.
@@ -200,55 +434,22 @@ class Collection:
                 func = NUM_DEFAULT_FUNCS.get(key, "avg")
 
             key = "~#" + key
-            func = NUM_FUNCS.get(func)
-            if func:
+            if func in NUM_FUNCS:
                 # If none of the songs can return a numeric key,
                 # the album returns default
-                values = (song(key) for song in self.songs)
-                values = [v for v in values if v != ""]
-                return func(values) if values else None
+                cls = _RatingCounts if key == "~#rating" else _NumericCounts
+                counts = self.__get_counts(key, cls)
+                return counts.aggregate(func, self.songs)
             elif key in NUMERIC_ZERO_DEFAULT:
                 return 0
             return None
         elif key[:1] == "~":
             key = key[1:]
             numkey = key.split(":")[0]
-            keys = {"people": {}, "peoplesort": {}}
-            if key in keys:
-                people = keys["people"]
-                peoplesort = keys["peoplesort"]
-                for song in self.songs:
-                    # Rank people by "relevance" -- artists before composers
-                    # before performers, then by number of appearances.
-                    for w, k in enumerate(ELPOEP):
-                        persons = song.list(k)
-                        for person in persons:
-                            people[person] = (people.get(person, 0) -
-                                              PEOPLE_SCORE[w])
-                        if k in TAG_TO_SORT:
-                            persons = song.list(TAG_TO_SORT[k]) or persons
-                        for person in persons:
-                            peoplesort[person] = (peoplesort.get(person, 0) -
-                                                  PEOPLE_SCORE[w])
-                # It's cheaper to get people and peoplesort in one go
-                keys["people"] = sorted(people.keys(),
-                                        key=people.__getitem__)[:100]
-                keys["peoplesort"] = sorted(peoplesort.keys(),
-                                            key=peoplesort.__getitem__)[:100]
-
-                ret = keys.pop(key)
-                ret = (ret and "\n".join(ret)) or None
-
-                other, values = keys.popitem()
-                other = "~" + other
-                if not values:
-                    self.__default.add(other)
-                else:
-                    if other in self.__used:
-                        self.__used.remove(other)
-                    self.__used.append(other)
-                    self.__cache[other] = "\n".join(values)
-                return ret
+            if key in ("people", "peoplesort"):
+                counts = self.__get_counts("~" + key, _PeopleCounts)
+                values = counts.ranked(self.songs)
+                return "\n".join(values) if values else None
             elif numkey == "length":
                 length = self.__get_value("~#" + key)
                 return None if length is None else util.format_time(length)
@@ -279,13 +480,7 @@ class Collection:
 
         # Nothing special was found, so just take all values of the songs
         # and sort them by their number of appearance
-        result = {}
-        for song in self.songs:
-            for value in song.list(key):
-                result[value] = result.get(value, 0) - 1
-
-        values = list(map(lambda x: x[0],
-                          sorted(result.items(), key=lambda x: (x[1], x[0]))))
+        values = self.__get_counts(key).ranked()
         return "\n".join(values) if values else None
 
 
@@ -320,16 +515,44 @@ class Album(Collection):
     def str_key(self):
         return str(self.key)
 
+    @util.cached_property
+    def revision(self):
+        """An object which gets replaced by a new one on `finalize` and
+        `refresh`, like `AudioFile.revision`"""
+
+        return object()
+
     def finalize(self):
         """Finalize this album. Call after songs get added or removed"""
         super().finalize()
+        self.__forget()
+
+    def refresh(self, changed=(), removed=()):
+        super().refresh(changed, removed)
+        self.__forget()
+
+    def __forget(self):
         self.__dict__.pop("peoplesort", None)
         self.__dict__.pop("genre", None)
+        self.__dict__.pop("revision", None)
 
     def __repr__(self):
         return "Album(%s)" % repr(self.key)
 
 
+def precompute(collections, keys):
+    """Computes the values of `keys` for all collections in one go, e.g.
+    before sorting them, so the comparisons only have to look them up.
+
+    Only as many keys as the collections cache (`Collection._cache_size`)
+    are kept.
+    """
+
+    for collection in collections:
+        for key in keys:
+            collection.get(key)
+
+
 @hashable
 @total_ordering
 class Playlist(Collection, Iterable):
@@ -7,6 +7,7 @@
 # the Free Software Foundation; either version 2 of the License, or
 # (at your option) any later version.
 
+import fnmatch
 import glob
 import os.path
 import re
@@ -17,6 +18,8 @@ from senf import fsn2text
 
 from quodlibet import _
 from quodlibet.plugins.cover import CoverSourcePlugin
+from quodlibet.util.cover.fscache import DirectoryListings, FoundCovers
+from quodlibet.util.cover.fscache import get_dir_state
 from quodlibet.util.dprint import print_w
 from quodlibet import config
 
@@ -63,6 +66,10 @@ class FilesystemCover(CoverSourcePlugin):
                     "alongside the song.")
     DEBUG = False
 
+    # shared by all lookups, see forget()
+    listings = DirectoryListings()
+    found = FoundCovers()
+
     cover_subdirs = {"scan", "scans", "images", "covers", "artwork"}
     cover_exts = {"jpg", "jpeg", "png", "gif"}
 
@@ -91,21 +98,71 @@ class FilesystemCover(CoverSourcePlugin):
     def priority():
         return 0.80
 
-    @property
-    def cover(self):
-        # TODO: Deserves some refactoring
-        if not self.song.is_file:
-            return None
+    @classmethod
+    def forget(cls, songs=None):
+        """Makes the next lookup for `songs` (or all songs if None) look at
+        their directories again.
+        """
+
+        if songs is None:
+            dirnames = None
+        else:
+            dirnames = {song("~dirname") for song in songs}
+        cls.listings.forget(dirnames)
+        cls.found.forget(dirnames)
+
+    @staticmethod
+    def _get_source(song):
+        # everything the lookup uses besides the group and the files
+        return (song("~filename"), tuple(song.list("~people")),
+                song("album"), song("labelid"))
+
+    @classmethod
+    def forget_changed(cls, songs):
+        """Forgets what was found using `songs` if they changed in a way
+        which could change the result, unlike e.g. their play count.
+        """
+
+        keys = set()
+        for song in songs:
+            key = cls.group_by(song)
+            source = cls._get_source(song)
+            for found_key, found_source in cls.found.sources(key[0]):
+                if found_source is not None and \
+                        found_source[0] == source[0] and \
+                        (found_key != key or found_source != source):
+                    keys.add(found_key)
+        if keys:
+            cls.found.forget(keys=keys)
+
+    def _listdir(self, path, states):
+        try:
+            entries, states[path] = self.listings.listdir(path)
+        except OSError:
+            states[path] = get_dir_state(path)
+            raise
+        return entries
+
+    def _find_forced(self, base, filenames, states):
+        """Returns (score, path) for all files matching the configured
+        names and patterns and if the result only depends on `states`.
+        """
 
-        base = self.song('~dirname')
         images = []
+        cacheable = True
+        try:
+            entries = self._listdir(base, states)
+        except OSError:
+            entries = []
 
-        if config.getboolean("albumart", "force_filename"):
-            score = 100
-            for filename in config.get("albumart", "filename").split(","):
-                # Remove white space to avoid confusion (e.g. "name, name2")
-                filename = filename.strip()
+        score = 100
+        for filename in filenames.split(","):
+            # Remove white space to avoid confusion (e.g. "name, name2")
+            filename = filename.strip()
 
+            if os.sep in filename or (os.altsep and os.altsep in filename):
+                # patterns for subdirectories, glob them every time
+                cacheable = False
                 escaped_path = os.path.join(glob.escape(base), filename)
                 try:
                     for path in glob.glob(escaped_path):
@@ -118,90 +175,152 @@ class FilesystemCover(CoverSourcePlugin):
                     # files in case no preferred file was found.
                     if os.path.isfile(path):
                         images.append((score, path))
+            else:
+                try:
+                    matches = fnmatch.filter(entries, filename)
+                except sre_constants.error:
+                    # Use literal filename if globbing causes errors
+                    matches = [filename] if filename in entries else []
+                # like glob, only match hidden files if asked for
+                if not filename.startswith("."):
+                    matches = [m for m in matches if not m.startswith(".")]
+                for match in matches:
+                    images.append((score, os.path.join(base, match)))
 
-                # So names and patterns at the start are preferred
-                score -= 1
+            # So names and patterns at the start are preferred
+            score -= 1
 
-        if not images:
-            entries = []
+        return images, cacheable
+
+    def _find_scored(self, base, states):
+        """Returns (score, path) for all images which are likely covers"""
+
+        images = []
+        entries = []
+        try:
+            entries = self._listdir(base, states)
+        except EnvironmentError:
+            print_w("Can't list album art directory %s" % base)
+
+        fns = []
+        for entry in entries:
+            lentry = entry.lower()
+            if get_ext(lentry) in self.cover_exts:
+                fns.append((None, entry))
+            if lentry in self.cover_subdirs:
+                subdir = os.path.join(base, entry)
+                sub_entries = []
+                try:
+                    sub_entries = self._listdir(subdir, states)
+                except EnvironmentError:
+                    pass
+                for sub_entry in sub_entries:
+                    lsub_entry = sub_entry.lower()
+                    if get_ext(lsub_entry) in self.cover_exts:
+                        fns.append((entry, sub_entry))
+
+        labelid = self.song.get("labelid", "").lower()
+        # Track-related keywords
+        values = set(self.song.list("~people")) | {self.song("album")}
+        lowers = [value.lower().strip() for value in values
+                  if len(value) > 1]
+        total_terms = sum(len(s.split()) for s in lowers)
+
+        for sub, fn in fns:
+            dec_lfn = os.path.splitext(fsn2text(fn))[0].lower()
+
+            score = 0
+            # check for the album label number
+            if labelid and labelid in dec_lfn:
+                score += 20
+
+            total_words = len([word for word in dec_lfn.split()
+                               if len(word) > 1])
+            # Penalise for many extra words in filename (wrong file?)
+            length_penalty = (- int((total_words - 1) / total_terms)
+                              if total_terms else 0)
+
+            # Matching tag values are very good
+            score += 3 * sum([value in dec_lfn for value in lowers])
+
+            # Well known names matching exactly (folder.jpg)
+            score += 4 * sum(r.search(dec_lfn) is not None
+                             for r in self.cover_name_regexes)
+
+            # Generic keywords
+            score += 2 * sum(r.search(dec_lfn) is not None
+                             for r in self.cover_positive_regexes)
+
+            score -= 3 * sum(r.search(dec_lfn) is not None
+                             for r in self.cover_negative_regexes)
+
+            sub_text = f" (in {sub!r})" if sub else ""
+            if self.DEBUG:
+                print(f"[{self.song('~~people~title')}]: "
+                      f"Album art {fn!r}{sub_text} "
+                      f"scores {score} ({length_penalty})")
+            score += length_penalty
+
+            # Let's only match if we're quite sure.
+            # This allows other sources to kick in
+            if score > 2:
+                if sub is not None:
+                    fn = os.path.join(sub, fn)
+                images.append((score, os.path.join(base, fn)))
+
+        return images
+
+    @property
+    def cover(self):
+        if not self.song.is_file:
+            return None
+
+        key = self.group_by(self.song)
+        force = config.getboolean("albumart", "force_filename")
+        filenames = config.get("albumart", "filename")
+        options = (force, filenames if force else None)
+
+        try:
+            path = self.found.get(key, options)
+        except KeyError:
+            pass
+        else:
+            if path is None:
+                return None
             try:
-                entries = os.listdir(base)
-            except EnvironmentError:
-                print_w("Can't list album art directory %s" % base)
-
-            fns = []
-            for entry in entries:
-                lentry = entry.lower()
-                if get_ext(lentry) in self.cover_exts:
-                    fns.append((None, entry))
-                if lentry in self.cover_subdirs:
-                    subdir = os.path.join(base, entry)
-                    sub_entries = []
-                    try:
-                        sub_entries = os.listdir(subdir)
-                    except EnvironmentError:
-                        pass
-                    for sub_entry in sub_entries:
-                        lsub_entry = sub_entry.lower()
-                        if get_ext(lsub_entry) in self.cover_exts:
-                            fns.append((entry, sub_entry))
-
-            for sub, fn in fns:
-                dec_lfn = os.path.splitext(fsn2text(fn))[0].lower()
-
-                score = 0
-                # check for the album label number
-                labelid = self.song.get("labelid", "").lower()
-                if labelid and labelid in dec_lfn:
-                    score += 20
-
-                # Track-related keywords
-                values = set(self.song.list("~people")) | {self.song("album")}
-                lowers = [value.lower().strip() for value in values
-                          if len(value) > 1]
-                total_terms = sum(len(s.split()) for s in lowers)
-                total_words = len([word for word in dec_lfn.split()
-                                   if len(word) > 1])
-                # Penalise for many extra words in filename (wrong file?)
-                length_penalty = (- int((total_words - 1) / total_terms)
-                                  if total_terms else 0)
-
-                # Matching tag values are very good
-                score += 3 * sum([value in dec_lfn for value in lowers])
-
-                # Well known names matching exactly (folder.jpg)
-                score += 4 * sum(r.search(dec_lfn) is not None
-                                 for r in self.cover_name_regexes)
-
-                # Generic keywords
-                score += 2 * sum(r.search(dec_lfn) is not None
-                                 for r in self.cover_positive_regexes)
-
-                score -= 3 * sum(r.search(dec_lfn) is not None
-                                 for r in self.cover_negative_regexes)
-
-                sub_text = f" (in {sub!r})" if sub else ""
-                if self.DEBUG:
-                    print(f"[{self.song('~~people~title')}]: "
-                          f"Album art {fn!r}{sub_text} "
-                          f"scores {score} ({length_penalty})")
-                score += length_penalty
-
-                # Let's only match if we're quite sure.
-                # This allows other sources to kick in
-                if score > 2:
-                    if sub is not None:
-                        fn = os.path.join(sub, fn)
-                    images.append((score, os.path.join(base, fn)))
+                return open(path, "rb")
+            except IOError:
+                # gone since, look again
+                pass
+
+        base = key[0]
+        # the state of all directories looked at
+        states = {}
+        images = []
+        cacheable = True
+
+        if force:
+            images, cacheable = self._find_forced(base, filenames, states)
+
+        if not images:
+            images = self._find_scored(base, states)
 
         images.sort(reverse=True)
+        found = None
+        fileobj = None
         for score, path in images:
             # could be a directory
             if not os.path.isfile(path):
                 continue
             try:
-                return open(path, "rb")
+                fileobj = open(path, "rb")
             except IOError:
                 print_w("Failed reading album art \"%s\"" % path)
-
-        return None
+            else:
+                found = path
+                break
+
+        if cacheable:
+            self.found.set(
+                key, options, found, states, self._get_source(self.song))
+        return fileobj
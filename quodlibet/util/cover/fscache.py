@@ -0,0 +1,240 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Caches for finding covers in the file system without looking at the
+same directories over and over again, which is slow on network shares.
+
+Both are validated using the state of the directories involved, so new,
+removed or renamed images get noticed.
+"""
+
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from senf import fsnative
+
+from quodlibet import util
+from quodlibet.util.atomic import atomic_save
+from quodlibet.util.picklehelper import pickle_loads, pickle_dumps
+
+
+# Directories changed this recently could change again without their mtime
+# changing on file systems with a coarse mtime resolution
+_UNSETTLED = 2
+
+
+def get_dir_state(path):
+    """Returns something which changes if entries of the directory get
+    added, removed or renamed, or None if it can't be accessed.
+    """
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    # the inode changes if the directory got replaced
+    return (stat.st_mtime_ns, stat.st_ino)
+
+
+def _is_settled(state):
+    return state is None or \
+        time.time() - state[0] / 1e9 > _UNSETTLED
+
+
+class DirectoryListings:
+    """The entries of recently listed directories.
+
+    Thread-safe.
+    """
+
+    def __init__(self, max_size=1000):
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._listings = OrderedDict()
+        # parent directory -> listed paths in it
+        self._children = {}
+
+    def listdir(self, path):
+        """Like os.listdir(), but only lists the directory again if it
+        changed since the last time.
+
+        Returns:
+            Tuple[List[fsnative], state]: the entries and the state of the
+                directory when it was listed, see get_dir_state()
+        Raises:
+            OSError
+        """
+
+        state = get_dir_state(path)
+        with self._lock:
+            cached = self._listings.get(path)
+            if cached is not None and cached[0] == state:
+                self._listings.move_to_end(path)
+                return cached[1], state
+
+        entries = os.listdir(path)
+        if state is not None and _is_settled(state):
+            with self._lock:
+                self._listings[path] = (state, entries)
+                self._children.setdefault(
+                    os.path.dirname(path), set()).add(path)
+                while len(self._listings) > self._max_size:
+                    self._remove(next(iter(self._listings)))
+        return entries, state
+
+    def _remove(self, path):
+        if self._listings.pop(path, None) is None:
+            return
+        parent = os.path.dirname(path)
+        children = self._children[parent]
+        children.discard(path)
+        if not children:
+            del self._children[parent]
+
+    def forget(self, dirnames=None):
+        """Forgets the listings of `dirnames` and their subdirectories,
+        or all of them if None.
+        """
+
+        with self._lock:
+            if dirnames is None:
+                self._listings.clear()
+                self._children.clear()
+                return
+            for dirname in dirnames:
+                self._remove(dirname)
+                for path in list(self._children.get(dirname, ())):
+                    self._remove(path)
+
+
+class FoundCovers:
+    """Which cover file was found for each group of songs, together with
+    the state of all directories looked at to find it and what it depends
+    on besides them (its source, e.g. the tags of the song used).
+
+    Keys start with the directory of the songs.
+
+    Thread-safe.
+    """
+
+    def __init__(self, max_size=50000):
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._found = OrderedDict()
+        # directory -> keys of the covers found for songs in it
+        self._dirs = {}
+
+    def get(self, key, options):
+        """Returns the path of the cover found for `key` (None if none was
+        found), as long as it was found using the same `options` and none
+        of the directories changed since.
+
+        Raises:
+            KeyError
+        """
+
+        with self._lock:
+            path, found_options, states, source = self._found[key]
+        if found_options != options or \
+                any(get_dir_state(d) != s for d, s in states.items()):
+            with self._lock:
+                self._remove(key)
+            raise KeyError(key)
+        with self._lock:
+            if key in self._found:
+                self._found.move_to_end(key)
+        return path
+
+    def set(self, key, options, path, states, source=None):
+        """Remembers the `path` (or None) found for `key`, using `options`.
+
+        Args:
+            states (Dict[fsnative, object]): the state of all directories
+                looked at, see get_dir_state()
+            source (object): what else the result depends on, see
+                sources()
+        """
+
+        if not all(map(_is_settled, states.values())):
+            return
+        with self._lock:
+            self._found[key] = (path, options, states, source)
+            self._found.move_to_end(key)
+            self._dirs.setdefault(key[0], set()).add(key)
+            while len(self._found) > self._max_size:
+                self._remove(next(iter(self._found)))
+
+    def _remove(self, key):
+        if self._found.pop(key, None) is None:
+            return
+        keys = self._dirs[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._dirs[key[0]]
+
+    def sources(self, dirname):
+        """Returns a list of (key, source) for all covers found for songs
+        in `dirname`.
+        """
+
+        with self._lock:
+            return [(key, self._found[key][3])
+                    for key in self._dirs.get(dirname, ())]
+
+    def forget(self, dirnames=None, keys=None):
+        """Forgets all covers found for songs in `dirnames` and the ones
+        for `keys`, or all of them if both are None.
+        """
+
+        with self._lock:
+            if dirnames is None and keys is None:
+                self._found.clear()
+                self._dirs.clear()
+                return
+            keys = set(keys or ())
+            for dirname in dirnames or ():
+                keys.update(self._dirs.get(dirname, ()))
+            for key in keys:
+                self._remove(key)
+
+    def load(self, filename):
+        """Replaces everything with what got saved to `filename`"""
+
+        assert isinstance(filename, fsnative)
+
+        try:
+            with open(filename, "rb") as h:
+                found = OrderedDict(pickle_loads(h.read()))
+        except EnvironmentError:
+            return
+        except (pickle.UnpicklingError, TypeError, ValueError):
+            util.print_exc()
+            return
+
+        dirs = {}
+        for key, entry in list(found.items()):
+            # saved by an older version
+            if len(entry) != 4:
+                del found[key]
+                continue
+            dirs.setdefault(key[0], set()).add(key)
+
+        with self._lock:
+            self._found = found
+            self._dirs = dirs
+
+    def save(self, filename):
+        assert isinstance(filename, fsnative)
+
+        with self._lock:
+            found = list(self._found.items())
+        try:
+            with atomic_save(filename, "wb") as h:
+                h.write(pickle_dumps(found, 2))
+        except EnvironmentError:
+            util.print_exc()
@@ -6,18 +6,23 @@
 # the Free Software Foundation; either version 2 of the License, or
 # (at your option) any later version.
 
+import os
+import threading
 from itertools import chain
 
 from gi.repository import GObject
+from senf import fsnative
 
 from quodlibet import _
+from quodlibet import config
+from quodlibet import get_cache_dir
 from quodlibet.formats import AudioFile
 from quodlibet.plugins import PluginManager, PluginHandler
 from quodlibet.qltk.notif import Task
 from quodlibet.util.cover import built_in
 from quodlibet.util import print_d
 from quodlibet.util.thread import call_async
-from quodlibet.util.thumbnails import get_thumbnail_from_file
+from quodlibet.util.thumbnails import get_thumbnail_from_file, CoverThumbnails
 from quodlibet.plugins.cover import CoverSourcePlugin
 
 
@@ -26,6 +31,7 @@ class CoverPluginHandler(PluginHandler):
 
     def __init__(self, use_built_in=True):
         self.providers = set()
+        self._lock = threading.Lock()
         if use_built_in:
             self.built_in = {built_in.EmbeddedCover, built_in.FilesystemCover}
         else:
@@ -35,18 +41,22 @@ class CoverPluginHandler(PluginHandler):
         return issubclass(plugin.cls, CoverSourcePlugin)
 
     def plugin_enable(self, plugin):
-        self.providers.add(plugin)
+        with self._lock:
+            self.providers.add(plugin)
         print_d("Registered {0} cover source".format(plugin.cls.__name__))
 
     def plugin_disable(self, plugin):
-        self.providers.remove(plugin)
+        with self._lock:
+            self.providers.remove(plugin)
         print_d("Unregistered {0} cover source".format(plugin.cls.__name__))
 
     @property
     def sources(self):
         """Yields all active CoverSourcePlugin classes sorted by priority"""
 
-        sources = chain((p.cls for p in self.providers), self.built_in)
+        with self._lock:
+            providers = list(self.providers)
+        sources = chain((p.cls for p in providers), self.built_in)
         for p in sorted(sources, reverse=True, key=lambda x: x.priority()):
             yield p
 
@@ -69,6 +79,23 @@ class CoverManager(GObject.Object):
     def __init__(self, use_built_in=True):
         super().__init__()
         self.plugin_handler = CoverPluginHandler(use_built_in)
+        self._thumbnails = None
+        # Cover sources don't have to be thread-safe, so only one thread
+        # at a time asks them, see get_pixbuf_many()
+        self._lock = threading.RLock()
+
+    @property
+    def thumbnails(self):
+        """The CoverThumbnails of covers shown by get_pixbuf() etc."""
+
+        with self._lock:
+            if self._thumbnails is None:
+                max_size = config.getint(
+                    "albumart", "thumbnail_cache_size", 100) * 1024 * 1024
+                self._thumbnails = CoverThumbnails(
+                    os.path.join(get_cache_dir(), "cover-thumbnails"),
+                    max_size)
+            return self._thumbnails
 
     def init_plugins(self):
         """Register the cover sources plugin handler with the global
@@ -77,6 +104,30 @@ class CoverManager(GObject.Object):
 
         PluginManager.instance.register_handler(self.plugin_handler)
 
+    def _get_found_covers_path(self):
+        return os.path.join(get_cache_dir(), "filesystem-covers")
+
+    def init_cache(self, librarian):
+        """Loads the covers found in the file system in earlier sessions
+        and forgets them for songs which change or get removed.
+        """
+
+        built_in.FilesystemCover.found.load(self._get_found_covers_path())
+
+        def changed(librarian, songs):
+            built_in.FilesystemCover.forget_changed(songs)
+
+        def removed(librarian, songs):
+            built_in.FilesystemCover.forget(songs)
+
+        librarian.connect("changed", changed)
+        librarian.connect("removed", removed)
+
+    def save_cache(self):
+        """Saves the covers found in the file system for the next session"""
+
+        built_in.FilesystemCover.found.save(self._get_found_covers_path())
+
     @property
     def sources(self):
         return self.plugin_handler.sources
@@ -90,6 +141,7 @@ class CoverManager(GObject.Object):
         to re-fetch the cover and do a display update.
         """
 
+        built_in.FilesystemCover.forget(songs)
         self.emit("cover-changed", songs)
 
     def acquire_cover(self, callback, cancellable, song):
@@ -150,6 +202,16 @@ class CoverManager(GObject.Object):
         """Same as acquire_cover_sync but returns a cover for multiple
         images"""
 
+        with self._lock:
+            for plugin, song in self._candidates(songs, embedded, external):
+                cover = plugin(song).cover
+                if cover:
+                    return cover
+
+    def _candidates(self, songs, embedded=True, external=True):
+        """Yields (source, song) for all cover sources and the songs
+        to ask them for, in the order they should be tried"""
+
         for plugin in self.sources:
             if not embedded and plugin.embedded:
                 continue
@@ -164,10 +226,45 @@ class CoverManager(GObject.Object):
             # sort both groups and songs by key, so we always get
             # the same result for the same set of songs
             for key, group in sorted(groups.items()):
-                song = sorted(group, key=lambda s: s.key)[0]
+                yield plugin, sorted(group, key=lambda s: s.key)[0]
+
+    def _find_cover(self, songs, boundary, use_thumbnails=True):
+        """Returns (path, fileobj) for the cover of songs, path being the
+        file it comes from (the song for embedded covers) or None.
+
+        If there is a thumbnail for it, fileobj is None and the cover
+        doesn't get loaded at all, unless `use_thumbnails` is False.
+        """
+
+        thumbnails = self.thumbnails
+        with self._lock:
+            for plugin, song in self._candidates(songs):
+                path = None
+                if plugin.embedded and song.is_file:
+                    path = song("~filename")
+                    if use_thumbnails and \
+                            thumbnails.contains(path, boundary):
+                        return path, None
                 cover = plugin(song).cover
                 if cover:
-                    return cover
+                    if not plugin.embedded:
+                        path = getattr(cover, "name", None)
+                        if not isinstance(path, fsnative):
+                            path = None
+                        elif use_thumbnails and \
+                                thumbnails.contains(path, boundary):
+                            cover.close()
+                            return path, None
+                    return path, cover
+        return None, None
+
+    def _get_thumbnail(self, path, fileobj, boundary):
+        if fileobj is None:
+            return self.thumbnails.get(path, boundary)
+        pixbuf = get_thumbnail_from_file(fileobj, boundary)
+        if pixbuf is not None and path is not None:
+            self.thumbnails.put(path, boundary, pixbuf)
+        return pixbuf
 
     def get_cover(self, song):
         """Returns a cover file object for one song or None.
@@ -191,14 +288,22 @@ class CoverManager(GObject.Object):
         """Returns a Pixbuf which fits into the boundary defined by width
         and height or None.
 
-        Uses the thumbnail cache if possible.
+        Uses the thumbnail cache if possible. Can be called from other
+        threads, the cover sources only get asked by one at a time though.
         """
 
-        fileobj = self.get_cover_many(songs)
-        if fileobj is None:
+        boundary = (width, height)
+        path, fileobj = self._find_cover(songs, boundary)
+        if path is None and fileobj is None:
             return
 
-        return get_thumbnail_from_file(fileobj, (width, height))
+        pixbuf = self._get_thumbnail(path, fileobj, boundary)
+        if pixbuf is None and fileobj is None:
+            # the thumbnail got removed or was broken, load the cover
+            path, fileobj = self._find_cover(songs, boundary, False)
+            if fileobj is not None:
+                pixbuf = self._get_thumbnail(path, fileobj, boundary)
+        return pixbuf
 
     def get_pixbuf(self, song, width, height):
         """see get_pixbuf_many()"""
@@ -212,12 +317,23 @@ class CoverManager(GObject.Object):
         The callback will be called in the main loop.
         """
 
-        fileobj = self.get_cover_many(songs)
-        if fileobj is None:
+        boundary = (width, height)
+        path, fileobj = self._find_cover(songs, boundary)
+        if path is None and fileobj is None:
             return
 
-        call_async(get_thumbnail_from_file, cancel, callback,
-                   args=(fileobj, (width, height)))
+        def thumbnail_cb(pixbuf):
+            if pixbuf is None and fileobj is None:
+                # the thumbnail got removed or was broken, load the cover
+                path, cover = self._find_cover(songs, boundary, False)
+                if cover is not None:
+                    call_async(self._get_thumbnail, cancel, callback,
+                               args=(path, cover, boundary))
+                    return
+            callback(pixbuf)
+
+        call_async(self._get_thumbnail, cancel, thumbnail_cb,
+                   args=(path, fileobj, boundary))
 
     def search_cover(self, cancellable, songs):
         """Search for all the covers applicable to `songs` across all providers
@@ -7,6 +7,10 @@
 
 """Utils for executing things in a thread controlled from the main loop"""
 
+import threading
+import time
+from collections import deque
+from itertools import chain
 from multiprocessing import cpu_count
 try:
     from concurrent.futures import ThreadPoolExecutor
@@ -147,3 +151,354 @@ def call_async_background(function, cancellable, callback, args=None,
 
     _call_async(Priority.BACKGROUND, function, cancellable, callback,
                 args, kwargs)
+
+
+class AsyncFilter:
+    """Filters items in a thread, passing the matching ones to the main loop
+    in batches while they are found.
+
+    Starting a new search cancels the previous one. The first items get
+    filtered right away, so small searches finish without using a thread.
+    """
+
+    SYNC_TIME = 0.03
+    """How long to filter in the main thread before using a thread"""
+
+    BATCH_TIME = 0.1
+    """How long to collect matches before passing them to the main loop"""
+
+    CHUNK_SIZE = 250
+    """How many items to filter between checks for cancellation"""
+
+    def __init__(self):
+        self._cancellable = Cancellable()
+        self.first_result_time = None
+        """Seconds until the last search found something or was done"""
+
+    def cancel(self):
+        """Cancel the running search, its callback won't be called anymore"""
+
+        self._cancellable.cancel()
+
+    def filter(self, function, items, callback, sync=False, thread=True):
+        """Calls `callback(matches, done)` with the items `function`
+        returns True for, in order.
+
+        If all items got filtered within `SYNC_TIME` or `sync` is True, the
+        callback gets called once before this returns. Otherwise it gets
+        called from the main loop for each batch of matches, the last time
+        with `done` being True. If `function` fails the search stops there,
+        as if all items were filtered.
+
+        If `thread` is False the remaining items get filtered in the main
+        loop in small steps instead, for items which aren't safe to access
+        from other threads.
+        """
+
+        self.cancel()
+        self._cancellable = cancellable = Cancellable()
+        items = list(items)
+        chunk = self.CHUNK_SIZE
+        start = time.perf_counter()
+        self.first_result_time = None
+
+        def deliver(matches, done):
+            if self.first_result_time is None:
+                self.first_result_time = time.perf_counter() - start
+            if done:
+                util.print_d("Filtered %d items in %.3fs, first results "
+                             "after %.3fs" % (
+                                 len(items), time.perf_counter() - start,
+                                 self.first_result_time))
+            callback(matches, done)
+
+        pos = 0
+        matches = []
+        deadline = start + self.SYNC_TIME
+        try:
+            while pos < len(items):
+                matches.extend(filter(function, items[pos:pos + chunk]))
+                pos += chunk
+                if not sync and time.perf_counter() > deadline:
+                    break
+        except Exception:
+            util.print_exc()
+            pos = len(items)
+
+        if pos >= len(items):
+            deliver(matches, True)
+            return
+        elif matches:
+            deliver(matches, False)
+
+        if not thread:
+            def step():
+                nonlocal pos
+
+                if cancellable.is_cancelled():
+                    return False
+                matches = []
+                deadline = time.perf_counter() + self.SYNC_TIME
+                try:
+                    while pos < len(items):
+                        matches.extend(
+                            filter(function, items[pos:pos + chunk]))
+                        pos += chunk
+                        if time.perf_counter() > deadline:
+                            break
+                except Exception:
+                    util.print_exc()
+                    pos = len(items)
+                done = pos >= len(items)
+                if matches or done:
+                    deliver(matches, done)
+                return not done
+
+            GLib.idle_add(step, priority=GLib.PRIORITY_DEFAULT)
+            return
+
+        def deliver_main(matches):
+            if not cancellable.is_cancelled():
+                deliver(matches, False)
+            return False
+
+        def run(pos):
+            matches = []
+            last = time.perf_counter()
+            while pos < len(items):
+                if cancellable.is_cancelled():
+                    return []
+                try:
+                    matches.extend(filter(function, items[pos:pos + chunk]))
+                except Exception:
+                    # still finish the search
+                    util.print_exc()
+                    break
+                pos += chunk
+                if matches and time.perf_counter() - last > self.BATCH_TIME:
+                    # same priority as the final callback, so they stay
+                    # in order
+                    GLib.idle_add(deliver_main, matches,
+                                  priority=GLib.PRIORITY_DEFAULT)
+                    matches = []
+                    last = time.perf_counter()
+            return matches
+
+        call_async(run, cancellable, lambda m: deliver(m, True), args=(pos,))
+
+
+class _QueueEntry:
+
+    __slots__ = ("function", "args", "callback", "cancellable",
+                 "background", "in_background", "running", "stale")
+
+    def __init__(self, function, args, callback):
+        self.function = function
+        self.args = args
+        self.callback = callback
+        # for the pending queue and the background one
+        self.cancellable = None
+        self.background = None
+        self.in_background = False
+        self.running = False
+        # queued again while running, the result is outdated
+        self.stale = False
+
+    def is_visible(self):
+        return self.cancellable is not None and \
+            not self.cancellable.is_cancelled()
+
+    def is_wanted(self):
+        return self.is_visible() or (self.background is not None and
+                                     not self.background.is_cancelled())
+
+
+class AsyncQueue:
+    """Calls functions for queued keys in a bounded number of threads and
+    passes the results to the main loop in batches.
+
+    Keys queued last get processed first, keys queued for the background
+    only when nothing else is left. Queueing a key which is still pending
+    replaces its function and callback instead of running it twice, one
+    which is running gets run again once done. A key stays queued in the
+    background while its background cancellable isn't cancelled.
+    """
+
+    BATCH_TIME = 0.05
+    """How long to collect results before passing them to the main loop"""
+
+    def __init__(self, max_workers=None, done=None):
+        """`done()` gets called in the main loop after each batch of
+        callbacks.
+        """
+
+        if max_workers is None:
+            try:
+                max_workers = min(cpu_count(), 4)
+            except NotImplementedError:
+                max_workers = 2
+        self._max_workers = max_workers
+        self._done = done
+        self._pool = None
+        self._lock = threading.Lock()
+        # key -> _QueueEntry
+        self._entries = {}
+        self._pending = deque()
+        self._background = deque()
+        self._workers = 0
+        self._results = []
+        self._flush_id = None
+
+    def put(self, key, function, args, callback, cancellable,
+            background=False):
+        """Calls `function(*args)` in a thread and `callback(result)` in the
+        main loop, unless `cancellable` got cancelled before either.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _QueueEntry(
+                    function, args, callback)
+            else:
+                entry.function = function
+                entry.args = args
+                entry.callback = callback
+                entry.stale = entry.running
+            if background:
+                entry.background = cancellable
+            else:
+                entry.cancellable = cancellable
+            if entry.running:
+                # gets queued again once done
+                return
+            if not background:
+                self._pending.append(key)
+            elif not entry.in_background:
+                self._queue_background(key, entry)
+            start = self._reserve_worker()
+
+        if start:
+            self._start_worker()
+
+    def clear(self):
+        """Forgets all keys which aren't running yet"""
+
+        with self._lock:
+            for key in chain(self._pending, self._background):
+                entry = self._entries.get(key)
+                if entry is not None and not entry.running:
+                    del self._entries[key]
+            self._pending.clear()
+            self._background.clear()
+
+    def destroy(self):
+        """Stops processing, no callbacks will be called anymore"""
+
+        self.clear()
+        if self._flush_id is not None:
+            GLib.source_remove(self._flush_id)
+            self._flush_id = None
+        with self._lock:
+            self._entries.clear()
+            self._results = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def _queue_background(self, key, entry):
+        # with the lock held
+        self._background.appendleft(key)
+        entry.in_background = True
+
+    def _reserve_worker(self):
+        # with the lock held
+        if self._workers >= self._max_workers:
+            return False
+        self._workers += 1
+        return True
+
+    def _start_worker(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self._max_workers)
+        self._pool.submit(self._work)
+
+    def _next(self):
+        # with the lock held
+        while self._pending or self._background:
+            visible = bool(self._pending)
+            if visible:
+                key = self._pending.pop()
+            else:
+                key = self._background.pop()
+            entry = self._entries.get(key)
+            if entry is not None and not visible:
+                entry.in_background = False
+            if entry is None or entry.running:
+                # done, or queued again while running
+                continue
+            if not entry.is_wanted():
+                del self._entries[key]
+                continue
+            if visible and not entry.is_visible():
+                # not visible anymore, wait for its turn in the background
+                if not entry.in_background:
+                    self._queue_background(key, entry)
+                continue
+            entry.running = True
+            return key, entry.function, entry.args
+        return None
+
+    def _work(self):
+        while True:
+            with self._lock:
+                next_ = self._next()
+                if next_ is None:
+                    self._workers -= 1
+                    return
+            key, function, args = next_
+
+            try:
+                result = function(*args)
+            except Exception:
+                util.print_exc()
+                result = None
+
+            with self._lock:
+                self._results.append((key, result))
+                if self._flush_id is None:
+                    self._flush_id = GLib.timeout_add(
+                        int(self.BATCH_TIME * 1000), self._flush)
+
+    def _flush(self):
+        with self._lock:
+            self._flush_id = None
+            results = self._results
+            self._results = []
+            callbacks = []
+            start = 0
+            for key, result in results:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                entry.running = False
+                if entry.stale and entry.is_wanted():
+                    # queued again while running, run it again instead
+                    entry.stale = False
+                    if entry.is_visible():
+                        self._pending.append(key)
+                    elif not entry.in_background:
+                        self._queue_background(key, entry)
+                    start += self._reserve_worker()
+                    continue
+                del self._entries[key]
+                if entry.is_wanted():
+                    callbacks.append((entry.callback, result))
+
+        for i in range(start):
+            self._start_worker()
+        for callback, result in callbacks:
+            callback(result)
+        if callbacks and self._done is not None:
+            self._done()
+        return False
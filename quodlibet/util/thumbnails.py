@@ -7,6 +7,8 @@
 
 import os
 import hashlib
+import threading
+from collections import OrderedDict
 
 from gi.repository import GdkPixbuf, GLib
 from senf import fsn2uri, fsnative, gettempdir
@@ -179,3 +181,150 @@ def get_thumbnail(path, boundary, ignore_temp=True):
         pass
 
     return scale(thumb_pb, boundary)
+
+
+class CoverThumbnails:
+    """A cache of covers scaled to the size they get shown at, so showing
+    the covers of many albums doesn't need to load each full image again.
+
+    Unlike the thumbnail cache above this also works for embedded covers,
+    which get extracted to temporary files. Thumbnails are keyed by the file
+    the cover comes from (the song for embedded covers), its mtime and size
+    and the boundary they got scaled to (including the scale factor).
+
+    They are stored as PNG files in `folder`. Once those take up more than
+    `max_size` bytes the least recently used ones get removed.
+
+    Thread-safe.
+    """
+
+    def __init__(self, folder, max_size):
+        self.folder = folder
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        # file name -> file size, least recently used first
+        self._files = None
+        self._size = 0
+
+    @property
+    def stats(self):
+        """A dict of counters, e.g. for debugging"""
+
+        with self._lock:
+            files = self._get_files()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "files": len(files),
+                "size": self._size,
+            }
+
+    def _get_files(self):
+        if self._files is None:
+            entries = []
+            try:
+                with os.scandir(self.folder) as it:
+                    for entry in it:
+                        if entry.name.endswith(".png"):
+                            stat = entry.stat()
+                            entries.append(
+                                (stat.st_mtime, entry.name, stat.st_size))
+            except OSError:
+                pass
+            entries.sort()
+            self._files = OrderedDict(
+                (name, size) for mtime_, name, size in entries)
+            self._size = sum(self._files.values())
+        return self._files
+
+    def _get_name(self, path, boundary):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = repr((stat.st_mtime, stat.st_size, tuple(boundary)))
+        data = os.fsencode(path) + b"\0" + key.encode("ascii")
+        return hashlib.sha1(data).hexdigest() + ".png"
+
+    def contains(self, path, boundary):
+        """If there is a thumbnail for the cover in `path`"""
+
+        name = self._get_name(path, boundary)
+        if name is None:
+            return False
+        with self._lock:
+            return name in self._get_files()
+
+    def get(self, path, boundary):
+        """Returns the thumbnail of the cover in `path` or None"""
+
+        name = self._get_name(path, boundary)
+        with self._lock:
+            files = self._get_files()
+            if name not in files:
+                self.misses += 1
+                return None
+            files.move_to_end(name)
+
+        filename = os.path.join(self.folder, name)
+        try:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file(filename)
+            # so the order survives restarts
+            os.utime(filename)
+        except (GLib.GError, OSError):
+            with self._lock:
+                self._remove(name)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return pixbuf
+
+    def put(self, path, boundary, pixbuf):
+        """Stores the thumbnail of the cover in `path`"""
+
+        name = self._get_name(path, boundary)
+        if name is None or self.max_size <= 0:
+            return
+
+        filename = os.path.join(self.folder, name)
+        try:
+            mkdir(self.folder, 0o700)
+            pixbuf.savev(filename, "png", [], [])
+            size = os.path.getsize(filename)
+        except (GLib.GError, OSError):
+            return
+
+        with self._lock:
+            files = self._get_files()
+            self._size += size - files.pop(name, 0)
+            files[name] = size
+            self.stores += 1
+            while self._size > self.max_size and len(files) > 1:
+                self._remove(next(iter(files)))
+                self.evictions += 1
+
+    def _remove(self, name):
+        size = self._files.pop(name, None)
+        if size is not None:
+            self._size -= size
+        try:
+            os.remove(os.path.join(self.folder, name))
+        except OSError:
+            pass
+
+    def clear(self):
+        """Removes all thumbnails"""
+
+        with self._lock:
+            for name in list(self._get_files()):
+                self._remove(name)
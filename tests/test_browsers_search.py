@@ -131,6 +131,58 @@ class TSearchBar(TestCase):
         finally:
             SongList.star = old
 
+    def test_search_refine(self):
+        self.bar.filter_text("t")
+        self.expected = sorted(SONGS[1:])
+        self._do()
+        self.success = False
+        self.bar.filter_text("tw")
+        self.expected = [SONGS[1]]
+        self._do()
+
+        song = SONGS[0]
+        old = song["title"]
+        song["title"] = "twenty"
+        try:
+            quodlibet.browsers.tracks.library.changed([song])
+            self.success = False
+            self.bar.filter_text("twe")
+            self.expected = [song]
+            self._do()
+        finally:
+            song["title"] = old
+
+    def test_search_background(self):
+        self.bar.disconnect_by_func(self._expected)
+        self.bar._filter.SYNC_TIME = 0
+        self.bar._filter.BATCH_TIME = 0
+        self.bar._filter.CHUNK_SIZE = 1
+        selected = []
+        added = []
+        completes = []
+        partial = []
+
+        def selected_cb(bar, songs, s):
+            selected.append(songs)
+            completes.append(bar.completes_added)
+            partial.append(bar.partial)
+
+        self.bar.connect('songs-selected', selected_cb)
+        self.bar.connect('songs-added', lambda bar, songs: added.extend(songs))
+
+        self.bar.filter_text("o")
+        while len(selected) < 2:
+            Gtk.main_iteration()
+        self.assertTrue(added)
+        self.assertEqual(set(selected[0] + added), set(SONGS))
+
+        # at the end, for everything not handling songs-added
+        self.assertEqual(completes, [False, True])
+        self.assertEqual(partial, [True, False])
+        self.assertEqual(selected[1], selected[0] + added)
+        self.assertFalse(self.bar.completes_added)
+        self.assertFalse(self.bar.partial)
+
     def test_saverestore(self):
         self.bar.filter_text("title = %s" % SONGS[0]["title"])
         self.expected = [SONGS[0]]
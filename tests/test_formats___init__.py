@@ -120,6 +120,25 @@ class TPickle(TestCase):
         assert i["int"] == 42
         assert i["float"] == 1.25
 
+    def test_share_values(self):
+        # built at runtime, so neither the values nor keys are shared
+        items = [AudioFile({"".join(["art", "ist"]): "".join(["a", "b"]),
+                            "~#rating": 0.5, "~#length": 1})
+                 for i in range(2)]
+        items.append(AudioFile({"~#length": 1.0}))
+        assert list(items[0].keys())[0] is not list(items[1].keys())[0]
+        a, b, c = load_audio_files(dump_audio_files(items))
+        assert a["artist"] is b["artist"]
+        assert a["~#rating"] is b["~#rating"]
+        key_a = [k for k in a.keys() if k == "artist"][0]
+        key_b = [k for k in b.keys() if k == "artist"][0]
+        assert key_a is key_b
+        assert isinstance(a["~#length"], int)
+        assert isinstance(c["~#length"], float)
+
+        a, b, c = load_audio_files(dump_audio_files(items), share=False)
+        assert a["artist"] is not b["artist"]
+
     def test_dump_audio_files(self):
         data = dump_audio_files(self.instances, process=False)
         items = load_audio_files(data, process=False)
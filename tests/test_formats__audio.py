@@ -8,6 +8,7 @@ from tests import TestCase, get_data_path
 import os
 import shutil
 import io
+import pickle
 from contextlib import contextmanager
 from senf import fsnative, fsn2text, bytes2fsn, mkstemp, mkdtemp
 
@@ -673,6 +674,50 @@ class TAudioFile(TestCase):
         self.failUnlessEqual(q.list("~people:roles"),
             ["C (Performance)", "B (Guitar)", "A (Arrangement, Vocals)"])
 
+    def test_synthetic_cached(self):
+        q = AudioFile([("artist", "A"), ("performer:vocals", "B"),
+                       ("date", "2004-10-31"), ("title", "T")])
+        self.assertEqual(q("~people"), "A\nB")
+        self.assertEqual(q("~#year"), 2004)
+        self.assertEqual(q("~~people~title"), "A, B - T")
+        self.assertEqual(q("~~people~title", connector="/"), "A, B/T")
+        self.assertEqual(q("~#disc"), "")
+        self.assertEqual(q("~#disc", 0), 0)
+        self.assertEqual(q("~#disc", []), [])
+
+        q["artist"] = "C"
+        self.assertEqual(q("~people"), "C\nB")
+        self.assertEqual(q("~~people~title"), "C, B - T")
+        del q["performer:vocals"]
+        self.assertEqual(q("~people"), "C")
+        q["date"] = "1999"
+        self.assertEqual(q("~#year"), 1999)
+        q["discnumber"] = "2"
+        self.assertEqual(q("~#disc", 0), 2)
+        q.update({"discnumber": "3"})
+        self.assertEqual(q("~#disc", 0), 3)
+        q.pop("discnumber")
+        self.assertEqual(q("~#disc", 0), 0)
+        q.setdefault("discnumber", "4")
+        self.assertEqual(q("~#disc", 0), 4)
+        q.clear()
+        self.assertEqual(q("~#disc", 0), 0)
+
+    def test_synthetic_not_cached(self):
+        q = AudioFile([("~#rating", 0.2), ("title", "T")])
+        self.assertEqual(q("~~rating~title"), q("~~rating~title"))
+        self.assertFalse(q.__dict__.get("_synthetic"))
+        q("~people")
+        self.assertTrue(q.__dict__.get("_synthetic"))
+
+    def test_synthetic_cached_pickle(self):
+        q = AudioFile([("artist", "A"), ("~filename", fsnative(u"/a/b"))])
+        q("~people")
+        q("~basename")
+        data = pickle.dumps(q)
+        self.assertFalse(pickle.loads(data).__dict__)
+        self.assertNotIn(b"_synthetic", data)
+
     def test_people_mix(self):
         q = AudioFile([
             ("performer:arrangement", "A"),
@@ -962,6 +1007,15 @@ class TAudioFile(TestCase):
         audio.reload()
         self.assertNotEqual(audio.get("title"), u"foo")
 
+    def test_reload_cached(self):
+        audio = MusicFile(get_data_path('silence-44-s.mp3'))
+        artist = audio("~people")
+        dict.__setitem__(audio, "artist", u"foo")
+        self.assertEqual(audio("~people"), artist)
+        audio.reload()
+        self.assertFalse(audio.__dict__.get("_synthetic"))
+        self.assertEqual(audio("~people"), artist)
+
     def test_reload_fail(self):
         audio = MusicFile(get_data_path('silence-44-s.mp3'))
         audio["title"] = u"foo"
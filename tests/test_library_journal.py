@@ -0,0 +1,69 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import os
+import shutil
+
+from senf import fsnative
+
+from tests import TestCase, mkdtemp
+
+from quodlibet.formats import AudioFile
+from quodlibet.library.journal import LibraryJournal
+
+
+def _song(name, **kwargs):
+    song = AudioFile({"~filename": fsnative(name)})
+    song.update(kwargs)
+    return song
+
+
+class TLibraryJournal(TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.journal = LibraryJournal(os.path.join(self.dir, "songs"))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_no_journal(self):
+        items = [_song("a")]
+        self.assertEqual(self.journal.replay(items), items)
+        self.assertEqual(self.journal.size, 0)
+        self.journal.clear()
+
+    def test_replay(self):
+        a, b = _song("a", title="A"), _song("b")
+        self.journal.append([], [_song("a", title="New"), _song("c")])
+        self.journal.append(["b"], [])
+        self.assertTrue(self.journal.size)
+
+        items = self.journal.replay([a, b])
+        self.assertEqual(sorted(i.key for i in items), ["a", "c"])
+        self.assertEqual(
+            [i["title"] for i in items if i.key == "a"], ["New"])
+
+    def test_remove_then_add(self):
+        self.journal.append(["a"], [_song("a", title="Again")])
+        items = self.journal.replay([_song("a")])
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0]["title"], "Again")
+
+    def test_truncated(self):
+        self.journal.append([], [_song("a", title="First")])
+        size = self.journal.size
+        self.journal.append([], [_song("a", title="Second")])
+        with open(self.journal.filename, "rb+") as h:
+            h.truncate(self.journal.size - 3)
+
+        items = self.journal.replay([])
+        self.assertEqual(items[0]["title"], "First")
+        self.assertEqual(self.journal.size, size)
+
+    def test_clear(self):
+        self.journal.append(["a"], [])
+        self.journal.clear()
+        self.assertFalse(os.path.exists(self.journal.filename))
@@ -11,14 +11,16 @@ from senf import fsnative
 
 from quodlibet.formats import AudioFileError
 from quodlibet import config
-from quodlibet.util import connect_obj, is_windows
+from quodlibet.util import connect_obj, is_windows, copool
 from quodlibet.formats import AudioFile
 
 from tests import TestCase, get_data_path, mkstemp, mkdtemp, skipIf
 from .helper import capture_output, get_temp_copy
 
 from quodlibet.library.libraries import Library, PicklingMixin, SongLibrary, \
-    FileLibrary, AlbumLibrary, SongFileLibrary, iter_paths
+    FileLibrary, AlbumLibrary, SongFileLibrary, iter_paths, TagIndex, \
+    SearchTextIndex, NumericColumns
+from quodlibet.library import libraries
 
 
 class Fake(int):
@@ -307,6 +309,127 @@ class TPicklingMixin(TestCase):
             os.unlink(filename)
 
 
+class RenamableAudioFile(FakeAudioFile):
+
+    def rename(self, newname):
+        self["~filename"] = newname
+
+
+class TPicklingMixinJournal(TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.filename = os.path.join(self.dir, "songs")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _load(self):
+        library = SongLibrary()
+        library.load(self.filename)
+        return library
+
+    def test_journal_save_load(self):
+        library = self._load()
+        library.add(list(map(RenamableAudioFile, range(10))))
+        library.save(compact=False)
+        self.assertFalse(library.dirty)
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertTrue(os.path.exists(library._storage.journal.filename))
+
+        library.remove([library[fsnative("3")]])
+        song = library[fsnative("4")]
+        song["title"] = "foo"
+        library.changed([song])
+        library.save(compact=False)
+
+        loaded = self._load()
+        self.assertEqual(len(loaded), 9)
+        self.assertFalse(fsnative("3") in loaded)
+        self.assertEqual(loaded[fsnative("4")]["title"], "foo")
+        loaded.destroy()
+
+        library.save()
+        self.assertTrue(os.path.exists(self.filename))
+        self.assertFalse(os.path.exists(library._storage.journal.filename))
+
+        loaded = self._load()
+        self.assertEqual(len(loaded), 9)
+        self.assertEqual(loaded[fsnative("4")]["title"], "foo")
+        loaded.destroy()
+        library.destroy()
+
+    def test_journal_rename(self):
+        library = self._load()
+        library.add([RenamableAudioFile(1)])
+        library.save()
+
+        library.rename(library[fsnative("1")], fsnative("2"))
+        library.save(compact=False)
+
+        loaded = self._load()
+        self.assertEqual(list(loaded.keys()), [fsnative("2")])
+        loaded.destroy()
+        library.destroy()
+
+    def test_compaction(self):
+        library = self._load()
+        library._storage.journal_min_size = 0
+        library._storage.journal_max_ratio = 0
+        library.add([RenamableAudioFile(1)])
+        library.save()
+
+        library.add([RenamableAudioFile(2)])
+        library.save(compact=False)
+        self.assertTrue(os.path.exists(library._storage.journal.filename))
+
+        library.add([RenamableAudioFile(3)])
+        library.save(compact=False)
+        self.assertFalse(os.path.exists(library._storage.journal.filename))
+
+        loaded = self._load()
+        self.assertEqual(len(loaded), 3)
+        loaded.destroy()
+        library.destroy()
+
+
+class TPicklingMixinSQLite(TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.filename = os.path.join(self.dir, "songs.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _load(self):
+        library = SongLibrary()
+        library.load(self.filename)
+        return library
+
+    def test_save_load(self):
+        library = self._load()
+        library.add(list(map(RenamableAudioFile, range(10))))
+        library.save(compact=False)
+        self.assertFalse(library.dirty)
+
+        library.remove([library[fsnative("3")]])
+        library.rename(library[fsnative("5")], fsnative("new"))
+        song = library[fsnative("4")]
+        song["title"] = "foo"
+        library.changed([song])
+        library.save()
+
+        loaded = self._load()
+        self.assertEqual(len(loaded), 9)
+        self.assertFalse(fsnative("3") in loaded)
+        self.assertTrue(fsnative("new") in loaded)
+        self.assertEqual(loaded[fsnative("4")]["title"], "foo")
+        self.assertTrue(isinstance(loaded[fsnative("4")], RenamableAudioFile))
+        loaded.destroy()
+        library.destroy()
+
+
 class TSongLibrary(TLibrary):
     Fake = FakeSong
     Frange = staticmethod(FSrange)
@@ -416,6 +539,22 @@ class TFileLibrary(TLibrary):
         self.assertTrue(new in changed)
         self.assertFalse(removed)
 
+    def test_rebuild(self):
+        valid, invalid = self.Fake(1), self.Fake(2)
+        invalid._valid = False
+        self.library.add([valid, invalid])
+        for i in self.library.rebuild([]):
+            pass
+        self.assertEqual(self.changed, [invalid])
+        self.assertTrue(invalid._valid)
+
+    def test_rebuild_force(self):
+        items = FSFrange(3)
+        self.library.add(items)
+        for i in self.library.rebuild([], force=True):
+            pass
+        self.assertEqual(sorted(self.changed), items)
+
 
 class TSongFileLibrary(TSongLibrary):
     Fake = FakeSongFile
@@ -519,6 +658,181 @@ class TSongFileLibrary(TSongLibrary):
         finally:
             os.unlink(filename)
 
+    def test_rebuild(self):
+        config.init()
+        try:
+            filename = self.__get_file()
+            song = self.library.add_filename(filename)
+            other = self.library.add_filename(self.__get_file())
+            for i in self.library.rebuild([]):
+                pass
+            self.assertFalse(self.changed)
+
+            os.utime(filename, (1, 1))
+            os.unlink(other("~filename"))
+            for i in self.library.rebuild([]):
+                pass
+            self.assertEqual(self.changed, [song])
+            self.assertEqual(song("~#mtime"), 1)
+            self.assertEqual(self.removed, [other])
+            os.unlink(filename)
+        finally:
+            config.quit()
+
+    def test_scan(self):
+        config.init()
+        dir_ = mkdtemp()
+        try:
+            for name in ["empty.flac", "empty.ogg", "silence-44-s.mp3"]:
+                shutil.copy(get_data_path(name), dir_)
+            with open(os.path.join(dir_, "broken.flac"), "wb"):
+                pass
+            config.set("library", "scan_workers", 2)
+
+            with capture_output():
+                for i in self.library.scan([dir_]):
+                    pass
+            self.assertEqual(len(self.library), 3)
+            self.assertEqual(len(self.added), 3)
+        finally:
+            shutil.rmtree(dir_)
+            config.quit()
+
+    def test_scan_index(self):
+        config.init()
+        dir_ = mkdtemp()
+        try:
+            shutil.copy(get_data_path("empty.flac"), dir_)
+            # just changed directories aren't remembered
+            for i in self.library.scan([dir_]):
+                pass
+            self.assertFalse(self.library._dir_states)
+            os.utime(dir_, (1, 1))
+            for i in self.library.scan([dir_]):
+                pass
+            self.assertEqual(len(self.library), 1)
+
+            # a new file, but the directory looks unchanged
+            stat = os.stat(dir_)
+            shutil.copy(get_data_path("empty.ogg"), dir_)
+            os.utime(dir_, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            for i in self.library.scan([dir_]):
+                pass
+            self.assertEqual(len(self.library), 1)
+
+            for i in self.library.scan([dir_], force=True):
+                pass
+            self.assertEqual(len(self.library), 2)
+
+            # removed songs get added again
+            self.library.remove(list(self.library.values()))
+            for i in self.library.scan([dir_]):
+                pass
+            self.assertEqual(len(self.library), 2)
+        finally:
+            shutil.rmtree(dir_)
+            config.quit()
+
+    def test_scan_index_retry(self):
+        config.init()
+        dir_ = mkdtemp()
+        try:
+            shutil.copy(get_data_path("empty.flac"), dir_)
+            excluded = os.path.join(dir_, "excluded.ogg")
+            shutil.copy(get_data_path("empty.ogg"), excluded)
+            broken = os.path.join(dir_, "broken.mp3")
+            with open(broken, "wb") as h:
+                h.write(b"not yet")
+            os.utime(dir_, (1, 1))
+            for i in self.library.scan([dir_], exclude=[excluded]):
+                pass
+            self.assertEqual(len(self.library), 1)
+
+            # files which failed to load or were excluded get looked at
+            # again, even if the directory didn't change
+            stat = os.stat(dir_)
+            shutil.copy(get_data_path("silence-44-s.mp3"), broken)
+            os.utime(dir_, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            for i in self.library.scan([dir_]):
+                pass
+            self.assertEqual(len(self.library), 3)
+        finally:
+            shutil.rmtree(dir_)
+            config.quit()
+
+    def test_forget_dirs_saved(self):
+        config.init()
+        dir_ = mkdtemp()
+        try:
+            self.library.filename = os.path.join(dir_, "library")
+            music = os.path.join(dir_, "music")
+            os.mkdir(music)
+            shutil.copy(get_data_path("empty.flac"), music)
+            os.utime(music, (1, 1))
+            for i in self.library.scan([music]):
+                pass
+            self.assertEqual(len(self.library), 1)
+            self.library.save()
+
+            # not loaded yet, like after a restart
+            self.library._dir_index = None
+            self.library.remove(list(self.library.values()))
+            self.library._dir_index = None
+            self.assertEqual(self.library._get_dir_index(), {})
+            for i in self.library.scan([music]):
+                pass
+            self.assertEqual(len(self.library), 1)
+        finally:
+            self.library.filename = None
+            shutil.rmtree(dir_)
+            config.quit()
+
+    def test_dir_index_saved_with_songs(self):
+        config.init()
+        dir_ = mkdtemp()
+        try:
+            filename = os.path.join(dir_, "library")
+            self.library.filename = filename
+            music = os.path.join(dir_, "music")
+            os.mkdir(music)
+            shutil.copy(get_data_path("empty.flac"), music)
+            os.utime(music, (1, 1))
+            for i in self.library.scan([music]):
+                pass
+            self.library._dir_index = None
+            self.assertEqual(self.library._get_dir_index(), {})
+            self.library.save()
+            self.library._dir_index = None
+            self.assertEqual(
+                list(self.library._get_dir_index()), [os.path.realpath(music)])
+
+            # the songs file is gone, so all directories get scanned again
+            os.unlink(filename)
+            library = SongFileLibrary()
+            library.load(filename)
+            self.assertEqual(library._get_dir_index(), {})
+            for i in library.scan([music]):
+                pass
+            self.assertEqual(len(library), 1)
+            library.destroy()
+        finally:
+            self.library.filename = None
+            shutil.rmtree(dir_)
+            config.quit()
+
+    def test_scan_stop(self):
+        config.init()
+        dir_ = mkdtemp()
+        try:
+            shutil.copy(get_data_path("empty.flac"), dir_)
+            scan = self.library.scan([dir_])
+            next(scan)
+            scan.close()
+            self.assertEqual(len(self.library), 0)
+        finally:
+            shutil.rmtree(dir_)
+            config.quit()
+
     def test_add_filename_normalize_path(self):
         if not os.name == "nt":
             return
@@ -539,6 +853,234 @@ class TSongFileLibrary(TSongLibrary):
         config.quit()
 
 
+class TTagIndex(TestCase):
+
+    def setUp(self):
+        config.init()
+        self.library = SongLibrary()
+        self.songs = ASrange(6)
+        self.library.add(self.songs[:3])
+
+    def tearDown(self):
+        self.library.destroy()
+        config.quit()
+
+    def test_get_index(self):
+        index = self.library.get_index("album")
+        self.assertTrue(isinstance(index, TagIndex))
+        self.assertIs(self.library.get_index("album"), index)
+        self.assertIs(self.library.get_index("title"), None)
+
+    def test_tag_values(self):
+        self.assertEqual(self.library.tag_values("album"),
+                         {"Album 1", "Album 2", "Album 3"})
+        self.assertEqual(self.library.tag_values("title"),
+                         {"Song 1", "Song 2", "Song 3"})
+
+    def test_added_removed(self):
+        index = self.library.get_index("album")
+        self.assertEqual(index.songs("Album 1"), {self.songs[0]})
+        self.library.add(self.songs[3:])
+        self.assertEqual(index.songs("Album 1"),
+                         {self.songs[0], self.songs[3]})
+        self.library.remove(self.songs[:3])
+        self.assertEqual(index.songs("Album 1"), {self.songs[3]})
+        self.library.remove(self.songs[3:])
+        self.assertFalse(index.values())
+        self.assertEqual(index.songs("Album 1"), set())
+
+    def test_changed(self):
+        index = self.library.get_index("album")
+        song = self.songs[0]
+        song["album"] = "New\nAlbum 2"
+        self.library.changed([song])
+        self.assertFalse("Album 1" in index)
+        self.assertEqual(index.values(), {"Album 2", "Album 3", "New"})
+        self.assertEqual(index.songs("Album 2"), {song, self.songs[1]})
+
+        del song["album"]
+        self.library.changed([song])
+        self.assertEqual(index.songs("Album 2"), {self.songs[1]})
+        self.assertFalse("New" in index)
+
+    def test_destroy(self):
+        index = self.library.get_index("album")
+        self.library.destroy()
+        self.library.add(self.songs[3:])
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.songs("Album 1"), {self.songs[0]})
+
+
+class TSearchTextIndex(TestCase):
+
+    def setUp(self):
+        config.init()
+        config.set("library", "search_text_index", "true")
+        self.library = SongLibrary()
+        self.songs = ASrange(6)
+        self.library.add(self.songs[:3])
+
+    def tearDown(self):
+        self.library.destroy()
+        config.quit()
+
+    def test_get_text_index(self):
+        index = self.library.get_text_index()
+        self.assertTrue(isinstance(index, SearchTextIndex))
+        self.assertIs(self.library.get_text_index(), index)
+        self.assertEqual(len(index), 3)
+
+    def test_disabled(self):
+        config.set("library", "search_text_index", "false")
+        self.assertIs(self.library.get_text_index(), None)
+        self.library.build_text_index()
+        self.assertIs(self.library.get_text_index(), None)
+
+    def test_build_text_index(self):
+        self.library.build_text_index()
+        self.assertIs(self.library.get_text_index(), None)
+        self.library.add(self.songs[3:4])
+        self.library.remove(self.songs[:1])
+        song = self.songs[1]
+        song["title"] = "New"
+        self.library.changed([song])
+
+        funcid = self.library._SongLibrary__build_text_index
+        while copool.step(funcid):
+            pass
+        index = self.library.get_text_index()
+        self.assertTrue(isinstance(index, SearchTextIndex))
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.search(["new"]), {song})
+        self.assertEqual(index.search(["song 1"]), set())
+
+    def test_destroy_building(self):
+        self.library.build_text_index()
+        funcid = self.library._SongLibrary__build_text_index
+        self.library.destroy()
+        self.assertRaises(ValueError, copool.step, funcid)
+
+    def test_get_text(self):
+        song = AudioFile({
+            "~filename": fsnative(u"/dir/F\xfc.ogg"),
+            "title": u"\xc4rger\nSTRASSE",
+            "musicbrainz_trackid": "id",
+            "~#playcount": 3,
+        })
+        text = SearchTextIndex.get_text(song)
+        self.assertEqual(sorted(text.split("\n")),
+                         ["/dir/fu.ogg", "arger", "strasse"])
+
+    def test_search(self):
+        index = self.library.get_text_index()
+        self.assertEqual(index.search(["song 1"]), {self.songs[0]})
+        self.assertEqual(index.search(["file_2"]), {self.songs[1]})
+        self.assertEqual(index.search(["fakeman"]), set(self.songs[:3]))
+        self.assertEqual(index.search(["Fakeman"]), set())
+        self.assertEqual(index.search(["song", "2"]), {self.songs[1]})
+
+    def test_added_changed_removed(self):
+        index = self.library.get_text_index()
+        self.library.add(self.songs[3:])
+        self.assertEqual(index.search(["song 4"]), {self.songs[3]})
+        song = self.songs[0]
+        song["title"] = "New"
+        self.library.changed([song])
+        self.assertEqual(index.search(["new"]), {song})
+        self.assertEqual(index.search(["song 1"]), set())
+        self.library.remove([song])
+        self.assertEqual(index.search(["new"]), set())
+        self.assertEqual(len(index), 5)
+
+    def test_destroy(self):
+        index = self.library.get_text_index()
+        self.library.destroy()
+        self.library.add(self.songs[3:])
+        self.assertEqual(len(index), 3)
+
+
+@skipIf(libraries.numpy is None, "NumPy missing")
+class TNumericColumns(TestCase):
+
+    def setUp(self):
+        config.init()
+        self.library = SongLibrary()
+        self.songs = [AudioFile({
+            "~filename": fsnative(u"/dir/%d.ogg" % i),
+            "~#playcount": i,
+        }) for i in range(6)]
+        self.songs[0]["~#rating"] = 1.0
+        self.library.add(self.songs[:3])
+
+    def tearDown(self):
+        self.library.destroy()
+        config.quit()
+
+    def _values(self, columns, tag):
+        values = columns.get(tag)
+        return {song: values[i] for i, song in enumerate(
+            columns.songs(columns.valid.nonzero()[0]))}
+
+    def test_get_columns(self):
+        columns = self.library.get_columns()
+        self.assertTrue(isinstance(columns, NumericColumns))
+        self.assertIs(self.library.get_columns(), columns)
+        self.assertEqual(len(columns), 3)
+
+    def test_disabled(self):
+        config.set("library", "numeric_columns", "false")
+        self.assertIs(self.library.get_columns(), None)
+
+    def test_get(self):
+        columns = self.library.get_columns()
+        self.assertEqual(self._values(columns, "~#playcount"),
+                         {song: i for i, song in enumerate(self.songs[:3])})
+        self.assertTrue(all(libraries.numpy.isnan(columns.get("~#foo"))))
+
+    def test_computed(self):
+        self.addCleanup(
+            setattr, config.RATINGS, "default", config.RATINGS.default)
+        columns = self.library.get_columns()
+        config.RATINGS.default = 0.25
+        self.assertEqual(sorted(columns.get("~#rating")), [0.25, 0.25, 1.0])
+        config.RATINGS.default = 0.75
+        self.assertEqual(sorted(columns.get("~#rating")), [0.75, 0.75, 1.0])
+
+    def test_added_changed_removed(self):
+        columns = self.library.get_columns()
+        columns.get("~#playcount")
+        self.library.add(self.songs[3:])
+        self.assertEqual(self._values(columns, "~#playcount"),
+                         {song: i for i, song in enumerate(self.songs)})
+        song = self.songs[1]
+        song["~#playcount"] = 10
+        self.library.changed([song])
+        self.assertEqual(self._values(columns, "~#playcount")[song], 10)
+        self.library.remove([song])
+        self.assertFalse(song in self._values(columns, "~#playcount"))
+        self.assertEqual(len(columns), 5)
+        self.assertEqual(columns.valid.sum(), 5)
+
+    def test_compact(self):
+        songs = [AudioFile({"~filename": fsnative(u"/more/%d.ogg" % i),
+                            "~#playcount": i}) for i in range(3000)]
+        self.library.add(songs)
+        columns = self.library.get_columns()
+        columns.get("~#playcount")
+        self.library.remove(songs[:2500])
+        self.assertEqual(len(columns.valid), 503)
+        values = self._values(columns, "~#playcount")
+        self.assertEqual(len(values), 503)
+        self.assertEqual(values[songs[2999]], 2999)
+        self.assertEqual(values[self.songs[2]], 2)
+
+    def test_destroy(self):
+        columns = self.library.get_columns()
+        self.library.destroy()
+        self.library.add(self.songs[3:])
+        self.assertEqual(len(columns), 3)
+
+
 class TAlbumLibrary(TestCase):
     Fake = FakeSong
     Frange = staticmethod(ASrange)
@@ -622,6 +1164,38 @@ class TAlbumLibrary(TestCase):
         self.failUnlessEqual(album2.key, key)
         self.failUnlessEqual(len(album2.songs), 4)
 
+    def test_change_key(self):
+        song = self.underlying.get("file_1.mp3")
+        old_key = song.album_key
+        song["album"] = song["labelid"] = "Album 2"
+        self.underlying.changed([song])
+
+        self.failUnlessEqual(len(self.library[old_key].songs), 3)
+        album = self.library[song.album_key]
+        self.failUnless(song in album.songs)
+        self.failUnlessEqual(len(album.songs), 5)
+
+        # and once more, now that it's in another album
+        song["album"] = song["labelid"] = "Album 4"
+        self.underlying.changed([song])
+        self.failUnlessEqual(len(album.songs), 4)
+        self.failUnlessEqual(self.library[song.album_key].songs, {song})
+
+        self.underlying.remove([song])
+        self.failIf(self.library.get(song.album_key))
+        self.failUnlessEqual(len(self.library), 3)
+
+    def test_change_key_empties_album(self):
+        songs = [s for s in self.underlying.values()
+                 if s("album") == "Album 1"]
+        old_key = songs[0].album_key
+        for song in songs:
+            song["album"] = song["labelid"] = "Album 2"
+        self.underlying.changed(songs)
+
+        self.failIf(self.library.get(old_key))
+        self.failUnlessEqual(len(self.library[songs[0].album_key].songs), 8)
+
     def test_misc(self):
         # It shouldn't implement FileLibrary etc
         self.failIf(getattr(self.library, "filename", None))
@@ -710,6 +1284,27 @@ class Titer_paths(TestCase):
         assert list(iter_paths(self.root, exclude=[name])) == []
         assert list(iter_paths(self.root, exclude=[name + "a"])) == [name]
 
+    def test_index(self):
+        child = mkdtemp(dir=self.root)
+        fd, name = mkstemp(dir=child)
+        os.close(fd)
+        index = {}
+        assert list(iter_paths(self.root, index=index)) == [name]
+        # changed too recently to be sure
+        assert index == {}
+        os.utime(child, (2, 2))
+        os.utime(self.root, (2, 2))
+        assert list(iter_paths(self.root, index=index)) == [name]
+        assert sorted(index) == sorted([self.root, child])
+        assert list(iter_paths(self.root, index=index)) == []
+
+        fd, other = mkstemp(dir=child)
+        os.close(fd)
+        # in case the clock is too coarse to notice the change
+        os.utime(child, (1, 1))
+        assert sorted(iter_paths(self.root, index=index)) == \
+            sorted([name, other])
+
     @skipIf(is_windows(), "no symlink")
     def test_with_dir_symlink(self):
         child = mkdtemp(dir=self.root)
@@ -0,0 +1,246 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import os
+import shutil
+import sqlite3
+
+from senf import fsnative
+
+from tests import TestCase, mkdtemp
+
+from quodlibet.formats import AudioFile, SerializationError
+from quodlibet.library.storage import PickleStorage, SQLiteStorage, \
+    get_storage, migrate_storage
+
+
+def _song(name, **kwargs):
+    song = AudioFile({"~filename": fsnative(name)})
+    song.update(kwargs)
+    return song
+
+
+class _TStorageMixin:
+
+    Storage = None
+    NAME = None
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.storage = self.Storage(os.path.join(self.dir, self.NAME))
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.dir)
+
+    def test_empty(self):
+        self.assertEqual(self.storage.mtime, 0)
+        self.assertEqual(self.storage.load(), [])
+
+    def test_write_load(self):
+        self.storage.write([_song("a", title="A"), _song("b")])
+        items = sorted(self.storage.load(), key=lambda i: i.key)
+        self.assertEqual([i.key for i in items], ["a", "b"])
+        self.assertEqual(items[0]["title"], "A")
+        self.assertTrue(isinstance(items[0], AudioFile))
+        self.assertTrue(self.storage.mtime)
+
+    def test_update(self):
+        self.storage.write([_song("a"), _song("b")])
+        self.storage.update(["b"], [_song("a", title="New"), _song("c")])
+        items = sorted(self.storage.load(), key=lambda i: i.key)
+        self.assertEqual([i.key for i in items], ["a", "c"])
+        self.assertEqual(items[0]["title"], "New")
+
+    def test_write_replaces(self):
+        self.storage.write([_song("a"), _song("b")])
+        self.storage.write([_song("c")])
+        self.assertEqual([i.key for i in self.storage.load()], ["c"])
+
+    def test_load_invalid(self):
+        with open(self.storage.filename, "wb") as h:
+            h.write(b"nope" * 1000)
+        self.assertEqual(self.storage.load(), [])
+        self.assertTrue(
+            os.path.exists(self.storage.filename + ".not-valid"))
+
+
+class TPickleStorage(_TStorageMixin, TestCase):
+    Storage = PickleStorage
+    NAME = "songs"
+
+    def test_crash_before_journal_cleared(self):
+        self.storage.write([_song("a")])
+        self.storage.update(["a"], [_song("b", title="Old")])
+        journal = self.storage.journal
+        journal.clear = lambda: None
+        self.storage.write([_song("a"), _song("b", title="New")])
+        self.assertTrue(journal.size)
+        self.storage.update([], [_song("c")])
+
+        items = sorted(self.storage.load(), key=lambda i: i.key)
+        self.assertEqual([i.key for i in items], ["a", "b", "c"])
+        self.assertEqual(items[1]["title"], "New")
+
+    def test_crash_before_rename(self):
+        self.storage.write([_song("a")])
+        self.storage.update([], [_song("b")])
+        # the marker gets written, but the library file doesn't change
+        self.storage.journal.mark_base(os.stat(self.dir))
+        items = sorted(self.storage.load(), key=lambda i: i.key)
+        self.assertEqual([i.key for i in items], ["a", "b"])
+
+    def test_needs_write(self):
+        self.assertTrue(self.storage.needs_write(True))
+        self.assertFalse(self.storage.needs_write(False))
+
+
+class TSQLiteStorage(_TStorageMixin, TestCase):
+    Storage = SQLiteStorage
+    NAME = "songs.sqlite"
+
+    def test_needs_write(self):
+        self.assertFalse(self.storage.needs_write(True))
+
+    def test_load_invalid_wal(self):
+        for suffix in ["", "-wal"]:
+            with open(self.storage.filename + suffix, "wb") as h:
+                h.write(b"nope" * 1000)
+        self.assertEqual(self.storage.load(), [])
+        for suffix in ["", "-wal"]:
+            self.assertTrue(os.path.exists(
+                self.storage.filename + ".not-valid" + suffix))
+
+    def test_load_locked(self):
+        self.storage.write([_song("a")])
+        self.storage.close()
+
+        def connect():
+            raise sqlite3.OperationalError("database is locked")
+
+        self.storage._connect = connect
+        self.assertEqual(self.storage.load(), [])
+        del self.storage._connect
+        self.assertFalse(
+            os.path.exists(self.storage.filename + ".not-valid"))
+        # not saving over what couldn't be loaded
+        self.assertRaises(EnvironmentError, self.storage.update, [], [])
+        self.assertEqual(
+            [i.key for i in SQLiteStorage(self.storage.filename).load()],
+            ["a"])
+
+    def test_keys(self):
+        key = fsnative(u"\xf6")
+        self.storage.write([_song(key)])
+        self.storage.update([key], [])
+        self.assertEqual(self.storage.load(), [])
+
+
+class TSQLiteStorageLazy(TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        filename = os.path.join(self.dir, "songs.sqlite")
+        SQLiteStorage(filename).write(
+            [_song("a", title="A", comment="C", lyrics="L"), _song("b")])
+        self.storage = SQLiteStorage(filename, lazy=True)
+        items = sorted(self.storage.load(), key=lambda i: i.key)
+        self.lazy, self.song = items
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.dir)
+
+    def test_hot(self):
+        self.assertTrue(isinstance(self.lazy, AudioFile))
+        self.assertEqual(self.lazy("title"), "A")
+        self.assertEqual(self.lazy["~filename"], "a")
+        self.assertTrue("comment" in self.lazy)
+        self.assertEqual(len(self.lazy), 4)
+        self.assertEqual(
+            sorted(self.lazy), ["comment", "lyrics", "title", "~filename"])
+        self.assertFalse(dict.__contains__(self.lazy, "comment"))
+        self.assertIs(type(self.song), AudioFile)
+
+    def test_cold(self):
+        self.assertEqual(self.lazy("comment"), "C")
+        self.assertIs(type(self.lazy), AudioFile)
+        self.assertEqual(self.lazy["lyrics"], "L")
+
+    def test_cold_forgets_cached(self):
+        self.lazy.sort_key
+        self.lazy.__dict__["_synthetic"] = {}
+        self.assertEqual(self.lazy("comment"), "C")
+        self.assertFalse("_synthetic" in self.lazy.__dict__)
+        self.assertFalse("sort_key" in self.lazy.__dict__)
+        self.assertFalse("_lazy_keys" in self.lazy.__dict__)
+
+    def test_whole(self):
+        self.assertEqual(dict(self.lazy), {
+            "~filename": "a", "title": "A", "comment": "C", "lyrics": "L"})
+        self.assertIs(type(self.lazy), AudioFile)
+
+    def test_change(self):
+        self.lazy["comment"] = "New"
+        self.assertEqual(self.lazy["lyrics"], "L")
+        self.assertEqual(self.lazy["comment"], "New")
+
+        self.lazy.clear()
+        self.assertEqual(len(self.lazy), 0)
+
+    def test_save(self):
+        self.lazy["title"] = "B"
+        self.storage.update([], [self.lazy])
+        items = sorted(
+            SQLiteStorage(self.storage.filename).load(), key=lambda i: i.key)
+        self.assertEqual(items[0]("comment"), "C")
+        self.assertEqual(items[0]("title"), "B")
+
+
+class Tget_storage(TestCase):
+
+    def test_main(self):
+        self.assertTrue(
+            isinstance(get_storage(fsnative(u"songs")), PickleStorage))
+        self.assertTrue(
+            isinstance(get_storage(fsnative(u"songs.sqlite")), SQLiteStorage))
+
+
+class Tmigrate_storage(TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_pickle_to_sqlite(self):
+        source = os.path.join(self.dir, "songs")
+        target = os.path.join(self.dir, "songs.sqlite")
+        storage = PickleStorage(source)
+        storage.write([_song("a")])
+        storage.update([], [_song("b", title="B")])
+
+        migrate_storage(source, target)
+        items = sorted(SQLiteStorage(target).load(), key=lambda i: i.key)
+        self.assertEqual([i.key for i in items], ["a", "b"])
+        self.assertEqual(items[1]["title"], "B")
+
+    def test_failed(self):
+        source = os.path.join(self.dir, "songs")
+        target = os.path.join(self.dir, "songs.sqlite")
+        PickleStorage(source).write([_song("a")])
+
+        def write(self, items):
+            raise SerializationError("nope")
+
+        old_write = SQLiteStorage.write
+        SQLiteStorage.write = write
+        try:
+            self.assertRaises(
+                SerializationError, migrate_storage, source, target)
+        finally:
+            SQLiteStorage.write = old_write
+        self.assertEqual(os.listdir(self.dir), ["songs"])
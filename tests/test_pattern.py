@@ -9,9 +9,12 @@ from senf import fsnative
 
 from tests import TestCase
 
+from quodlibet import config
 from quodlibet.formats import AudioFile
 from quodlibet.pattern import (FileFromPattern, XMLFromPattern, Pattern,
-    XMLFromMarkupPattern, ArbitraryExtensionFileFromPattern)
+    XMLFromMarkupPattern, ArbitraryExtensionFileFromPattern, forget_formatted)
+from quodlibet.pattern._pattern import _render_cache
+from quodlibet.util.collection import Album, Collection
 
 
 class _TPattern(TestCase):
@@ -580,3 +583,103 @@ class TPatternFormatList(_TPattern):
     def test_string(s):
         pat = Pattern('display')
         s.assertEqual(pat.format_list(s.a), {("display", "display")})
+
+
+class TPatternRenderCache(_TPattern):
+
+    def setUp(self):
+        super().setUp()
+        config.init()
+        forget_formatted()
+
+    def tearDown(self):
+        forget_formatted()
+        config.quit()
+
+    def test_cached(s):
+        pat = Pattern('<artist> - <title>')
+        s.assertEqual(pat.format(s.a), "Artist - Title5")
+        s.assertEqual(len(_render_cache), 1)
+        s.assertEqual(pat.format(s.a), "Artist - Title5")
+        s.assertEqual(pat.format_list(s.a),
+                      {("Artist - Title5", "Artist - Title5")})
+        s.assertEqual(len(_render_cache), 1)
+
+    def test_changed(s):
+        pat = Pattern('<artist> - <~basename>')
+        s.assertEqual(pat.format(s.a), "Artist - a.mp3")
+        s.a["artist"] = "Other"
+        s.assertEqual(pat.format(s.a), "Other - a.mp3")
+        s.a.update({"artist": "Third"})
+        s.assertEqual(pat.format(s.a), "Third - a.mp3")
+        del s.a["artist"]
+        s.assertEqual(pat.format(s.a), " - a.mp3")
+
+    def test_volatile(s):
+        for text in ['<~#rating>', '<~rating>', '<~title~~rating>',
+                     '<~#rating|rated>', r'<#(added \< 1 day)|new>']:
+            Pattern(text).format(s.a)
+        s.assertEqual(len(_render_cache), 0)
+
+        s.addCleanup(
+            setattr, config.RATINGS, "default", config.RATINGS.default)
+        pat = Pattern('<~#rating>')
+        config.RATINGS.default = 0.25
+        s.assertEqual(pat.format(s.a), "0.25")
+        config.RATINGS.default = 0.75
+        s.assertEqual(pat.format(s.a), "0.75")
+
+    def test_not_songs(s):
+        collection = Collection()
+        collection.songs = [s.a]
+        s.assertEqual(Pattern('<artist>').format(collection), "Artist")
+        s.assertEqual(len(_render_cache), 0)
+
+    def test_album(s):
+        album = Album(s.a)
+        album.songs = {s.a, s.b}
+        album.finalize()
+        pat = XMLFromMarkupPattern('[b]<~tracks>[/b]')
+        s.assertEqual(pat.format(album), "<b>2 tracks</b>")
+        album.songs.add(s.e)
+        s.assertEqual(pat.format(album), "<b>2 tracks</b>")
+        album.finalize()
+        s.assertEqual(pat.format(album), "<b>3 tracks</b>")
+
+    def test_forget(s):
+        pat = Pattern('<title>')
+        pat.format(s.a)
+        pat.format(s.b)
+        forget_formatted([s.a])
+        s.assertEqual(len(_render_cache), 1)
+        forget_formatted()
+        s.assertEqual(len(_render_cache), 0)
+
+    def test_patterns_dropped(s):
+        Pattern('<title>').format(s.a)
+        s.assertEqual(len(_render_cache), 1)
+        Pattern('<title> - <artist>', MAX_CACHE_SIZE=0)
+        s.assertEqual(len(_render_cache), 0)
+
+    def test_bounded(s):
+        pat = Pattern('<title>')
+        max_songs = _render_cache.max_songs
+        try:
+            _render_cache.max_songs = 2
+            for song in [s.a, s.b, s.c, s.a]:
+                pat.format(song)
+            s.assertEqual(len(_render_cache), 2)
+        finally:
+            _render_cache.max_songs = max_songs
+
+    def test_post(s):
+        pat = FileFromPattern('<title>')
+        s.assertEqual(pat.format(s.a), "Title5.mp3")
+        s.a["~filename"] = s.a["~filename"][:-4] + fsnative(u".ogg")
+        s.assertEqual(pat.format(s.a), "Title5.ogg")
+
+    def test_format_songs(s):
+        pat = Pattern('<title>')
+        songs = [s.a, s.b, s.a]
+        s.assertEqual(pat.format_songs(songs), ["Title5", "Title6", "Title5"])
+        s.assertEqual(pat.format_songs([]), [])
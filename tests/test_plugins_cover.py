@@ -6,6 +6,8 @@
 import io
 import os
 import shutil
+import threading
+import time
 
 from gi.repository import Gtk
 from gi.repository import GdkPixbuf
@@ -77,6 +79,20 @@ class DummyCoverSource3(ApiCoverSourcePlugin):
         return self.emit('fetch-success', DUMMY_COVER)
 
 
+class SlowCoverSource(CoverSourcePlugin):
+    running = 0
+    max_running = 0
+
+    @property
+    def cover(self):
+        cls = SlowCoverSource
+        cls.running += 1
+        cls.max_running = max(cls.max_running, cls.running)
+        time.sleep(0.01)
+        cls.running -= 1
+        return None
+
+
 dummy_sources = [Plugin(s) for s in
                  (DummyCoverSource1, DummyCoverSource2, DummyCoverSource3)]
 
@@ -117,6 +133,21 @@ class TCoverManager(TestCase):
             ps = [p.priority() for p in self.manager.sources]
             self.assertSequenceEqual(ps, sorted(ps, reverse=True))
 
+    def test_sources_one_at_a_time(self):
+        song = AudioFile({"~filename": "/dev/null"})
+        manager = CoverManager(use_built_in=False)
+        source = Plugin(SlowCoverSource)
+        manager.plugin_handler.plugin_handle(source)
+        manager.plugin_handler.plugin_enable(source)
+
+        threads = [threading.Thread(target=manager.acquire_cover_sync,
+                                    args=(song,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(SlowCoverSource.max_running, 1)
+
     def test_acquire_cover_sync(self):
         song = AudioFile({"~filename": "/dev/null"})
 
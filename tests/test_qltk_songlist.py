@@ -12,11 +12,45 @@ from tests import TestCase
 
 from quodlibet.library import SongLibrary
 from quodlibet.qltk.songlist import (SongList, set_columns, get_columns,
-                                     header_tag_split, get_sort_tag)
+                                     header_tag_split, get_sort_tag,
+                                     SortRanks)
 from quodlibet.formats import AudioFile
 from quodlibet import config
 
 
+class TSortRanks(TestCase):
+
+    def test_main(self):
+        songs = [AudioFile({"title": t}) for t in ["b", "a", "c", "a"]]
+        ranks = SortRanks(AudioFile.sort_by_func("title"))
+        self.assertEqual(ranks.get(songs), [1, 0, 2, 0])
+        self.assertEqual(ranks.count, 3)
+        self.assertEqual(ranks.get(songs[2:]), [2, 0])
+
+        new = AudioFile({"title": "aa"})
+        self.assertEqual(ranks.get([new, songs[0]]), [1, 2])
+        self.assertEqual(ranks.count, 4)
+
+        songs[0]["title"] = "d"
+        self.assertEqual(ranks.get(songs[:1]), [2])
+        ranks.forget(songs[:1])
+        self.assertEqual(ranks.get(songs), [3, 0, 2, 0])
+
+    def test_keys_func(self):
+        songs = [AudioFile({"title": t}) for t in ["b", "a", "c"]]
+        calls = []
+
+        def keys_func(songs):
+            calls.append(len(songs))
+            return [song("title") for song in songs]
+
+        ranks = SortRanks(None, keys_func)
+        self.assertEqual(ranks.get(songs), [1, 0, 2])
+        self.assertEqual(ranks.get(songs + [AudioFile({"title": "d"})]),
+                         [1, 0, 2, 3])
+        self.assertEqual(calls, [3, 1])
+
+
 class TSongList(TestCase):
     HEADERS = ["acolumn", "~#lastplayed", "~foo~bar", "~#rating",
                "~#length", "~dirname", "~#track"]
@@ -171,6 +205,70 @@ class TSongList(TestCase):
 
         self.assertEqual(self.songlist.get_songs(), [song] * 4)
 
+    def test_sort_songs(self):
+        s = self.songlist
+        songs = [AudioFile({"~filename": fsnative(u"/dev/%d" % i),
+                            "artist": a, "title": t, "~#playcount": p})
+                 for i, (a, t, p) in enumerate(
+                     [("b", "x", 1), ("a", "y", 2), ("b", "y", 0),
+                      ("a", "x", 2)])]
+
+        s.set_column_headers(["artist", "title", "~#playcount"])
+        s.set_sort_orders([("title", False), ("artist", False)])
+        self.assertEqual(s._get_sort_passes(),
+                         [(["", "title", "artistsort"], False)])
+        s._sort_songs(songs)
+        self.assertEqual([(x("artist"), x("title")) for x in songs],
+                         [("a", "x"), ("a", "y"), ("b", "x"), ("b", "y")])
+
+        s.set_sort_orders([("~#playcount", True), ("title", False)])
+        self.assertEqual(s._get_sort_passes(),
+                         [(["", "~#playcount"], True), (["title"], False)])
+        s._sort_songs(songs)
+        self.assertEqual([x("~#playcount") for x in songs], [2, 1, 2, 0])
+
+    def test_sort_keys_changed(self):
+        library = SongLibrary()
+        s = SongList(library)
+        songs = [AudioFile({"~filename": fsnative(u"/dev/%d" % i),
+                            "title": t}) for i, t in enumerate("bac")]
+        library.add(songs)
+        s.set_column_headers(["title"])
+        s.set_sort_orders([("title", False)])
+        s._sort_songs(songs)
+        self.assertEqual([x("title") for x in songs], ["a", "b", "c"])
+
+        songs[0]["title"] = "d"
+        s._sort_songs(songs)
+        self.assertEqual([x("title") for x in songs], ["d", "b", "c"])
+        library.changed([songs[0]])
+        s._sort_songs(songs)
+        self.assertEqual([x("title") for x in songs], ["b", "c", "d"])
+        s.destroy()
+        library.destroy()
+
+    def test_add_songs_sorted(self):
+        s = self.songlist
+        s.set_column_headers(["title", "~#playcount"])
+        s.set_sort_orders([("~#playcount", True), ("title", False)])
+
+        def song(i, title, count):
+            return AudioFile({"~filename": fsnative(u"/dev/%d" % i),
+                              "title": title, "~#playcount": count})
+
+        old = [song(i, t, c) for i, (t, c) in enumerate(
+            [("a", 1), ("b", 2), ("b", 1), ("d", 0)])]
+        s.set_songs(old)
+        self.assertEqual(s.get_songs(), old)
+
+        new = [song(i + 4, t, c) for i, (t, c) in enumerate(
+            [("e", 0), ("b", 1), ("0", 0), ("c", 1), ("b", 3)])]
+        s.add_songs(new)
+        self.assertEqual(
+            s.get_songs(),
+            [new[2], old[0], new[4], old[1], new[1], old[2], new[3], old[3],
+             new[0]])
+
     def test_header_menu(self):
         from quodlibet import browsers
         from quodlibet.library import SongLibrary, SongLibrarian
@@ -0,0 +1,129 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import time
+
+from senf import fsnative
+
+from tests import TestCase
+
+from quodlibet import config
+from quodlibet.formats import AudioFile
+from quodlibet.query import Query
+from quodlibet.query._compiler import compile_search, compile_filter
+from quodlibet.query._match import Inter, Neg, True_, False_, Union, \
+    Regex
+from quodlibet.util.collection import Album
+
+NOW = time.time()
+DAY = 24 * 60 * 60
+
+SONGS = [
+    AudioFile({
+        "~filename": fsnative(u"/dir/foo.ogg"),
+        "~mountpoint": fsnative(u"/"),
+        "artist": "Foo\nBar",
+        "album": "Some Album",
+        "title": u"B\xe4r",
+        "date": "2004-10-31",
+        "~#playcount": 4,
+        "~#skipcount": 0,
+        "~#added": NOW - 3 * DAY,
+        "~#length": 241,
+        "~#rating": 0.8,
+    }),
+    AudioFile({
+        "~filename": fsnative(u"/other/bar.flac"),
+        "artist": "Baz",
+        "title": "",
+        "~#playcount": 2,
+        "~#skipcount": 3,
+        "~#added": NOW - 30 * DAY,
+    }),
+    AudioFile({
+        "~filename": fsnative(u"/other/quux.mp3"),
+        "album": "Other",
+        "format": "not the format",
+        "date": "invalid",
+    }),
+]
+
+QUERIES = [
+    "", "foo", "foo bar", u"b\xe4r", "bar", "!foo", "|(foo, baz)",
+    "&(foo, !baz)", "artist=foo", 'artist="Foo"c', "artist=/^ba/",
+    "artist=|(foo, baz)", "artist=&(foo, bar)", "artist=!foo",
+    "artist,title=r", "title=/^$/", "title=''", "album=other",
+    "filename=foo", "~filename=/\\.ogg$/", "~dirname=other",
+    "~basename=quux", "format=ogg", "~format=mp3", "mountpoint=/",
+    "~people=foo", "genre=/^$/", "#(playcount > 3)", "#(playcount < 3)",
+    "#(playcount = 2)", "#(playcount != 2)", "#(playcount >= 2 * 2)",
+    "#(3 < playcount < 5)", "#(playcount > skipcount)",
+    "#(playcount / skipcount > 1)", "#(playcount - skipcount < -0.5)",
+    "#(playcount * 2 + 1 = 9)", "#(-playcount < -3)", "#((1 + 2) < playcount)",
+    "#(added < 1 week)", "#(added > 1 week)", "#(added < today)",
+    "#(added > now - 5 days)", "#(date > 2000)", "#(date < 2004-11)",
+    "#(date = 2004-10-31)", "#(length > 3 minutes)", "#(rating > 0.5)",
+    "#(rating = 0.5)", "#(lastplayed > 1 day)",
+    "&(#(playcount > 1), |(artist=baz, title=bar), !album=other)",
+    "|(&(foo, #(rating > 0.5)), #(skipcount > 1))",
+    "!&(foo, bar)", "!|(foo, baz)", "&(|(foo, baz), |(album=some, bar))",
+]
+
+
+class TQueryCompiler(TestCase):
+
+    def setUp(self):
+        config.init()
+
+    def tearDown(self):
+        config.quit()
+
+    def _check(self, node, items):
+        search = compile_search(node)
+        for item in items:
+            self.assertEqual(
+                bool(search(item)), bool(node.search(item)),
+                msg="%r %r" % (node, item))
+        self.assertEqual(
+            compile_filter(node)(items), node.filter(items))
+
+    def test_songs(self):
+        for text in QUERIES:
+            self._check(Query(text)._match, SONGS)
+
+    def test_album(self):
+        albums = []
+        for song in SONGS:
+            album = Album(song)
+            album.songs = {song}
+            album.finalize()
+            albums.append(album)
+
+        for text in QUERIES:
+            self._check(Query(text)._match, albums)
+
+    def test_nodes(self):
+        self._check(Inter([]), [1])
+        self._check(Union([]), [1])
+        self._check(Inter([True_(), Neg(True_())]), [1])
+        self._check(Union([False_(), Neg(False_())]), [1])
+        self._check(Neg(Inter([Union([True_()]), Neg(False_())])), [1])
+
+    def test_not_compiled(self):
+        node = Regex("foo", "")
+        self.assertTrue(compile_search(node) is node.search)
+
+    def test_nested(self):
+        node = True_()
+        for i in range(101):
+            node = Inter([Neg(node), True_()])
+        self._check(node, [1])
+
+    def test_query(self):
+        query = Query("#(playcount > skipcount)")
+        self.assertEqual(query.filter(SONGS), SONGS[:1])
+        self.assertTrue(query.search(SONGS[0]))
+        self.assertFalse(query.search(SONGS[1]))
+        self.assertEqual(Query("").filter(SONGS), SONGS)
@@ -0,0 +1,293 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import time
+
+from senf import fsnative
+
+from tests import TestCase, skipIf
+
+from quodlibet import config
+from quodlibet.formats import AudioFile
+from quodlibet.library import libraries
+from quodlibet.library.libraries import SongLibrary
+from quodlibet.query import Query
+from quodlibet.query._compiler import compile_search
+from quodlibet.query._planner import plan, narrow, compile_residual
+
+
+def _song(i):
+    song = AudioFile({
+        "~filename": fsnative(u"/dir/%d.ogg" % i),
+        "title": "Title %d" % i,
+        "artist": ["Foo", "Bar", u"B\xe4r", "Foo\nBaz"][i % 4],
+        "album": "Album %d" % (i % 3),
+        "genre": ["Rock", "Pop", "Hard Rock"][i % 3],
+        "~#added": time.time() - (i + 0.5) * 24 * 60 * 60,
+    })
+    if i % 2:
+        song["~#playcount"] = i
+    if i % 5:
+        song["~#rating"] = i % 5 / 5.0
+    return song
+
+
+class TQueryPlanner(TestCase):
+
+    def setUp(self):
+        config.init()
+        config.set("library", "search_text_index", "true")
+        self.library = SongLibrary()
+        self.library.add([_song(i) for i in range(40)])
+
+    def tearDown(self):
+        self.library.destroy()
+        config.quit()
+
+    def _check(self, text, indexed=True, get_text_index=None,
+               get_columns=None):
+        query = Query(text)
+        self.assertEqual(
+            plan(query, self.library.get_index, get_text_index,
+                 get_columns) is not None,
+            indexed)
+        expected = query.filter(self.library.values())
+        result = query.filter_indexed(
+            self.library.values(), self.library.get_index, get_text_index,
+            get_columns)
+        self.assertEqual(len(result), len(expected))
+        self.assertEqual(set(result), set(expected))
+        return result
+
+    def test_tag(self):
+        self.assertEqual(len(self._check('artist="foo"')), 20)
+        self._check('artist="Foo"c')
+        self._check("artist=/^ba/")
+        self._check("artist=bar")
+        self._check(u'artist="bar"d')
+        self._check("artist=|(foo, baz)")
+        self._check("genre=rock")
+        self._check("artist,genre=o")
+
+    def test_not_indexed(self):
+        self._check("title=foo", indexed=False)
+        self._check("artist,title=foo", indexed=False)
+        self._check("artist=&(foo, baz)", indexed=False)
+        self._check("artist=!foo", indexed=False)
+        self._check("artist=/foo\\sbaz/", indexed=False)
+        self._check("artist=/foo.baz/s", indexed=False)
+        self._check("artist=/^$/", indexed=False)
+        self._check("#(playcount > skipcount)", indexed=False)
+        self._check("#(date > 2000)", indexed=False)
+        self._check("#(playcount != 3)", indexed=False)
+
+    def test_numeric(self):
+        self.assertEqual(len(self._check("#(playcount > 10)")), 15)
+        self._check("#(playcount >= 11)")
+        self._check("#(10 < playcount)")
+        self._check("#(playcount = 11)")
+        self._check("#(playcount < 2 * 5)")
+        self._check("#(rating > 0.5)")
+        self._check("#(rating = 0.5)")
+        self._check("#(added < 5 days)")
+        self._check("#(added > 1 week)")
+        self._check("#(3 days < added < 2 weeks)")
+
+    def test_inter_union(self):
+        self._check("&(artist=foo, genre=rock)")
+        self._check("&(artist=foo, title=1)")
+        self._check("|(artist=foo, #(playcount > 30))")
+        self._check("|(artist=foo, title=1)", indexed=False)
+        self._check("&(|(artist=foo, genre=pop), #(rating < 0.5))")
+
+    def test_text(self):
+        get_text_index = self.library.get_text_index
+        self.assertEqual(len(self._check(
+            "title=foo", get_text_index=get_text_index)), 0)
+        self.assertEqual(len(self._check(
+            "bar", get_text_index=get_text_index)), 20)
+        self.assertEqual(len(self._check(
+            u"b\xe4r 3", get_text_index=get_text_index)), 3)
+        self._check("title=1", get_text_index=get_text_index)
+        self._check("artist,title=|(foo, 1)", get_text_index=get_text_index)
+        self._check("filename=dir", get_text_index=get_text_index)
+        self._check("~people=baz", get_text_index=get_text_index)
+        self._check(u"&(foo, !title=1)", get_text_index=get_text_index)
+        self._check("ae", get_text_index=get_text_index)
+
+    def test_text_not_indexed(self):
+        get_text_index = self.library.get_text_index
+        self._check("title=/^t/", False, get_text_index)
+        self._check("title=/foo\\nbar/", False, get_text_index)
+        self._check('title="foo"c', False, get_text_index)
+        self._check("~rating=foo", False, get_text_index)
+        self._check("~title~artist=foo", False, get_text_index)
+        self._check("musicbrainz_trackid=foo", False, get_text_index)
+        self._check("!foo", False, get_text_index)
+
+    def test_text_disabled(self):
+        config.set("library", "search_text_index", "false")
+        self.assertIs(self.library.get_text_index(), None)
+        self._check("foo", False, self.library.get_text_index)
+
+    def test_narrow(self):
+        query = Query("foo title")
+        songs, search = query.narrow(
+            self.library.values(), self.library.get_index,
+            self.library.get_text_index)
+        self.assertEqual(len(songs), 20)
+        self.assertEqual(len([s for s in songs if search(s)]), 20)
+
+        query = Query('artist="foo"')
+        songs, search = query.narrow(
+            self.library.values(), self.library.get_index)
+        self.assertEqual(len(songs), 20)
+        self.assertTrue(search(None))
+
+    def test_changed(self):
+        song = list(self.library.values())[0]
+        self._check("#(rating = 1.0)")
+        song["~#rating"] = 1.0
+        song["artist"] = "New"
+        self.library.changed([song])
+        self.assertEqual(self._check("#(rating = 1.0)"), [song])
+        self.assertEqual(self._check("artist=new"), [song])
+        self.assertEqual(self._check(
+            "new", get_text_index=self.library.get_text_index), [song])
+
+    @skipIf(libraries.numpy is None, "NumPy missing")
+    def test_columns(self):
+        get_columns = self.library.get_columns
+
+        def check(text, exact=True):
+            query = Query(text)
+            result = plan(query, self.library.get_index,
+                          get_columns=get_columns)
+            self.assertEqual(result is not None and result[1] is None,
+                             exact)
+            return self._check(
+                text, result is not None, get_columns=get_columns)
+
+        self.assertEqual(len(check("#(playcount > 10)")), 15)
+        check("#(playcount != 3)")
+        check("#(playcount > skipcount)")
+        check("#(length < 1)")
+        check("#(playcount / 2 > 3)")
+        check("#(playcount / 0 > 3)")
+        check("#(-playcount < -5)")
+        check("#((playcount + 1) * 2 = 8)")
+        check("#(rating > 0.5)")
+        check("#(rating = 0.5)")
+        check("#(added < 5 days)")
+        check("#(3 days < added < 2 weeks)")
+        check("#(added > 2015-02-11)")
+        check("&(#(playcount > 10), #(rating < 0.5))")
+        check("|(#(playcount > 30), !#(rating < 0.5))")
+        check("!&(#(playcount > 10), |(#(added < 5 days), #(bar = 2)))")
+        check("&(artist=foo, #(playcount > 10), #(rating < 0.5))")
+        check("&(title=1, #(playcount > 10), #(rating < 0.5))", False)
+        check("#(date > 2000)", False)
+        check("#(rating:avg > 0.5)", False)
+        check("|(#(playcount > 30), title=1)", False)
+
+    @skipIf(libraries.numpy is None, "NumPy missing")
+    def test_columns_rounding(self):
+        songs = list(self.library.values())
+        songs[0]["~#foo"] = 2.675
+        songs[1]["~#foo"] = 2.665
+        songs[2]["~#foo"] = 0.125
+        self.library.changed(songs[:3])
+        get_columns = self.library.get_columns
+        for value in ["2.67", "2.68", "2.66", "0.12", "0.13"]:
+            self._check("#(foo = %s)" % value, get_columns=get_columns)
+
+    @skipIf(libraries.numpy is None, "NumPy missing")
+    def test_columns_changed(self):
+        get_columns = self.library.get_columns
+        self._check("#(playcount > 100)", get_columns=get_columns)
+        song = list(self.library.values())[0]
+        song["~#playcount"] = 1000
+        self.library.changed([song])
+        self.assertEqual(
+            self._check("#(playcount > 100)", get_columns=get_columns),
+            [song])
+        self.addCleanup(
+            setattr, config.RATINGS, "default", config.RATINGS.default)
+        config.RATINGS.default = 0.1
+        self._check("#(rating < 0.15)", get_columns=get_columns)
+        self.library.remove([song])
+        self.assertEqual(
+            self._check("#(playcount > 100)", get_columns=get_columns), [])
+
+    def test_planned_time(self):
+        # searching can take a while, match as of the time of planning
+        then = time.time() - 60 * 60
+        day = 24 * 60 * 60
+        before, after = _song(100), _song(101)
+        before["~#added"] = then - 2 * day - 30
+        after["~#added"] = then - 2 * day + 30
+        self.library.add([before, after])
+
+        query = Query("&(#(added > 2 days), !#(added > 3 days))")
+        songs, residual = narrow(
+            query, self.library.values(), self.library.get_index, now=then)
+        search = compile_residual(residual, then)
+        result = [s for s in songs if search(s)]
+        self.assertTrue(before in result)
+        self.assertFalse(after in result)
+        self.assertEqual(
+            set(result),
+            set(filter(compile_search(query, then), self.library.values())))
+
+    def test_residual_cached(self):
+        songs = self.library.values()
+        query = Query("&(artist=foo, title=/1/)")
+        for i in range(2):
+            result = query.filter_indexed(songs, self.library.get_index)
+            self.assertEqual(set(result), set(query.filter(songs)))
+            self.assertEqual(len(query._residuals), 1)
+
+        # depends on the time of planning
+        query = Query("&(artist=foo, !#(added < 3 days))")
+        result = query.filter_indexed(songs, self.library.get_index)
+        self.assertEqual(set(result), set(query.filter(songs)))
+        self.assertEqual(query._residuals, {})
+
+    def test_query(self):
+        self.assertEqual(len(self.library.query('artist="baz"')), 10)
+        self.assertEqual(len(self.library.query("")), 40)
+
+    def test_query_order(self):
+        songs = list(self.library.values())
+        self.assertEqual(self.library.query("artist=foo"),
+                         [s for s in songs if "Foo" in s.list("artist")])
+
+    def test_tag_fallback(self):
+        config.set("library", "indexed_tags", "title,version,filename")
+        untitled = AudioFile({"~filename": fsnative(u"/dir/untitled.ogg")})
+        fallback = AudioFile({"~filename": fsnative(u"/dir/fallback.ogg"),
+                              "~version": "Live"})
+        self.library.add([untitled, fallback])
+        # the title made up from the file name doesn't get searched
+        self.assertEqual(self._check("title=untitled"), [])
+        self.assertEqual(len(self._check("title=/^title 1/")), 11)
+        self.assertEqual(self._check("version=live"), [fallback])
+        self._check("filename=untitled", indexed=False)
+        self._check("title~version=live", indexed=False)
+
+    def test_query_refine(self):
+        self.assertEqual(len(self.library.query("bar")), 20)
+        query = self.library._last_query
+        self.assertEqual(len(self.library.query("bar title 3")), 6)
+        self.assertTrue(self.library._last_query.is_refinement_of(query))
+
+        song = [s for s in self.library.query("foo")
+                if "1" not in s("title") + s("album")][0]
+        self.assertEqual(len(self.library.query("foo 1")), 9)
+        self.assertFalse(song in self.library.query("foo 1"))
+        song["title"] = "Title 1x"
+        self.library.changed([song])
+        self.assertTrue(self.library._last_query is None)
+        self.assertEqual(self.library.query("foo 1x"), [song])
@@ -0,0 +1,93 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+from tests import TestCase
+
+from quodlibet import config
+from quodlibet.query import Query
+from quodlibet.query._refine import refines
+
+
+class TQueryRefine(TestCase):
+
+    def setUp(self):
+        config.init()
+
+    def tearDown(self):
+        config.quit()
+
+    def _refines(self, text, other):
+        return refines(Query(text)._match, Query(other)._match)
+
+    def test_text(self):
+        self.assertTrue(self._refines("foo", ""))
+        self.assertTrue(self._refines("foo", "foo"))
+        self.assertTrue(self._refines("food", "foo"))
+        self.assertTrue(self._refines("afoo", "foo"))
+        self.assertTrue(self._refines("foo bar", "foo"))
+        self.assertTrue(self._refines("foo bar", "bar foo"))
+        self.assertTrue(self._refines("foo barx", "foo bar"))
+        self.assertTrue(self._refines("foo.", "foo"))
+        self.assertTrue(self._refines(u"b\xe4r", "b"))
+        self.assertFalse(self._refines("", "foo"))
+        self.assertFalse(self._refines("fo", "foo"))
+        self.assertFalse(self._refines("foo", "foo bar"))
+        self.assertFalse(self._refines("fxoo", "foo"))
+
+    def test_variants(self):
+        # "ae" also matches "æ", "a" doesn't
+        self.assertFalse(self._refines("fae", "fa"))
+        self.assertTrue(self._refines("faex", "fae"))
+        self.assertTrue(self._refines("xfae", "fae"))
+        self.assertTrue(self._refines("fae", "f"))
+
+    def test_tags(self):
+        self.assertTrue(self._refines("artist=food", "artist=foo"))
+        self.assertTrue(self._refines("artist=foo", "artist,title=foo"))
+        self.assertFalse(self._refines("artist,title=foo", "artist=foo"))
+        self.assertFalse(self._refines("title=foo", "artist=foo"))
+        self.assertFalse(self._refines('artist="foo"c', "artist=foo"))
+        self.assertFalse(self._refines("artist=/fo+/", "artist=/fo/"))
+        self.assertFalse(self._refines("artist=/fo/", "artist=/fo+/"))
+        self.assertTrue(self._refines("artist=/foo/", "artist=/fo/"))
+        self.assertTrue(self._refines("artist=foo", "artist=|(foo, bar)"))
+        self.assertTrue(
+            self._refines("artist=&(foo, bar)", "artist=|(foo, bar)"))
+        self.assertTrue(self._refines("artist=!ba", "artist=!bar"))
+        self.assertFalse(self._refines("artist=!bar", "artist=!ba"))
+
+    def test_inter_union(self):
+        self.assertTrue(self._refines("&(foo, #(rating > 0.5))", "foo"))
+        self.assertTrue(
+            self._refines("&(a=x, &(b=y, c=z))", "&(c=z, a=x)"))
+        self.assertFalse(self._refines("&(a=x, b=y)", "&(a=x, c=z)"))
+        self.assertTrue(self._refines("a=x", "|(a=x, b=y)"))
+        self.assertTrue(self._refines("|(a=xy, b=yz)", "|(a=x, b=y)"))
+        self.assertFalse(self._refines("|(a=x, b=y)", "a=x"))
+
+    def test_not_known(self):
+        self.assertFalse(
+            self._refines("#(rating > 0.5)", "#(rating > 0.5)"))
+        query = Query("#(rating > 0.5)")
+        self.assertTrue(refines(query, query))
+
+        # the same query can match other songs later on
+        for text in ["#(lastplayed > 1 day)", "#(added < today)",
+                     "#(year > now)", "&(a=x, #(laststarted:max < 1 hour))",
+                     "!#(added > 3 weeks)"]:
+            query = Query(text)
+            self.assertFalse(refines(query, query), msg=text)
+
+    def test_query(self):
+        query = Query("foo")
+        self.assertTrue(Query("foo bar").is_refinement_of(query))
+        self.assertFalse(Query("fo").is_refinement_of(query))
+
+        # the multi search bar adds the matches of other queries
+        other = Query("artist=foo")
+        query._match = query._match & other._match
+        new = Query("food")
+        new._match = new._match & other._match
+        self.assertTrue(new.is_refinement_of(query))
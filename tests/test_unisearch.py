@@ -9,10 +9,15 @@ import re
 import unicodedata
 
 from tests import TestCase
+from .helper import capture_output
 
-from quodlibet.unisearch import compile
+from quodlibet.unisearch import compile, folded_text
+from quodlibet.util import re_escape
 from quodlibet.unisearch.db import diacritic_for_letters
-from quodlibet.unisearch.parser import re_replace_literals, re_add_variants
+from quodlibet.unisearch.db import get_replacement_mapping
+from quodlibet.unisearch.fold import fold, fold_cached
+from quodlibet.unisearch.parser import re_replace_literals, re_add_variants, \
+    _compile
 
 
 class TUniSearch(TestCase):
@@ -184,3 +189,75 @@ class TCompileMatch(TestCase):
 
         with self.assertRaises(ValueError):
             compile(u"(F", asym=True)
+
+    def test_cached(self):
+        search = compile(u"bar", asym=True)
+        self.assertTrue(
+            _compile(u"bar", True, False, True) is
+            _compile(u"bar", True, False, True))
+        assert search(u"B\xe4r")
+        assert compile(u"bar", asym=True)(u"bar")
+        assert not compile(u"bar", ignore_case=False, asym=True)(u"B\xe4r")
+
+    def test_prefilter(self):
+        self.assertTrue(_compile(u"f\xf6o", True, False, True)[1])
+        self.assertTrue(_compile(u"a\\.b", True, False, True)[1])
+        self.assertFalse(_compile(u"f.o", True, False, True)[1])
+        self.assertFalse(_compile(u"foo", False, False, True)[1])
+        self.assertFalse(_compile(u"foo", True, False, False)[1])
+
+        assert compile(u"ae", asym=True)(u"\xe6")
+        assert compile(u"ss", asym=True)(u"Stra\xdfe")
+        assert not compile(u"f", asym=True)(u"\ufb00")
+        assert compile(u"a\\.b", asym=True)(u"A.\u1e03")
+        assert not compile(u"a\\.b", asym=True)(u"AX\u1e03")
+
+
+class TFold(TestCase):
+
+    def test_fold(self):
+        self.assertEqual(fold(u"F\xf6hn"), u"fohn")
+        self.assertEqual(fold(u"\xc6ON"), u"aeon")
+        self.assertEqual(fold(u"Stra\xdfe"), u"strasse")
+        self.assertEqual(fold(u"\u0130stanbul"), u"istanbul")
+        self.assertEqual(fold(u"o\u0308"), fold(u"\xf6"))
+        self.assertEqual(fold(u"\u65e5\u672c"), u"\u65e5\u672c")
+        self.assertEqual(fold_cached(u"F\xf6hn"), u"fohn")
+        self.assertEqual(fold_cached(u"F\xf6hn"), u"fohn")
+
+    def test_ascii(self):
+        for code in range(128):
+            char = chr(code)
+            self.assertEqual(fold(char), fold(u"\xe4" + char)[1:])
+
+    def test_no_case_fixes(self):
+        from quodlibet.unisearch import fold as fold_module
+
+        def restore(values):
+            for name, value in values.items():
+                setattr(fold_module, name, value)
+            _compile.cache_clear()
+
+        names = ["_CASE_FIXES", "_table", "_available"]
+        self.addCleanup(
+            restore, {name: getattr(fold_module, name) for name in names})
+        restore({"_CASE_FIXES": None, "_table": None, "_available": True})
+
+        with capture_output():
+            self.assertEqual(fold(u"F\xf6hn"), None)
+        self.assertEqual(_compile(u"F\xf6hn", True, False, True)[1], None)
+        self.assertEqual(folded_text(u"F\xf6hn", asym=True), None)
+        assert compile(u"Fohn", asym=True)(u"F\xf6hn")
+
+    def test_folded_text(self):
+        self.assertEqual(folded_text(u"F\xf6hn", asym=True), u"fohn")
+        self.assertEqual(folded_text(u"f.hn", asym=True), None)
+        self.assertEqual(folded_text(u"fohn"), None)
+
+    def test_variants(self):
+        # everything a character matches folds to the same
+        mapping = get_replacement_mapping()
+        for key, variants in mapping.items():
+            for variant in variants:
+                self.assertEqual(fold(variant), fold(key))
+                self.assertTrue(compile(re_escape(key), asym=True)(variant))
@@ -17,8 +17,9 @@ from quodlibet import config
 from tests import TestCase, mkdtemp
 from quodlibet.formats import AudioFile as Fakesong
 from quodlibet.formats._audio import NUMERIC_ZERO_DEFAULT, PEOPLE
-from quodlibet.util.collection import (Album, Playlist, avg, bayesian_average,
-                                       FileBackedPlaylist, XSPFBackedPlaylist)
+from quodlibet.util.collection import (Album, Collection, Playlist, avg,
+                                       bayesian_average, FileBackedPlaylist,
+                                       XSPFBackedPlaylist, precompute)
 from quodlibet.library.libraries import FileLibrary
 from quodlibet.util import format_rating
 
@@ -264,6 +265,152 @@ class TAlbum(TestCase):
         s.failUnlessEqual(album.comma("c"), "cc3, cc1")
         s.failUnlessEqual(album.comma("~c~b"), "cc3, cc1 - bb1, bb4")
 
+    def test_refresh(self):
+        keys = ["~#length", "~#rating", "~#playcount:avg", "~#added:max",
+                "~people", "~peoplesort", "genre", "~length", "~#tracks"]
+        songs = [
+            Fakesong({"~#length": 4, "~#playcount": 2, "~#added": 3,
+                      "artist": "b", "genre": "rock\npop", "~#rating": 0.2}),
+            Fakesong({"~#length": 7, "~#added": 5, "artist": "a",
+                      "artistsort": "z", "genre": "pop"}),
+            Fakesong({"~#length": 1, "~#playcount": 4, "albumartist": "c",
+                      "artist": "b"}),
+        ]
+
+        def check(album):
+            fresh = Album(songs[0])
+            fresh.songs = set(album.songs)
+            for key in keys:
+                self.assertEqual(album(key), fresh(key), msg=key)
+
+        album = Album(songs[0])
+        album.songs = set(songs[:2])
+        check(album)
+
+        album.songs.add(songs[2])
+        album.refresh([songs[2]])
+        check(album)
+
+        songs[0]["~#playcount"] = 10
+        songs[0]["genre"] = "jazz"
+        del songs[0]["~#rating"]
+        songs[1]["artist"] = "d"
+        album.refresh(songs[:2])
+        check(album)
+
+        album.songs.remove(songs[1])
+        album.refresh(removed=[songs[1]])
+        check(album)
+
+    def test_refresh_like_recount(self):
+        keys = ["~people", "~peoplesort", "~#length", "~#length:max",
+                "~#playcount:min", "~#playcount:avg", "~#rating:max"]
+        songs = [
+            Fakesong({"artist": "b", "~#length": 1.0, "~#playcount": 2}),
+            Fakesong({"artist": "c\na", "~#length": 2, "~#playcount": 2.0,
+                      "~#rating": 1}),
+            Fakesong({"artist": "a", "~#length": 2.0, "~#playcount": 3,
+                      "~#rating": 1.0}),
+        ]
+        collection = Collection()
+        collection.songs = list(songs)
+
+        def check():
+            values = [collection(key) for key in keys]
+            collection.finalize()
+            recounted = [collection(key) for key in keys]
+            self.assertEqual(values, recounted)
+            self.assertEqual(list(map(type, values)),
+                             list(map(type, recounted)))
+            return dict(zip(keys, values))
+
+        values = check()
+        self.assertEqual(values["~people"], "a\nb\nc")
+        self.assertEqual(values["~#length"], 5.0)
+        self.assertEqual(values["~#length:max"], 2)
+        self.assertTrue(isinstance(values["~#length:max"], int))
+        self.assertTrue(isinstance(values["~#playcount:min"], int))
+        self.assertEqual(values["~#rating:max"], 1)
+
+        songs[0]["artist"] = "d"
+        songs[0]["~#length"] = 1
+        songs[1]["~#playcount"] = 1.0
+        del songs[1]["~#rating"]
+        collection.refresh(songs[:2])
+        values = check()
+        self.assertEqual(values["~people"], "a\nd\nc")
+        self.assertTrue(isinstance(values["~#length"], float))
+        self.assertTrue(isinstance(values["~#playcount:min"], float))
+        self.assertTrue(isinstance(values["~#rating:max"], float))
+
+        collection.songs.remove(songs[0])
+        collection.refresh(removed=songs[:1])
+        values = check()
+        self.assertEqual(values["~people"], "a\nc")
+        self.assertEqual(values["~#length:max"], 2)
+        self.assertTrue(isinstance(values["~#length:max"], int))
+
+    def test_refresh_default_rating(self):
+        self.addCleanup(
+            setattr, config.RATINGS, "default", config.RATINGS.default)
+        songs = [Fakesong({"~#rating": 1.0}), Fakesong({})]
+        album = Album(songs[0])
+        album.songs = set(songs)
+
+        config.RATINGS.default = 0.5
+        self.assertEqual(album("~#rating:avg"), 0.75)
+        config.RATINGS.default = 0.0
+        album.refresh()
+        self.assertEqual(album("~#rating:avg"), 0.5)
+
+    def test_counts_dropped(self):
+        songs = [Fakesong({"~#length": i, "genre": "rock"})
+                 for i in range(3)]
+        album = Album(songs[0])
+        album.songs = set(songs)
+        album._cache_size = 2
+
+        def counted():
+            return set(album._Collection__counts)
+
+        self.assertEqual(album("genre"), "rock")
+        self.assertEqual(album("~#length"), 3)
+        self.assertEqual(counted(), {"genre", "~#length"})
+        counts = album._Collection__counts["genre"]
+        self.assertEqual(len(set(map(id, counts._songs.values()))), 1)
+
+        # kept to update the values after a refresh
+        songs[0]["genre"] = "pop"
+        album.refresh(songs[:1])
+        self.assertEqual(counted(), {"genre", "~#length"})
+        self.assertEqual(album("genre"), "rock\npop")
+
+        # dropped with the last value computed using them
+        self.assertEqual(album("~#tracks"), 3)
+        self.assertEqual(counted(), {"genre"})
+        self.assertEqual(album("composer"), "")
+        self.assertEqual(counted(), {"genre"})
+        self.assertEqual(album("~#discs"), 1)
+        self.assertEqual(counted(), set())
+
+    def test_precompute(self):
+        songs = [Fakesong({"~#rating": 0.25 * i, "date": str(2000 + i)})
+                 for i in range(3)]
+        albums = []
+        for song in songs:
+            album = Album(song)
+            album.songs = {song}
+            albums.append(album)
+
+        precompute(albums, ["~#rating", "date"])
+        for album, song in zip(albums, songs):
+            song["~#rating"] = 1.0
+            # cached until the album gets refreshed
+            self.assertEqual(album("date"), song("date"))
+            self.assertNotEqual(album("~#rating"), 1.0)
+            album.refresh([song])
+            self.assertEqual(album("~#rating"), 1.0)
+
     def tearDown(self):
         config.quit()
 
@@ -7,6 +7,7 @@
 import glob
 import os
 import shutil
+import time
 from os.path import basename
 
 from gi.repository import Gio
@@ -17,7 +18,9 @@ from quodlibet import config
 from quodlibet.ext.covers.artwork_url import ArtworkUrlCover
 from quodlibet.formats import AudioFile
 from quodlibet.plugins import Plugin
+from quodlibet.util.cover.built_in import FilesystemCover
 from quodlibet.util.cover.http import escape_query_value
+from quodlibet.util.cover import manager
 from quodlibet.util.cover.manager import CoverManager
 from quodlibet.util.path import normalize_path, path_equal, mkdir
 
@@ -56,6 +59,7 @@ class TCoverManager(TestCase):
         })
 
     def tearDown(self):
+        FilesystemCover.forget()
         shutil.rmtree(self.dir)
         config.quit()
 
@@ -221,11 +225,127 @@ class TCoverManager(TestCase):
             assert path_equal(
                 actual, f, "\"%s\" should trump \"%s\"" % (f, actual))
 
+    def settle(self, path):
+        # old enough to be remembered
+        old = time.time() - 60
+        os.utime(path, (old, old))
+
+    def test_found_remembered(self):
+        first = self.add_file("cover.png")
+        self.settle(self.dir)
+        with self._find_cover(self.song) as cover:
+            assert path_equal(os.path.abspath(cover.name), first)
+
+        # a better one, without the directory looking changed
+        stat = os.stat(self.dir)
+        better = self.add_file("Quuxly - front.png")
+        os.utime(self.dir, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        with self._find_cover(self.song) as cover:
+            assert path_equal(os.path.abspath(cover.name), first)
+
+        self.manager.cover_changed([self.song])
+        with self._find_cover(self.song) as cover:
+            assert path_equal(os.path.abspath(cover.name), better)
+
+    def test_found_song_changed(self):
+        first = self.add_file("Some One.png")
+        other = self.add_file("Other.png")
+        self.settle(self.dir)
+        with self._find_cover(self.song) as cover:
+            assert path_equal(os.path.abspath(cover.name), first)
+
+        # doesn't change what gets found
+        self.song["~#playcount"] = 1
+        FilesystemCover.forget_changed([self.song])
+        assert len(FilesystemCover.found.sources(self.dir)) == 1
+
+        self.song["artist"] = "Other"
+        FilesystemCover.forget_changed([self.song])
+        assert not FilesystemCover.found.sources(self.dir)
+        with self._find_cover(self.song) as cover:
+            assert path_equal(os.path.abspath(cover.name), other)
+
+    def test_found_dir_changed(self):
+        self.settle(self.dir)
+        assert not self._find_cover(self.song)
+        f = self.add_file("cover.png")
+        with self._find_cover(self.song) as cover:
+            assert path_equal(os.path.abspath(cover.name), f)
+
+    def test_found_subdir_changed(self):
+        mkdir(self.full_path("covers"))
+        self.add_file(os.path.join("covers", "back.jpg"))
+        self.settle(self.full_path("covers"))
+        self.settle(self.dir)
+        assert not self._find_cover(self.song)
+        f = self.add_file(os.path.join("covers", "cover.jpg"))
+        with self._find_cover(self.song) as cover:
+            assert path_equal(os.path.abspath(cover.name), f)
+
+    def test_found_removed(self):
+        f = self.add_file("cover.png")
+        self.settle(self.dir)
+        self._find_cover(self.song).close()
+        os.remove(f)
+        self.settle(self.dir)
+        assert not self._find_cover(self.song)
+
+    def test_found_options_changed(self):
+        self.add_file("cover.png")
+        f = self.add_file("foo.png")
+        self.settle(self.dir)
+        self._find_cover(self.song).close()
+        config.set("albumart", "force_filename", str(True))
+        config.set("albumart", "filename", "foo.*")
+        with self._find_cover(self.song) as cover:
+            assert path_equal(os.path.abspath(cover.name), f)
+
+    def test_glob_hidden(self):
+        config.set("albumart", "force_filename", str(True))
+        config.set("albumart", "filename", "*hidden.jpg")
+        f = self.add_file(".hidden.jpg")
+        assert not self._find_cover(self.song)
+        config.set("albumart", "filename", ".*hidden.jpg")
+        with self._find_cover(self.song) as cover:
+            assert path_equal(os.path.abspath(cover.name), f)
+
     def test_get_thumbnail(self):
         self.assertTrue(self.manager.get_pixbuf(self.song, 10, 10) is None)
         self.assertTrue(
             self.manager.get_pixbuf_many([self.song], 10, 10) is None)
 
+    def test_get_thumbnail_gone(self):
+        # removed or found broken after checking for it
+        class Thumbnails:
+            stored = []
+
+            def contains(self, path, boundary):
+                return True
+
+            def get(self, path, boundary):
+                return None
+
+            def put(self, path, boundary, pixbuf):
+                self.stored.append(path)
+
+        f = self.add_file("cover.jpg")
+        self.manager._thumbnails = Thumbnails()
+        loaded = []
+
+        def get_thumbnail_from_file(fileobj, boundary):
+            loaded.append(fileobj.name)
+            return "pixbuf"
+
+        old = manager.get_thumbnail_from_file
+        manager.get_thumbnail_from_file = get_thumbnail_from_file
+        try:
+            self.assertEqual(
+                self.manager.get_pixbuf(self.song, 10, 10), "pixbuf")
+        finally:
+            manager.get_thumbnail_from_file = old
+        self.assertEqual(loaded, [f])
+        self.assertEqual(Thumbnails.stored, [f])
+
     def test_get_many(self):
         songs = [AudioFile({"~filename": os.path.join(self.dir, "song.ogg"),
                             "title": "Ode to Baz"}),
@@ -0,0 +1,187 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import os
+import shutil
+import time
+
+from quodlibet.util.cover.fscache import DirectoryListings, FoundCovers, \
+    get_dir_state
+
+from tests import TestCase, mkdtemp
+
+
+class TFSCache(TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def touch(self, name):
+        open(os.path.join(self.dir, name), "wb").close()
+
+    def settle(self):
+        old = time.time() - 60
+        os.utime(self.dir, (old, old))
+
+    def test_get_dir_state(self):
+        assert get_dir_state(os.path.join(self.dir, "nope")) is None
+        state = get_dir_state(self.dir)
+        assert state is not None
+        self.touch("a")
+        self.settle()
+        assert get_dir_state(self.dir) != state
+
+    def test_listdir(self):
+        listings = DirectoryListings()
+        self.touch("a")
+        self.settle()
+        entries, state = listings.listdir(self.dir)
+        assert entries == ["a"]
+        assert state == get_dir_state(self.dir)
+
+        # unchanged, so not listed again
+        os.remove(os.path.join(self.dir, "a"))
+        os.utime(self.dir, ns=(state[0], state[0]))
+        assert listings.listdir(self.dir)[0] == ["a"]
+
+        listings.forget([self.dir])
+        assert listings.listdir(self.dir)[0] == []
+
+    def test_listdir_forget_subdirs(self):
+        listings = DirectoryListings()
+        sub = os.path.join(self.dir, "sub")
+        os.mkdir(sub)
+        old = time.time() - 60
+        os.utime(sub, (old, old))
+        self.settle()
+        listings.listdir(self.dir)
+        listings.listdir(sub)
+        listings.forget([os.path.join(self.dir, "other")])
+        assert len(listings._listings) == 2
+        listings.forget([self.dir])
+        assert not listings._listings
+        assert not listings._children
+
+    def test_listdir_unsettled(self):
+        listings = DirectoryListings()
+        self.touch("a")
+        state = listings.listdir(self.dir)[1]
+        os.remove(os.path.join(self.dir, "a"))
+        os.utime(self.dir, ns=(state[0], state[0]))
+        assert listings.listdir(self.dir)[0] == []
+
+    def test_listdir_error(self):
+        with self.assertRaises(OSError):
+            DirectoryListings().listdir(os.path.join(self.dir, "nope"))
+
+    def test_listdir_max_size(self):
+        listings = DirectoryListings(max_size=1)
+        for name in ["a", "b"]:
+            os.mkdir(os.path.join(self.dir, name))
+            old = time.time() - 60
+            os.utime(os.path.join(self.dir, name), (old, old))
+            listings.listdir(os.path.join(self.dir, name))
+        assert len(listings._listings) == 1
+
+    def test_found(self):
+        found = FoundCovers()
+        self.settle()
+        key = (self.dir, ("album",))
+        states = {self.dir: get_dir_state(self.dir)}
+        path = os.path.join(self.dir, "cover.jpg")
+        found.set(key, "options", path, states)
+        assert found.get(key, "options") == path
+        with self.assertRaises(KeyError):
+            found.get(key, "other")
+        with self.assertRaises(KeyError):
+            found.get(key, "options")
+
+    def test_found_none(self):
+        found = FoundCovers()
+        self.settle()
+        key = (self.dir, ("album",))
+        found.set(key, None, None, {self.dir: get_dir_state(self.dir)})
+        assert found.get(key, None) is None
+
+    def test_found_dir_changed(self):
+        found = FoundCovers()
+        self.settle()
+        key = (self.dir, ("album",))
+        found.set(key, None, None, {self.dir: get_dir_state(self.dir)})
+        self.touch("a")
+        with self.assertRaises(KeyError):
+            found.get(key, None)
+
+    def test_found_unsettled(self):
+        found = FoundCovers()
+        key = (self.dir, ("album",))
+        found.set(key, None, None, {self.dir: get_dir_state(self.dir)})
+        with self.assertRaises(KeyError):
+            found.get(key, None)
+
+    def test_found_forget(self):
+        found = FoundCovers()
+        self.settle()
+        states = {self.dir: get_dir_state(self.dir)}
+        found.set((self.dir, ("a",)), None, None, states)
+        found.set(("other", ("a",)), None, None, {})
+        found.forget([self.dir])
+        with self.assertRaises(KeyError):
+            found.get((self.dir, ("a",)), None)
+        assert found.get(("other", ("a",)), None) is None
+        found.forget()
+        with self.assertRaises(KeyError):
+            found.get(("other", ("a",)), None)
+
+    def test_found_sources(self):
+        found = FoundCovers()
+        self.settle()
+        states = {self.dir: get_dir_state(self.dir)}
+        found.set((self.dir, ("a",)), None, None, states, "source")
+        found.set((self.dir, ("b",)), None, None, states)
+        assert sorted(found.sources(self.dir)) == [
+            ((self.dir, ("a",)), "source"), ((self.dir, ("b",)), None)]
+        assert found.sources("other") == []
+        found.forget(keys=[(self.dir, ("a",))])
+        assert found.sources(self.dir) == [((self.dir, ("b",)), None)]
+        with self.assertRaises(KeyError):
+            found.get((self.dir, ("a",)), None)
+
+    def test_found_max_size(self):
+        found = FoundCovers(max_size=1)
+        self.settle()
+        states = {self.dir: get_dir_state(self.dir)}
+        found.set((self.dir, ("a",)), None, None, states)
+        found.set((self.dir, ("b",)), None, None, states)
+        assert found.sources(self.dir) == [((self.dir, ("b",)), None)]
+
+    def test_save_load(self):
+        found = FoundCovers()
+        self.settle()
+        key = (self.dir, ("album",))
+        path = os.path.join(self.dir, "cover.jpg")
+        found.set(key, None, path, {self.dir: get_dir_state(self.dir)})
+        other = mkdtemp()
+        try:
+            filename = os.path.join(other, "found")
+            found.save(filename)
+            loaded = FoundCovers()
+            loaded.load(filename)
+        finally:
+            shutil.rmtree(other)
+        assert loaded.get(key, None) == path
+
+    def test_load_missing_or_broken(self):
+        found = FoundCovers()
+        found.load(os.path.join(self.dir, "nope"))
+        filename = os.path.join(self.dir, "broken")
+        with open(filename, "wb") as h:
+            h.write(b"nope")
+        found.load(filename)
+        with self.assertRaises(KeyError):
+            found.get(("a", ()), None)
@@ -6,13 +6,15 @@
 # (at your option) any later version.
 
 import threading
+import time
 
 from tests import TestCase
+from tests.helper import capture_output
 
 from gi.repository import Gtk
 
 from quodlibet.util.thread import call_async, call_async_background, \
-    Cancellable, terminate_all
+    Cancellable, terminate_all, AsyncFilter, AsyncQueue
 
 
 class Tcall_async(TestCase):
@@ -61,3 +63,244 @@ class Tcall_async(TestCase):
 
     def test_terminate_all(self):
         terminate_all()
+
+
+class TAsyncFilter(TestCase):
+
+    def setUp(self):
+        self.filter = AsyncFilter()
+        self.results = []
+
+    def _callback(self, matches, done):
+        self.results.append((matches, done))
+
+    def _wait(self):
+        while not (self.results and self.results[-1][1]):
+            Gtk.main_iteration()
+
+    def test_sync(self):
+        self.filter.filter(lambda i: i % 2, range(10), self._callback)
+        self.assertEqual(self.results, [([1, 3, 5, 7, 9], True)])
+        self.assertTrue(self.filter.first_result_time is not None)
+
+    def test_async(self):
+        self.filter.SYNC_TIME = 0
+        self.filter.BATCH_TIME = 0
+        self.filter.CHUNK_SIZE = 10
+        self.filter.filter(lambda i: i % 3 == 0, range(1000), self._callback)
+        self._wait()
+        self.assertTrue(len(self.results) > 2)
+        self.assertEqual([done for m, done in self.results[:-1]],
+                         [False] * (len(self.results) - 1))
+        self.assertEqual(sum((m for m, done in self.results), []),
+                         list(range(0, 1000, 3)))
+
+    def test_sync_all(self):
+        self.filter.SYNC_TIME = 0
+        self.filter.CHUNK_SIZE = 10
+        self.filter.filter(
+            lambda i: i > 500, range(1000), self._callback, sync=True)
+        self.assertEqual(self.results, [(list(range(501, 1000)), True)])
+
+    def test_cancel(self):
+        self.filter.SYNC_TIME = 0
+        self.filter.CHUNK_SIZE = 10
+
+        def slow(i):
+            time.sleep(0.001)
+            return True
+
+        self.filter.filter(slow, range(1000), self._callback)
+        self.assertEqual(len(self.results), 1)
+        self.filter.filter(lambda i: i == 5, range(1000), self._callback)
+        self._wait()
+        time.sleep(0.1)
+        while Gtk.events_pending():
+            Gtk.main_iteration()
+        self.assertEqual(self.results[1:], [([5], False), ([], True)])
+
+    def test_main_loop(self):
+        self.filter.SYNC_TIME = 0
+        self.filter.CHUNK_SIZE = 10
+        main = threading.current_thread()
+        threads = set()
+
+        def function(i):
+            threads.add(threading.current_thread())
+            return i % 3 == 0
+
+        self.filter.filter(function, range(1000), self._callback,
+                           thread=False)
+        self._wait()
+        self.assertEqual(threads, {main})
+        self.assertEqual(sum((m for m, done in self.results), []),
+                         list(range(0, 1000, 3)))
+
+    def test_error(self):
+        self.filter.SYNC_TIME = 0
+        self.filter.CHUNK_SIZE = 10
+
+        def function(i):
+            if i == 500:
+                raise ValueError
+            return True
+
+        for thread in [True, False]:
+            del self.results[:]
+            with capture_output():
+                self.filter.filter(function, range(1000), self._callback,
+                                   thread=thread)
+                self._wait()
+            matches = sum((m for m, done in self.results), [])
+            self.assertEqual(matches, list(range(len(matches))))
+            self.assertTrue(len(matches) <= 500)
+
+        # the first items get filtered right away
+        del self.results[:]
+        with capture_output():
+            self.filter.filter(function, range(1000), self._callback,
+                               sync=True)
+        self.assertEqual(self.results, [(list(range(500)), True)])
+
+
+class TAsyncQueue(TestCase):
+
+    def setUp(self):
+        self.done = 0
+        self.queue = AsyncQueue(max_workers=1, done=self._done)
+        self.results = []
+
+    def tearDown(self):
+        self.queue.destroy()
+
+    def _done(self):
+        self.done += 1
+
+    def _wait(self, count):
+        while len(self.results) < count:
+            Gtk.main_iteration()
+
+    def _put(self, key, function, cancel=None, background=False):
+        self.queue.put(key, function, (key,), self.results.append,
+                       cancel or Cancellable(), background)
+
+    def _block(self):
+        # keeps the only worker busy until the returned event is set
+        started = threading.Event()
+        event = threading.Event()
+
+        def block(key):
+            started.set()
+            event.wait(5)
+            return key
+
+        self._put("block", block)
+        started.wait(5)
+        return event
+
+    def test_put(self):
+        for i in range(10):
+            self._put(i, lambda i: i * 2)
+        self._wait(10)
+        self.assertEqual(sorted(self.results), list(range(0, 20, 2)))
+        self.assertTrue(self.done >= 1)
+
+    def test_order(self):
+        event = self._block()
+        self._put("background", lambda k: k, background=True)
+        for i in range(3):
+            self._put(i, lambda k: k)
+        event.set()
+        self._wait(5)
+        self.assertEqual(self.results, ["block", 2, 1, 0, "background"])
+
+    def test_put_twice(self):
+        event = self._block()
+        calls = []
+
+        def func(key):
+            calls.append(key)
+            return key
+
+        self._put("a", func)
+        self._put("a", func)
+        self._put("a", func, background=True)
+        event.set()
+        self._wait(2)
+        time.sleep(0.1)
+        while Gtk.events_pending():
+            Gtk.main_iteration()
+        self.assertEqual(calls, ["a"])
+        self.assertEqual(self.results, ["block", "a"])
+
+    def test_put_pending_replaced(self):
+        event = self._block()
+        self._put("a", lambda k: "old")
+        self._put("a", lambda k: "new")
+        event.set()
+        self._wait(2)
+        self.assertEqual(self.results, ["block", "new"])
+
+    def test_put_running(self):
+        started = threading.Event()
+        event = threading.Event()
+
+        def old(key):
+            started.set()
+            event.wait(5)
+            return "old"
+
+        self._put("a", old)
+        started.wait(5)
+        self._put("a", lambda k: "new")
+        event.set()
+        self._wait(1)
+        time.sleep(0.1)
+        while Gtk.events_pending():
+            Gtk.main_iteration()
+        self.assertEqual(self.results, ["new"])
+
+    def test_background_kept(self):
+        event = self._block()
+        self._put("a", lambda k: k, background=True)
+        cancel = Cancellable()
+        self._put("a", lambda k: k, cancel)
+        cancel.cancel()
+        self._put("b", lambda k: k)
+        event.set()
+        self._wait(3)
+        self.assertEqual(self.results, ["block", "b", "a"])
+
+    def test_cancel(self):
+        event = self._block()
+        cancel = Cancellable()
+        self._put("a", lambda k: k, cancel)
+        self._put("b", lambda k: k)
+        cancel.cancel()
+        event.set()
+        self._wait(2)
+        self.assertEqual(self.results, ["block", "b"])
+
+    def test_put_again_after_cancel(self):
+        event = self._block()
+        cancel = Cancellable()
+        self._put("a", lambda k: k, cancel)
+        cancel.cancel()
+        self._put("a", lambda k: k)
+        event.set()
+        self._wait(2)
+        self.assertEqual(self.results, ["block", "a"])
+
+    def test_clear(self):
+        event = self._block()
+        self._put("a", lambda k: k)
+        self.queue.clear()
+        self._put("b", lambda k: k)
+        event.set()
+        self._wait(2)
+        self.assertEqual(self.results, ["block", "b"])
+
+    def test_error(self):
+        self._put("a", lambda k: 1 / 0)
+        self._wait(1)
+        self.assertEqual(self.results, [None])
@@ -4,12 +4,13 @@
 # (at your option) any later version.
 
 from quodlibet.util.path import mtime
-from tests import TestCase, NamedTemporaryFile, get_data_path
+from tests import TestCase, NamedTemporaryFile, get_data_path, mkdtemp
 
 from gi.repository import GdkPixbuf
 from senf import fsn2uri, fsnative
 
 import os
+import shutil
 
 try:
     import hashlib as hash
@@ -117,3 +118,77 @@ class TThumb(TestCase):
         #check rights
         if os.name != "nt":
             s.failUnlessEqual(os.stat(path).st_mode, 33152)
+
+
+class TCoverThumbnails(TestCase):
+
+    def setUp(self):
+        self.temp = mkdtemp()
+        self.folder = os.path.join(self.temp, "thumbnails")
+        self.pixbuf = GdkPixbuf.Pixbuf.new(
+            GdkPixbuf.Colorspace.RGB, True, 8, 10, 20)
+        self.covers = []
+        for i in range(3):
+            path = os.path.join(self.temp, "cover%d.png" % i)
+            shutil.copy(get_data_path("test.png"), path)
+            self.covers.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def test_get_put(self):
+        cache = thumbnails.CoverThumbnails(self.folder, 1024 * 1024)
+        path = self.covers[0]
+        self.assertFalse(cache.contains(path, (10, 20)))
+        self.assertIsNone(cache.get(path, (10, 20)))
+
+        cache.put(path, (10, 20), self.pixbuf)
+        self.assertTrue(cache.contains(path, (10, 20)))
+        self.assertFalse(cache.contains(path, (20, 20)))
+        thumb = cache.get(path, (10, 20))
+        self.assertEqual((thumb.get_width(), thumb.get_height()), (10, 20))
+
+        stats = cache.stats
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["files"], 1)
+
+        # kept for the next start
+        cache = thumbnails.CoverThumbnails(self.folder, 1024 * 1024)
+        self.assertTrue(cache.get(path, (10, 20)))
+
+    def test_changed(self):
+        cache = thumbnails.CoverThumbnails(self.folder, 1024 * 1024)
+        path = self.covers[0]
+        cache.put(path, (10, 20), self.pixbuf)
+        os.utime(path, (0, 0))
+        self.assertFalse(cache.contains(path, (10, 20)))
+
+    def test_missing(self):
+        cache = thumbnails.CoverThumbnails(self.folder, 1024 * 1024)
+        path = os.path.join(self.temp, "nope.png")
+        cache.put(path, (10, 20), self.pixbuf)
+        self.assertFalse(cache.contains(path, (10, 20)))
+        self.assertIsNone(cache.get(path, (10, 20)))
+
+    def test_evict(self):
+        cache = thumbnails.CoverThumbnails(self.folder, 1024 * 1024)
+        cache.put(self.covers[0], (10, 20), self.pixbuf)
+        size = cache.stats["size"]
+
+        cache = thumbnails.CoverThumbnails(self.folder, size * 2)
+        cache.put(self.covers[1], (10, 20), self.pixbuf)
+        self.assertTrue(cache.get(self.covers[0], (10, 20)))
+        cache.put(self.covers[2], (10, 20), self.pixbuf)
+        self.assertTrue(cache.contains(self.covers[0], (10, 20)))
+        self.assertFalse(cache.contains(self.covers[1], (10, 20)))
+        self.assertTrue(cache.contains(self.covers[2], (10, 20)))
+        self.assertEqual(cache.stats["evictions"], 1)
+        self.assertEqual(len(os.listdir(self.folder)), 2)
+
+    def test_clear(self):
+        cache = thumbnails.CoverThumbnails(self.folder, 1024 * 1024)
+        cache.put(self.covers[0], (10, 20), self.pixbuf)
+        cache.clear()
+        self.assertFalse(cache.contains(self.covers[0], (10, 20)))
+        self.assertEqual(os.listdir(self.folder), [])